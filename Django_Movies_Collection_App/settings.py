@@ -48,10 +48,14 @@ CRISPY_TEMPLATE_PACK = 'bootstrap4'
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    # Above sessions, so a request that only saves its session still pins the client to the primary.
+    'movies.routing.ReplicaMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    # After authentication so ?_profile=1 can be limited to staff.
+    'movies.perf.PerfMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -89,9 +93,77 @@ DATABASES = {
         'PASSWORD': 'filiq5577',
         'USER': 'postgres',
         'PORT': 5432,
+        # Persistent connections, so the worker threads movies.aio.fetch_concurrently queries from reuse theirs.
+        'CONN_MAX_AGE': 60,
+        'CONN_HEALTH_CHECKS': True,
     }
 }
 
+# Read replicas: aliases of DATABASES mapped to their weight, e.g. {'replica1': 2, 'replica2': 1}. GET requests
+# read from one of them, picked by weight ('weighted') or by requests in flight per weight ('least_loaded').
+DATABASE_ROUTERS = ['movies.sharding.ShardRouter', 'movies.routing.ReplicaRouter']
+MOVIES_DATABASE_REPLICAS = {}
+MOVIES_REPLICA_SELECTION = 'weighted'
+# A client that wrote reads from the primary for this many seconds, so it sees its writes despite replication lag.
+MOVIES_READ_YOUR_WRITES_SECONDS = 10
+# Replicas are probed at most this often; one that fails, or lags more than MOVIES_REPLICA_MAX_LAG_SECONDS
+# (PostgreSQL only; None disables the check), is skipped for MOVIES_REPLICA_RETRY_SECONDS.
+MOVIES_REPLICA_CHECK_SECONDS = 5
+MOVIES_REPLICA_RETRY_SECONDS = 30
+MOVIES_REPLICA_MAX_LAG_SECONDS = 30
+# Aliases of DATABASES the reviews are spread over by a hash of their movie id. Append aliases to grow, then run
+# `manage.py reshard_reviews`, which also creates the table on new shards; ['default'] keeps them unsharded.
+MOVIES_REVIEW_SHARDS = ['default']
+
+# Movie and person page views are counted in memory per worker and added to the stored counts every
+# MOVIES_VIEW_FLUSH_SECONDS or once MOVIES_VIEW_BUFFER_SIZE objects are pending; a crashed worker loses at most that.
+MOVIES_VIEW_FLUSH_SECONDS = 10
+MOVIES_VIEW_BUFFER_SIZE = 1000
+
+# Deleting a genre, person or movie hides it at once; a background thread per worker (or the process_deletions
+# command, with MOVIES_DELETE_IN_BACKGROUND off) then removes it and its dependents this many rows at a time.
+MOVIES_DELETE_IN_BACKGROUND = True
+MOVIES_DELETE_BATCH_SIZE = 1000
+# Each deletion is worked on by one run at a time; one left this long without progress (a stopped worker) is taken over.
+MOVIES_DELETE_CLAIM_SECONDS = 300
+
+
+# Caches
+# https://docs.djangoproject.com/en/5.0/topics/cache/
+
+CACHES = {
+    'default': {
+        # LocMemCache evicts least recently used entries once MAX_ENTRIES is reached.
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'movies',
+        'OPTIONS': {'MAX_ENTRIES': 10000},
+    }
+}
+
+MOVIES_DETAIL_CACHE = 'default'
+MOVIES_DETAIL_CACHE_TIMEOUT = 300
+# Rendered list rows ({% rowcache %}) are keyed by version stamps, so they can live much longer.
+MOVIES_ROW_CACHE_TIMEOUT = 3600
+# Home page sections are also retired on writes; the short timeout bounds staleness after bulk imports.
+MOVIES_HOME_CACHE_TIMEOUT = 60
+
+# "Viewers also liked": similarity measure ('cosine' or 'adjusted_cosine') and neighbours kept per movie.
+# Changing either needs a `refresh_recommendations --full`.
+MOVIES_RECOMMENDATION_SIMILARITY = 'adjusted_cosine'
+MOVIES_RECOMMENDATION_NEIGHBORS = 10
+
+# Lets a Prometheus scraper read /metrics with "Authorization: Bearer <token>"; staff can always read it.
+MOVIES_METRICS_TOKEN = None
+
+# Serve filmographies from the denormalised Credit table instead of a union query.
+# Run `rebuild_credits` after switching this on.
+MOVIES_CREDITS_TABLE = False
+
+# Leaderboards: phantom ratings at the catalog mean added to every movie's average, and the half-life of a
+# review's weight in the trending score. Changing either needs a `refresh_leaderboards --full`.
+MOVIES_LEADERBOARD_PRIOR_WEIGHT = 10
+MOVIES_TRENDING_HALF_LIFE_DAYS = 3.5
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
@@ -0,0 +1,86 @@
+import asyncio
+
+from asgiref.sync import sync_to_async
+from django.db import close_old_connections, connection
+from django.http import Http404
+
+from movies.cache import detail_cache
+from movies.pagination import InvalidCursor
+
+
+def _fetch_on_own_connection(queryset):
+    try:
+        return list(queryset)
+    finally:
+        close_old_connections()
+
+
+async def fetch_concurrently(querysets):
+    """
+    Evaluates a dict of independent querysets and returns a dict of lists.
+
+    Django's async ORM still runs every query on the one thread-sensitive
+    executor, so plain gathering would not overlap anything. On PostgreSQL each
+    queryset instead gets its own worker thread and connection, kept open for
+    reuse by CONN_MAX_AGE. Without persistent connections every query would
+    pay for a new connection, inside a transaction the other connections
+    could not see its writes, and SQLite serialises access anyway, so then
+    the querysets are evaluated one after another.
+    """
+    if (connection.vendor != 'postgresql' or not connection.settings_dict['CONN_MAX_AGE']
+            or connection.in_atomic_block):
+        return {name: [obj async for obj in queryset] for name, queryset in querysets.items()}
+    results = await asyncio.gather(*(
+        sync_to_async(_fetch_on_own_connection, thread_sensitive=False)(queryset)
+        for queryset in querysets.values()
+    ))
+    return dict(zip(querysets, results))
+
+
+class AsyncKeysetListMixin:
+    """
+    Async GET for a KeysetPaginationMixin list view. The page is read with the
+    async ORM; the view's own get_context_data then builds the context from it.
+    """
+
+    async def get(self, request, *args, **kwargs):
+        self.object_list = await self.aget_queryset()
+        paginator = await self.aget_keyset_paginator(self.object_list, self.get_paginate_by(self.object_list))
+        try:
+            self.fetched_page = paginator, await paginator.apage(request.GET.get(self.cursor_kwarg))
+        except InvalidCursor:
+            raise Http404('Invalid page cursor.')
+        return self.render_to_response(self.get_context_data())
+
+    async def aget_queryset(self):
+        return self.get_queryset()
+
+    async def aget_keyset_paginator(self, queryset, page_size):
+        return self.get_keyset_paginator(queryset, page_size)
+
+    def paginate_queryset(self, queryset, page_size):
+        return self.paginated(*self.fetched_page)
+
+
+class AsyncDetailMixin:
+    """
+    Async GET for a CachedDetailMixin view. The object is read with aget() and
+    the querysets named by get_related_querysets() are fetched concurrently.
+    """
+
+    async def get(self, request, *args, **kwargs):
+        pk = kwargs[self.pk_url_kwarg]
+        context = dict(await detail_cache.aget_or_build(self.model._meta.model_name, pk, self.abuild_context))
+        self.object = context['object']
+        context['view'] = self
+        return self.render_to_response(context)
+
+    async def abuild_context(self):
+        try:
+            self.object = await self.get_queryset().aget(pk=self.kwargs[self.pk_url_kwarg])
+        except self.model.DoesNotExist:
+            raise Http404(f'No {self.model._meta.verbose_name} found matching the query')
+        related = await fetch_concurrently(self.get_related_querysets())
+        context = self.get_context_data(object=self.object, **related)
+        del context['view']
+        return context
@@ -0,0 +1,448 @@
+import hashlib
+import json
+
+from asgiref.sync import sync_to_async
+from django import forms
+from django.core.exceptions import ValidationError
+from django.forms.models import model_to_dict
+from django.http import Http404, HttpResponse, JsonResponse
+from django.shortcuts import get_object_or_404
+from django.utils.cache import get_conditional_response, quote_etag, set_response_etag
+from django.utils.http import http_date
+from django.views import View
+
+from movies.cache import detail_cache
+from movies.deletion import DELETABLE, request_deletion
+from movies.models import Award, Cast, Genre, Movie, MovieAward, Person, Review
+from movies.pagination import CursorEncoder, InvalidCursor, KeysetPaginator
+from movies.routing import replica_may_predate
+
+
+class ApiError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+class ForeignKeyInclude:
+    def __init__(self, resource_name, attname):
+        self.resource_name = resource_name
+        self.attname = attname
+
+    def load(self, objects):
+        ids = {getattr(obj, self.attname) for obj in objects} - {None}
+        return list(RESOURCES[self.resource_name].get_queryset().in_bulk(ids).values())
+
+
+class ReverseInclude:
+    def __init__(self, resource_name, attname):
+        self.resource_name = resource_name
+        self.attname = attname
+
+    def load(self, objects):
+        queryset = RESOURCES[self.resource_name].get_queryset()
+        return list(queryset.filter(**{f'{self.attname}__in': [obj.pk for obj in objects]}).order_by('pk'))
+
+
+class ManyToManyInclude:
+    def __init__(self, resource_name, through, source, target):
+        self.resource_name = resource_name
+        self.through = through
+        self.source = source
+        self.target = target
+
+    def related_ids(self, objects):
+        related = {obj.pk: [] for obj in objects}
+        links = self.through.objects.filter(**{f'{self.source}__in': list(related)}).order_by('pk')
+        for source, target in links.values_list(self.source, self.target):
+            related[source].append(target)
+        return related
+
+    def load(self, objects):
+        ids = {pk for pks in self.related_ids(objects).values() for pk in pks}
+        return list(RESOURCES[self.resource_name].get_queryset().in_bulk(ids).values())
+
+
+class Resource:
+    """
+    A model exposed through the JSON API. `fields` are the attributes a client
+    may select with ?fields=, `includes` the relations it may ask for with
+    ?include=; each included relation costs one query per page, never one per
+    object.
+    """
+
+    model = None
+    fields = ()
+    many_to_many = {}
+    includes = {}
+    filters = ()
+    write_fields = ()
+    # Detail-cache stamp covering every row the representation depends on, together with the
+    # includes whose rows it also covers.
+    stamp = None
+    stamped_includes = ()
+
+    def get_queryset(self):
+        return self.model.objects.all()
+
+    def selected_fields(self, request):
+        requested = request.GET.get('fields')
+        if not requested:
+            return list(self.fields)
+        selected = [name.strip() for name in requested.split(',') if name.strip()]
+        unknown = set(selected) - set(self.fields)
+        if unknown:
+            raise ApiError(400, f'Unknown field(s): {", ".join(sorted(unknown))}.')
+        return ['id'] + [name for name in selected if name != 'id']
+
+    def selected_includes(self, request):
+        requested = [name.strip() for name in request.GET.get('include', '').split(',') if name.strip()]
+        unknown = set(requested) - set(self.includes)
+        if unknown:
+            raise ApiError(400, f'Unknown include(s): {", ".join(sorted(unknown))}.')
+        return requested
+
+    def columns(self, fields, includes=()):
+        columns = [self.model._meta.get_field(name).attname for name in fields if name not in self.many_to_many]
+        # Foreign key includes read their key from the primary rows, so it must not be deferred.
+        columns += [self.includes[name].attname for name in includes
+                    if isinstance(self.includes[name], ForeignKeyInclude)]
+        return columns
+
+    def filter(self, queryset, request):
+        for name in self.filters:
+            value = request.GET.get(name)
+            if value is None:
+                continue
+            field = self.model._meta.get_field(name)
+            try:
+                value = (field.target_field if field.is_relation else field).to_python(value)
+            except ValidationError:
+                raise ApiError(400, f'Invalid value for {name}.')
+            queryset = queryset.filter(**{field.attname: value})
+        return queryset
+
+    def serialize(self, objects, fields):
+        related = {name: include.related_ids(objects) for name, include in self.many_to_many.items() if name in fields}
+        rows = []
+        for obj in objects:
+            row = {}
+            for name in fields:
+                if name in related:
+                    row[name] = related[name][obj.pk]
+                else:
+                    row[name] = getattr(obj, self.model._meta.get_field(name).attname)
+            rows.append(row)
+        return rows
+
+    def included(self, objects, names):
+        included = {}
+        for name in names:
+            include = self.includes[name]
+            resource = RESOURCES[include.resource_name]
+            rows = included.setdefault(include.resource_name, {})
+            for row in resource.serialize(include.load(objects), list(resource.fields)):
+                rows[row['id']] = row
+        return {name: list(rows.values()) for name, rows in included.items()}
+
+    def is_stamped(self, request):
+        return self.stamp is not None and set(self.selected_includes(request)) <= set(self.stamped_includes)
+
+    def before_save(self, request, instance):
+        pass
+
+
+class MovieResource(Resource):
+    model = Movie
+    fields = ('id', 'title', 'description', 'release_year', 'duration_minutes', 'genre', 'directors',
+              'rating_count', 'rating_avg', 'rating_histogram')
+    many_to_many = {'directors': ManyToManyInclude('persons', Movie.directors.through, 'movie_id', 'person_id')}
+    includes = {
+        'genre': ForeignKeyInclude('genres', 'genre_id'),
+        'directors': many_to_many['directors'],
+        'cast': ReverseInclude('casts', 'movie_id'),
+        'awards': ReverseInclude('movie-awards', 'movie_id'),
+        'reviews': ReverseInclude('reviews', 'movie_id'),
+    }
+    filters = ('genre', 'release_year')
+    write_fields = ('title', 'description', 'release_year', 'duration_minutes', 'genre', 'directors')
+    stamp = 'movie'
+    stamped_includes = ('genre', 'directors', 'cast', 'awards', 'reviews')
+
+
+class PersonResource(Resource):
+    model = Person
+    fields = ('id', 'first_name', 'last_name', 'birth_date', 'death_date', 'role')
+    includes = {
+        'directed_movies': ManyToManyInclude('movies', Movie.directors.through, 'person_id', 'movie_id'),
+        'cast': ReverseInclude('casts', 'person_id'),
+    }
+    filters = ('role',)
+    write_fields = ('first_name', 'last_name', 'birth_date', 'death_date', 'role')
+    stamp = 'person'
+    # Included movies carry their ratings and directors, which do not touch the person's stamp.
+    stamped_includes = ('cast',)
+
+
+class GenreResource(Resource):
+    model = Genre
+    fields = ('id', 'name')
+    write_fields = ('name',)
+
+
+class CastResource(Resource):
+    model = Cast
+    fields = ('id', 'movie', 'person', 'role_name')
+    includes = {
+        'movie': ForeignKeyInclude('movies', 'movie_id'),
+        'person': ForeignKeyInclude('persons', 'person_id'),
+    }
+    filters = ('movie', 'person')
+    write_fields = ('movie', 'person', 'role_name')
+
+    def get_queryset(self):
+        return Cast.objects.filter(movie__pending_delete=False, person__pending_delete=False)
+
+
+class AwardResource(Resource):
+    model = Award
+    fields = ('id', 'name')
+    includes = {'movie_awards': ReverseInclude('movie-awards', 'award_id')}
+    write_fields = ('name',)
+    stamp = 'award'
+    stamped_includes = ('movie_awards',)
+
+
+class MovieAwardResource(Resource):
+    model = MovieAward
+    fields = ('id', 'movie', 'award', 'category')
+    includes = {
+        'movie': ForeignKeyInclude('movies', 'movie_id'),
+        'award': ForeignKeyInclude('awards', 'award_id'),
+    }
+    filters = ('movie', 'award')
+    write_fields = ('movie', 'award', 'category')
+
+    def get_queryset(self):
+        return MovieAward.objects.filter(movie__pending_delete=False)
+
+
+class ReviewResource(Resource):
+    model = Review
+    fields = ('id', 'movie', 'user', 'rating', 'text', 'created_at')
+    includes = {'movie': ForeignKeyInclude('movies', 'movie_id')}
+    filters = ('movie', 'user')
+    write_fields = ('movie', 'rating', 'text')
+
+    def get_queryset(self):
+        return Review.objects.live()
+
+    def before_save(self, request, instance):
+        if instance.user_id is None:
+            instance.user = request.user
+
+
+RESOURCES = {
+    'movies': MovieResource(),
+    'persons': PersonResource(),
+    'genres': GenreResource(),
+    'casts': CastResource(),
+    'awards': AwardResource(),
+    'movie-awards': MovieAwardResource(),
+    'reviews': ReviewResource(),
+}
+
+
+class ApiView(View):
+    http_method_names = ['get', 'post', 'put', 'patch', 'delete', 'head', 'options']
+    default_limit = 25
+    max_limit = 100
+
+    def dispatch(self, request, *args, **kwargs):
+        if kwargs['resource'] not in RESOURCES:
+            raise Http404('Unknown resource.')
+        self.resource = RESOURCES[kwargs['resource']]
+        try:
+            return super().dispatch(request, *args, **kwargs)
+        except ApiError as error:
+            return JsonResponse({'error': error.message}, status=error.status)
+
+    def json_response(self, payload, status=200):
+        return JsonResponse(payload, status=status, encoder=CursorEncoder)
+
+    def get(self, request, resource, pk=None):
+        if pk is None:
+            return self.conditional(request, self.get_list(request))
+        validators = self.stamped_validators(request, pk)
+        if validators is None:
+            return self.conditional(request, self.get_detail(request, pk))
+        etag, last_modified = validators
+        not_modified = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if not_modified is not None:
+            return not_modified
+        return self.stamped(self.get_detail(request, pk), etag, last_modified)
+
+    def stamped_validators(self, request, pk):
+        # Stamped resources answer revalidation from the cache alone, without touching the database. A body
+        # read from a replica that may predate the stamp gets a content ETag instead, so it is never tagged as
+        # that version.
+        if not self.resource.is_stamped(request):
+            return None
+        version, last_modified = detail_cache.validators(self.resource.stamp, pk)
+        if replica_may_predate(last_modified):
+            return None
+        etag = quote_etag(hashlib.md5(f'{version}|{request.get_full_path()}'.encode()).hexdigest())
+        return etag, last_modified
+
+    def stamped(self, response, etag, last_modified):
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(last_modified)
+        return response
+
+    def conditional(self, request, response):
+        set_response_etag(response)
+        return get_conditional_response(request, etag=response['ETag'], response=response)
+
+    def list_paginator(self, request):
+        fields = self.resource.selected_fields(request)
+        includes = self.resource.selected_includes(request)
+        try:
+            limit = min(max(int(request.GET.get('limit', self.default_limit)), 1), self.max_limit)
+        except ValueError:
+            raise ApiError(400, 'Invalid limit.')
+        queryset = self.resource.filter(self.resource.get_queryset(), request)
+        queryset = queryset.only(*self.resource.columns(fields, includes))
+        return KeysetPaginator(queryset, ('pk',), limit), fields, includes
+
+    def list_payload(self, page, fields, includes):
+        payload = {'results': self.resource.serialize(page.object_list, fields), 'next': page.next_cursor}
+        if includes:
+            payload['included'] = self.resource.included(page.object_list, includes)
+        return payload
+
+    def get_list(self, request):
+        paginator, fields, includes = self.list_paginator(request)
+        try:
+            page = paginator.page(request.GET.get('cursor'))
+        except InvalidCursor:
+            raise ApiError(400, 'Invalid cursor.')
+        return self.json_response(self.list_payload(page, fields, includes))
+
+    def detail_queryset(self, request):
+        fields = self.resource.selected_fields(request)
+        includes = self.resource.selected_includes(request)
+        return self.resource.get_queryset().only(*self.resource.columns(fields, includes)), fields, includes
+
+    def detail_payload(self, obj, fields, includes):
+        payload = {'data': self.resource.serialize([obj], fields)[0]}
+        if includes:
+            payload['included'] = self.resource.included([obj], includes)
+        return payload
+
+    def get_detail(self, request, pk):
+        queryset, fields, includes = self.detail_queryset(request)
+        obj = get_object_or_404(queryset, pk=pk)
+        return self.json_response(self.detail_payload(obj, fields, includes))
+
+    def read_payload(self, request):
+        if not request.user.is_authenticated:
+            raise ApiError(401, 'Authentication required.')
+        try:
+            payload = json.loads(request.body or b'{}')
+        except ValueError:
+            raise ApiError(400, 'Request body must be JSON.')
+        if not isinstance(payload, dict):
+            raise ApiError(400, 'Request body must be a JSON object.')
+        return payload
+
+    def save(self, request, data, instance=None, status=200):
+        form_class = forms.modelform_factory(self.resource.model, fields=self.resource.write_fields)
+        form = form_class(data=data, instance=instance)
+        if not form.is_valid():
+            return self.json_response({'errors': form.errors.get_json_data()}, status=400)
+        obj = form.save(commit=False)
+        self.resource.before_save(request, obj)
+        obj.save()
+        form.save_m2m()
+        return self.json_response({'data': self.resource.serialize([obj], list(self.resource.fields))[0]}, status)
+
+    def post(self, request, resource, pk=None):
+        if pk is not None:
+            return HttpResponse(status=405)
+        return self.save(request, self.read_payload(request), status=201)
+
+    def put(self, request, resource, pk=None):
+        payload = self.read_payload(request)
+        return self.save(request, payload, self.get_instance(pk))
+
+    def patch(self, request, resource, pk=None):
+        payload = self.read_payload(request)
+        instance = self.get_instance(pk)
+        current = model_to_dict(instance, fields=self.resource.write_fields)
+        for name, value in current.items():
+            if isinstance(value, list):
+                current[name] = [getattr(item, 'pk', item) for item in value]
+        return self.save(request, {**current, **payload}, instance)
+
+    def delete(self, request, resource, pk=None):
+        if not request.user.is_authenticated:
+            raise ApiError(401, 'Authentication required.')
+        instance = self.get_instance(pk)
+        if type(instance) in DELETABLE.values():
+            request_deletion(instance)
+        else:
+            instance.delete()
+        return HttpResponse(status=204)
+
+    def get_instance(self, pk):
+        if pk is None:
+            raise ApiError(405, 'Method not allowed on a collection.')
+        return get_object_or_404(self.resource.get_queryset(), pk=pk)
+
+
+class AsyncApiView(ApiView):
+    """
+    Read-only async variant of ApiView: primary rows are read with the async ORM,
+    and many-to-many ids and includes are then loaded in one sync hop.
+    """
+
+    http_method_names = ['get', 'head', 'options']
+
+    def dispatch(self, request, *args, **kwargs):
+        return self.handle_errors(super().dispatch(request, *args, **kwargs))
+
+    async def handle_errors(self, response):
+        try:
+            return await response
+        except ApiError as error:
+            return JsonResponse({'error': error.message}, status=error.status)
+
+    async def get(self, request, resource, pk=None):
+        if pk is None:
+            return self.conditional(request, await self.aget_list(request))
+        validators = await sync_to_async(self.stamped_validators)(request, pk)
+        if validators is None:
+            return self.conditional(request, await self.aget_detail(request, pk))
+        etag, last_modified = validators
+        not_modified = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if not_modified is not None:
+            return not_modified
+        return self.stamped(await self.aget_detail(request, pk), etag, last_modified)
+
+    async def aget_list(self, request):
+        # Building the queryset may query too: sharded reviews read the movies pending deletion first.
+        paginator, fields, includes = await sync_to_async(self.list_paginator)(request)
+        try:
+            page = await paginator.apage(request.GET.get('cursor'))
+        except InvalidCursor:
+            raise ApiError(400, 'Invalid cursor.')
+        return self.json_response(await sync_to_async(self.list_payload)(page, fields, includes))
+
+    async def aget_detail(self, request, pk):
+        queryset, fields, includes = await sync_to_async(self.detail_queryset)(request)
+        try:
+            obj = await queryset.aget(pk=pk)
+        except self.resource.model.DoesNotExist:
+            raise Http404('No such object.')
+        return self.json_response(await sync_to_async(self.detail_payload)(obj, fields, includes))
@@ -0,0 +1,221 @@
+import bisect
+import heapq
+import threading
+from collections import defaultdict
+
+from django.contrib.postgres.search import TrigramSimilarity
+from django.db import connection, transaction
+from django.db.models import Q, Value
+from django.db.models.functions import Concat
+
+from movies.models import Genre, Movie, Person
+from movies.search import tokenize
+
+
+def trigrams(text):
+    grams = set()
+    for word in tokenize(text):
+        padded = f'  {word} '
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+class NgramIndex:
+    """
+    In-process trigram index used when pg_trgm is not available. Word-prefix
+    matches (found by bisecting a sorted word list) rank first; the rest are
+    ranked by the trigram overlap ratio that pg_trgm's similarity() uses.
+    """
+
+    candidate_cap = 2000
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.grams = defaultdict(set)
+        self.sizes = {}
+        self.words = {}
+        self.word_list = []
+
+    def add(self, pk, label):
+        with self.lock:
+            self.remove(pk)
+            grams = trigrams(label)
+            words = tuple(tokenize(label))
+            self.sizes[pk] = len(grams)
+            self.words[pk] = words
+            for gram in grams:
+                self.grams[gram].add(pk)
+            for word in set(words):
+                bisect.insort(self.word_list, (word, pk))
+
+    def bulk_load(self, items):
+        with self.lock:
+            for pk, label in items:
+                words = tuple(tokenize(label))
+                grams = trigrams(label)
+                self.sizes[pk] = len(grams)
+                self.words[pk] = words
+                for gram in grams:
+                    self.grams[gram].add(pk)
+                self.word_list.extend((word, pk) for word in set(words))
+            self.word_list.sort()
+
+    def remove(self, pk):
+        with self.lock:
+            words = self.words.pop(pk, None)
+            if words is None:
+                return
+            del self.sizes[pk]
+            for gram in trigrams(' '.join(words)):
+                pks = self.grams.get(gram)
+                if pks is not None:
+                    pks.discard(pk)
+                    if not pks:
+                        del self.grams[gram]
+            for word in set(words):
+                position = bisect.bisect_left(self.word_list, (word, pk))
+                if position < len(self.word_list) and self.word_list[position] == (word, pk):
+                    del self.word_list[position]
+
+    def prefix_matches(self, prefix):
+        position = bisect.bisect_left(self.word_list, (prefix,))
+        matches = set()
+        while position < len(self.word_list) and len(matches) < self.candidate_cap:
+            word, pk = self.word_list[position]
+            if not word.startswith(prefix):
+                break
+            matches.add(pk)
+            position += 1
+        return matches
+
+    def similarity(self, query_grams, pk):
+        shared = sum(1 for gram in query_grams if pk in self.grams.get(gram, ()))
+        return shared / (len(query_grams) + self.sizes[pk] - shared)
+
+    def fuzzy_matches(self, query_grams):
+        postings = sorted((self.grams.get(gram, set()) for gram in query_grams), key=len)
+        shared = defaultdict(int)
+        for pks in postings:
+            # Very common trigrams say little about the match; skip them once rarer ones found candidates.
+            if shared and len(pks) > self.candidate_cap:
+                break
+            for pk in pks:
+                shared[pk] += 1
+        return {pk: count / (len(query_grams) + self.sizes[pk] - count) for pk, count in shared.items()}
+
+    def search(self, query, limit):
+        tokens = tokenize(query)
+        if not tokens:
+            return []
+        query_grams = trigrams(query)
+        with self.lock:
+            scored = {}
+            for pk in self.prefix_matches(tokens[-1]):
+                words = self.words[pk]
+                if all(any(word.startswith(token) for word in words) for token in tokens[:-1]):
+                    scored[pk] = 1 + self.similarity(query_grams, pk)
+            if len(scored) < limit:
+                for pk, score in self.fuzzy_matches(query_grams).items():
+                    scored.setdefault(pk, score)
+        best = heapq.nlargest(limit, scored.items(), key=lambda item: (item[1], -item[0]))
+        return [pk for pk, score in best]
+
+
+class AutocompleteSource:
+    model = None
+    search_fields = ()
+    ordering = ('pk',)
+
+    def __init__(self):
+        self.index = None
+        self.lock = threading.Lock()
+
+    def label(self, obj):
+        return str(obj)
+
+    def get_queryset(self, params):
+        return self.model.objects.all()
+
+    def search(self, query, params, limit):
+        queryset = self.get_queryset(params)
+        if connection.vendor == 'postgresql':
+            return self.search_database(queryset, query, limit)
+        return self.search_index(queryset, query, limit)
+
+    def search_database(self, queryset, query, limit):
+        for word in tokenize(query):
+            match = Q()
+            for field in self.search_fields:
+                match |= Q(**{f'{field}__icontains': word})
+            queryset = queryset.filter(match)
+        label = Concat(*[part for field in self.search_fields for part in (field, Value(' '))][:-1])
+        queryset = queryset.annotate(similarity=TrigramSimilarity(label, query))
+        return list(queryset.order_by('-similarity', 'pk')[:limit])
+
+    def get_index(self):
+        if self.index is None:
+            with self.lock:
+                if self.index is None:
+                    index = NgramIndex()
+                    objects = self.model.objects.only(*self.search_fields).iterator(chunk_size=2000)
+                    index.bulk_load((obj.pk, self.label(obj)) for obj in objects)
+                    self.index = index
+        return self.index
+
+    def search_index(self, queryset, query, limit):
+        # Over-fetch so that filters applied by the queryset (e.g. role) still leave enough matches.
+        candidates = self.get_index().search(query, limit * 5)
+        objects = queryset.in_bulk(candidates)
+        return [objects[pk] for pk in candidates if pk in objects][:limit]
+
+    def update(self, obj):
+        index = self.index
+        if index is not None:
+            pk, label = obj.pk, self.label(obj)
+            transaction.on_commit(lambda: index.add(pk, label))
+
+    def remove(self, pk):
+        index = self.index
+        if index is not None:
+            transaction.on_commit(lambda: index.remove(pk))
+
+
+class PersonSource(AutocompleteSource):
+    model = Person
+    search_fields = ('first_name', 'last_name')
+    ordering = ('last_name', 'first_name', 'pk')
+
+    def get_queryset(self, params):
+        role = params.get('role')
+        if role == 'actor':
+            return Person.objects.filter(role__in=['actor', 'both'])
+        if role == 'director':
+            return Person.objects.filter(role__in=['director', 'both'])
+        return Person.objects.all()
+
+
+class MovieSource(AutocompleteSource):
+    model = Movie
+    search_fields = ('title',)
+    ordering = ('title', 'pk')
+
+    def label(self, obj):
+        return obj.title
+
+
+class GenreSource(AutocompleteSource):
+    model = Genre
+    search_fields = ('name',)
+    ordering = ('name', 'pk')
+
+
+SOURCES = {
+    'person': PersonSource(),
+    'movie': MovieSource(),
+    'genre': GenreSource(),
+}
+
+
+def reset_indexes():
+    for source in SOURCES.values():
+        source.index = None
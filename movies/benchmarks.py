@@ -0,0 +1,574 @@
+import itertools
+import os
+import platform
+import random
+import statistics
+import subprocess
+import time
+
+import django
+from django.contrib.auth.models import AnonymousUser, User
+from django.db.models import Count
+from django.db import connection, transaction
+from django.test import Client, RequestFactory, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from movies.api import ApiView
+from movies.autocomplete import SOURCES
+from movies.casting import ACTOR_ROLES
+from movies.catalog import CatalogExporter
+from movies.deletion import request_deletion, run_deletion
+from movies.facets import FacetIndex, FacetSelection
+from movies.filmography import filmography, rebuild_credits
+from movies.generator import VOCABULARY
+from movies.models import Award, Cast, Genre, Movie, Person, Review
+from movies.pagination import KeysetPaginator
+from movies.popularity import ViewCounter, get_view_counter
+from movies.search import get_search_backend
+from movies.views import MovieDetailView, PersonDetailView
+
+SUITES = {}
+
+
+def suite(name):
+    def register(func):
+        SUITES[name] = func
+        return func
+    return register
+
+
+def measure(name, func, repeat=5, setup=None):
+    # setup() runs untimed before every call and its result is passed to func.
+    timings = []
+    for _ in range(repeat):
+        args = (setup(),) if setup else ()
+        start = time.perf_counter()
+        func(*args)
+        timings.append((time.perf_counter() - start) * 1000)
+    return {
+        'name': name,
+        'min_ms': round(min(timings), 3),
+        'median_ms': round(statistics.median(timings), 3),
+        'max_ms': round(max(timings), 3),
+    }
+
+
+def proc_status_kib(field):
+    with open('/proc/self/status') as status:
+        for line in status:
+            if line.startswith(f'{field}:'):
+                return int(line.split()[1])
+    raise LookupError(field)
+
+
+def peak_rss_kib(func):
+    """
+    How far the resident set size rises while func runs, which unlike
+    tracemalloc counts the database driver's buffers too. func runs in a
+    forked child, so memory that earlier work left this process holding
+    cannot absorb it; the child shares the open transaction, and its rows,
+    while the parent waits. Linux only (the peak is read from /proc), None
+    elsewhere.
+    """
+    if not hasattr(os, 'fork') or not os.path.exists('/proc/self/clear_refs'):
+        return None
+    read_end, write_end = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        code = 1
+        try:
+            os.close(read_end)
+            # Resets VmHWM, the peak RSS, to the current RSS.
+            with open('/proc/self/clear_refs', 'w') as clear_refs:
+                clear_refs.write('5')
+            start = proc_status_kib('VmRSS')
+            func()
+            os.write(write_end, str(proc_status_kib('VmHWM') - start).encode())
+            code = 0
+        finally:
+            # Skips interpreter shutdown, which would close the database connection the parent goes on using.
+            os._exit(code)
+    os.close(write_end)
+    with os.fdopen(read_end) as pipe:
+        output = pipe.read()
+    os.waitpid(pid, 0)
+    return int(output) if output else None
+
+
+def words(rng, count):
+    # Squared uniform draws skew towards the start of the vocabulary, like real word frequencies.
+    return ' '.join(VOCABULARY[int(len(VOCABULARY) * rng.random() ** 2)] for _ in range(count))
+
+
+def seed_movies(count, batch_size=5000):
+    rng = random.Random(count)
+    genre = Genre.objects.create(name='Benchmark')
+    for start in range(0, count, batch_size):
+        Movie.objects.bulk_create(
+            Movie(title=f'{words(rng, 3).title()} {i}', description=words(rng, 20),
+                  release_year=1900 + i % 125, duration_minutes=80 + i % 100, genre=genre)
+            for i in range(start, min(start + batch_size, count))
+        )
+
+
+@suite('pagination')
+def pagination_suite(repeat, per_page=25):
+    results = []
+    queryset = Movie.objects.all()
+    total = queryset.count()
+    for label, ordering in (('title', ('title', 'pk')), ('release_year', ('release_year', 'pk'))):
+        paginator = KeysetPaginator(queryset, ordering, per_page)
+        for fraction in (0, 0.1, 0.5, 0.9):
+            offset = int(total * fraction)
+            anchor = queryset.order_by(*paginator.ordering)[offset:offset + 1].first() if offset else None
+            cursor = paginator.cursor_for(anchor) if anchor else None
+            results.append(measure(f'keyset {label} @ {offset}', lambda: paginator.page(cursor), repeat))
+            results.append(measure(
+                f'offset {label} @ {offset}',
+                lambda: list(queryset.order_by(*paginator.ordering)[offset:offset + per_page]),
+                repeat,
+            ))
+    return results
+
+
+@suite('search')
+def search_suite(repeat, per_page=25):
+    backend = get_search_backend()
+    backend.search(Movie.objects.all(), 'warmup').exists()
+    results = []
+    for query in ('night', 'storm river', 'frozen crown', 'burning silver echo', 'nonexistentword'):
+        def run():
+            return backend.get_paginator(Movie.objects.all(), query, per_page).page()
+        results.append(measure(f'search {query!r}', run, repeat))
+    return results
+
+
+@suite('autocomplete')
+def autocomplete_suite(repeat, limit=10):
+    source = SOURCES['movie']
+    source.search('warmup', {}, limit)
+    return [
+        measure(f'autocomplete movie {query!r}', lambda: source.search(query, {}, limit), repeat)
+        for query in ('st', 'sto', 'storm', 'frozen cro', 'burnng')
+    ]
+
+
+@suite('export')
+def export_suite(repeat, sizes=(1000, 10000, 100000)):
+    # Grows the table 100x (inside the benchmark's rolled-back transaction) to show peak RSS stays flat.
+    exporter = CatalogExporter()
+    results = []
+    for size in sizes:
+        missing = size - Movie.objects.count()
+        if missing > 0:
+            seed_movies(missing)
+
+        def run():
+            for line in exporter.render('movies', 'jsonl'):
+                pass
+        result = measure(f'export movies @ {size}', run, repeat)
+        result['peak_rss_kib'] = peak_rss_kib(run)
+        results.append(result)
+    return results
+
+
+def render_view(view, path, **kwargs):
+    request = RequestFactory().get(path)
+    request.user = AnonymousUser()
+    response = view(request, **kwargs)
+    if hasattr(response, 'render'):
+        response.render()
+    return response.content
+
+
+DUMMY_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}}
+
+
+@suite('api')
+@override_settings(CACHES=DUMMY_CACHES)
+def api_suite(repeat):
+    # Compares building the movie detail HTML page with the API's JSON for the same object, both uncached.
+    movie = Movie.objects.annotate(cast_count=Count('cast')).order_by('-cast_count', 'pk').first()
+    if movie is None:
+        return []
+    html_view = MovieDetailView.as_view()
+    api_view = ApiView.as_view()
+    variants = [
+        ('html movie_detail', html_view, f'/movies/{movie.pk}/', {'pk': movie.pk}),
+        ('api movie', api_view, f'/api/movies/{movie.pk}/', {'resource': 'movies', 'pk': movie.pk}),
+        ('api movie ?fields=title,rating_avg', api_view, f'/api/movies/{movie.pk}/?fields=title,rating_avg',
+         {'resource': 'movies', 'pk': movie.pk}),
+        ('api movie ?include=cast,awards', api_view, f'/api/movies/{movie.pk}/?include=cast,awards',
+         {'resource': 'movies', 'pk': movie.pk}),
+    ]
+    results = []
+    for label, view, path, kwargs in variants:
+        result = measure(label, lambda: render_view(view, path, **kwargs), repeat)
+        result['bytes'] = len(render_view(view, path, **kwargs))
+        results.append(result)
+    return results
+
+
+# Median time allowed for rendering a 500-credit person page uncached; most of it is template rendering.
+FILMOGRAPHY_TARGET_MS = 100
+
+
+@suite('filmography')
+@override_settings(CACHES=DUMMY_CACHES)
+def filmography_suite(repeat, credits=500):
+    # A person with `credits` credits, half directing and half acting, rendered from the union and the Credit table.
+    genre = Genre.objects.create(name='Filmography benchmark')
+    person = Person.objects.create(first_name='Prolific', last_name='Benchmark', birth_date='1950-01-01', role='both')
+    movies = Movie.objects.bulk_create(
+        Movie(title=f'Credit {i}', description='', release_year=1950 + i % 75, duration_minutes=90, genre=genre)
+        for i in range(credits)
+    )
+    person.directed_movies.add(*movies[:credits // 2])
+    Cast.objects.bulk_create(Cast(movie=movie, person=person, role_name=f'Role {i}')
+                             for i, movie in enumerate(movies[credits // 2:]))
+    view = PersonDetailView.as_view()
+    results = []
+    for label, table in (('union', False), ('credits table', True)):
+        with override_settings(MOVIES_CREDITS_TABLE=table):
+            if table:
+                rebuild_credits([person.pk])
+            results.append(measure(f'filmography query {label} @ {credits} credits',
+                                   lambda: list(filmography(person)), repeat))
+            result = measure(f'person_detail {label} @ {credits} credits',
+                             lambda: render_view(view, f'/persons/{person.pk}/', pk=person.pk), repeat)
+            with CaptureQueriesContext(connection) as queries:
+                render_view(view, f'/persons/{person.pk}/', pk=person.pk)
+            result['queries'] = len(queries)
+            result['target_ms'] = FILMOGRAPHY_TARGET_MS
+            result['within_target'] = result['median_ms'] <= FILMOGRAPHY_TARGET_MS
+            results.append(result)
+    return results
+
+
+# Median time allowed for counting every facet of the movie list under one selection, at a million movies.
+FACETS_TARGET_MS = 50
+
+
+@suite('facets')
+def facets_suite(repeat):
+    results = [measure('facet index build', FacetIndex.build, 1)]
+    index = FacetIndex.build()
+    counts = index.counts(FacetSelection())
+
+    def most_common(name):
+        return [max(counts[name], key=counts[name].get)] if counts[name] else []
+
+    genre, decade, director, award = (most_common(name) for name in ('genre', 'decade', 'director', 'award'))
+    selections = {
+        'none': FacetSelection(),
+        'genre': FacetSelection({'genre': genre}),
+        'genre decade duration': FacetSelection({'genre': genre, 'decade': decade, 'duration': ['90-120']}),
+        'director min_rating': FacetSelection({'director': director}, 7),
+        'award': FacetSelection({'award': award}),
+        'min_rating': FacetSelection(min_rating=8),
+    }
+    for label, selection in selections.items():
+        result = measure(f'facet counts {label} @ {len(index.ids)} movies',
+                         lambda: index.counts(selection), repeat)
+        result['target_ms'] = FACETS_TARGET_MS
+        result['within_target'] = result['median_ms'] <= FACETS_TARGET_MS
+        results.append(result)
+    return results
+
+
+def fetch(client, method, path, data=None, expected=200):
+    response = getattr(client, method)(path, data)
+    if response.status_code != expected:
+        form = (getattr(response, 'context_data', None) or {}).get('form')
+        errors = f' {form.errors.as_text()}' if form is not None and form.errors else ''
+        raise RuntimeError(f'{method.upper()} {path} returned {response.status_code}, expected {expected}.{errors}')
+    return response
+
+
+def measure_request(name, client, method, target, repeat, expected=200):
+    # target() returns the path and form data of one request. It runs untimed, so a write can get a fresh object.
+    def run(request):
+        fetch(client, method, *request, expected=expected)
+    # One untimed request first, so lazily built indexes and connection setup do not land in the timings.
+    run(target())
+    result = measure(name, run, repeat, setup=target)
+    request = target()
+    with CaptureQueriesContext(connection) as queries:
+        run(request)
+    result['queries'] = len(queries)
+    return result
+
+
+@suite('views')
+@override_settings(CACHES=DUMMY_CACHES, ALLOWED_HOSTS=['testserver'])
+def views_suite(repeat):
+    # Every page through the full middleware stack, uncached, signed in as staff. Writes are rolled back with the run.
+    movie = Movie.objects.order_by('-rating_count', 'pk').first()
+    if movie is None:
+        return []
+    typical = Movie.objects.order_by('pk')[Movie.objects.count() // 2]
+    person = Person.objects.annotate(credit_count=Count('cast')).order_by('-credit_count', 'pk').first()
+    actor = Person.objects.filter(role__in=[Person.ACTOR, Person.BOTH]).order_by('pk').first()
+    director = Person.objects.filter(role__in=[Person.DIRECTOR, Person.BOTH]).order_by('pk').first()
+    award = Award.objects.order_by('pk').first()
+    user, _ = User.objects.get_or_create(username='benchmark', defaults={'is_staff': True})
+    review = Review.objects.create(user=user, movie=typical, rating=6, text='Benchmark review')
+    client = Client()
+    client.force_login(user)
+    counter = itertools.count()
+
+    reads = [
+        ('home', reverse('home')),
+        ('movie_list', reverse('movie_list')),
+        ('movie_list ?sort_by=rating', reverse('movie_list') + '?sort_by=rating'),
+        ('movie_list ?sort_by=release_year', reverse('movie_list') + '?sort_by=release_year'),
+        ('review_list', reverse('review_list')),
+        ('person_list', reverse('person_list')),
+        ('genre_list', reverse('genre_list')),
+        ('award_list', reverse('award_list')),
+        ('movie_detail most reviewed', reverse('movie_detail', args=[movie.pk])),
+        ('movie_detail typical', reverse('movie_detail', args=[typical.pk])),
+        ('person_detail most cast', reverse('person_detail', args=[person.pk])),
+        ('movie_list faceted', reverse('movie_list') + f'?genre={typical.genre_id}&min_rating=7'),
+        ('search night', reverse('movie_list') + '?q=night'),
+        ('search storm river', reverse('movie_list') + '?q=storm+river'),
+        ('autocomplete movie sto', reverse('autocomplete', args=['movie']) + '?q=sto'),
+        ('api movies', reverse('api_list', args=['movies'])),
+        ('api movie', reverse('api_detail', args=['movies', movie.pk])),
+    ]
+    if award is not None:
+        reads.append(('award_detail', reverse('award_detail', args=[award.pk])))
+    results = [
+        measure_request(f'GET {name}', client, 'get', lambda path=path: (path, None), repeat) for name, path in reads
+    ]
+
+    def movie_data():
+        return {'title': f'Benchmark {next(counter)}', 'description': 'Benchmark', 'release_year': 2000,
+                'duration_minutes': 100, 'genre': typical.genre_id, 'directors': [director.pk] if director else []}
+
+    def new_movie():
+        created = Movie.objects.create(title='Benchmark', description='', release_year=2000, duration_minutes=90,
+                                       genre_id=typical.genre_id)
+        return reverse('movie_delete', args=[created.pk]), None
+
+    def new_review():
+        created = Review.objects.create(user=user, movie=movie, rating=5, text='Benchmark')
+        return reverse('review_delete', args=[created.pk]), None
+
+    writes = [
+        ('movie_add', lambda: (reverse('movie_add'), movie_data())),
+        ('movie_edit', lambda: (reverse('movie_edit', args=[typical.pk]), movie_data())),
+        ('movie_delete', new_movie),
+        ('review_add most reviewed', lambda: (
+            reverse('review_add'), {'movie': movie.pk, 'rating': 7, 'text': 'Benchmark'})),
+        ('review_edit', lambda: (reverse('review_edit', args=[review.pk]),
+                                 {'movie': typical.pk, 'rating': 1 + next(counter) % 10, 'text': 'Benchmark'})),
+        ('review_delete most reviewed', new_review),
+    ]
+    if actor is not None:
+        writes.append(('cast_add', lambda: (
+            f"{reverse('cast_add')}?movie={typical.pk}",
+            {'movie': typical.pk, 'person': actor.pk, 'role_name': f'Extra {next(counter)}'})))
+    results += [
+        measure_request(f'POST {name}', client, 'post', target, repeat, expected=302) for name, target in writes
+    ]
+    return results
+
+
+@suite('view_counts')
+@override_settings(CACHES=DUMMY_CACHES, ALLOWED_HOSTS=['testserver'])
+def view_counts_suite(repeat, objects=1000):
+    # Detail page latency with views buffered, compared with writing every view through as it happens, and the
+    # cost of one flush. The benchmark command raises the thresholds, so no background flush runs meanwhile.
+    movie = Movie.objects.order_by('pk').first()
+    if movie is None:
+        return []
+    client = Client()
+    path = reverse('movie_detail', args=[movie.pk])
+    counter = get_view_counter()
+    results = [
+        measure('record 10000 views', lambda: [counter.record(Movie, pk) for pk in range(10000)], repeat),
+        measure_request('GET movie_detail buffered', client, 'get', lambda: (path, None), repeat),
+    ]
+
+    def write_through(request):
+        fetch(client, 'get', *request)
+        counter.flush()
+
+    result = measure('GET movie_detail written through', write_through, repeat, setup=lambda: (path, None))
+    with CaptureQueriesContext(connection) as queries:
+        write_through((path, None))
+    result['queries'] = len(queries)
+    results.append(result)
+
+    ids = list(Movie.objects.order_by('pk').values_list('pk', flat=True)[:objects])
+
+    def fill():
+        buffer = ViewCounter(flush_seconds=3600, buffer_size=10 ** 9)
+        for rank, pk in enumerate(ids, start=1):
+            # Zipf-like views: a few objects take most of them, so most objects share an increment.
+            for _ in range(max(1, len(ids) // (rank * 10))):
+                buffer.record(Movie, pk)
+        return buffer
+
+    result = measure(f'flush {len(ids)} objects', lambda buffer: buffer.flush(), repeat, setup=fill)
+    with CaptureQueriesContext(connection) as queries:
+        fill().flush()
+    result['queries'] = len(queries)
+    results.append(result)
+    counter.pending.clear()
+    return results
+
+
+@suite('bulk_cast')
+@override_settings(CACHES=DUMMY_CACHES, ALLOWED_HOSTS=['testserver'])
+def bulk_cast_suite(repeat, rows=150):
+    # Entering a whole cast row by row through cast_add (form, POST, redirect to the movie) against pasting it into
+    # the bulk editor once, then editing a fifth of an existing cast the same two ways.
+    actors = list(Person.objects.filter(role__in=ACTOR_ROLES).order_by('pk')[:rows])
+    genre = Genre.objects.order_by('pk').first()
+    if not actors or genre is None:
+        return []
+    movie = Movie.objects.create(title='Benchmark cast', description='', release_year=2000, duration_minutes=90,
+                                 genre=genre)
+    user, _ = User.objects.get_or_create(username='benchmark', defaults={'is_staff': True})
+    client = Client()
+    client.force_login(user)
+    add_path, bulk_path = f"{reverse('cast_add')}?movie={movie.pk}", reverse('cast_bulk_edit', args=[movie.pk])
+    detail_path = reverse('movie_detail', args=[movie.pk])
+    cast = [(actor.pk, f'Role {i}') for i, actor in enumerate(actors)]
+
+    def clear():
+        Cast.objects.filter(movie=movie).delete()
+
+    def full_cast():
+        clear()
+        Cast.objects.bulk_create(Cast(movie=movie, person_id=pk, role_name=role_name) for pk, role_name in cast)
+
+    def one_by_one(rows):
+        for pk, role_name in rows:
+            fetch(client, 'get', add_path)
+            fetch(client, 'post', add_path, {'movie': movie.pk, 'person': pk, 'role_name': role_name}, expected=302)
+            fetch(client, 'get', detail_path)
+
+    def rename_one_by_one(rows):
+        ids = dict(Cast.objects.filter(movie=movie).values_list('person_id', 'pk'))
+        for pk, role_name in rows:
+            path = reverse('cast_edit', args=[ids[pk]])
+            fetch(client, 'get', path)
+            fetch(client, 'post', path, {'movie': movie.pk, 'person': pk, 'role_name': role_name}, expected=302)
+            fetch(client, 'get', detail_path)
+
+    def in_bulk(rows):
+        fetch(client, 'get', bulk_path)
+        text = '\n'.join(f'{pk}\t{role_name}' for pk, role_name in rows)
+        fetch(client, 'post', bulk_path, {'cast': text, 'directors': ''}, expected=302)
+        fetch(client, 'get', detail_path)
+
+    renamed = [(pk, f'{role_name} (renamed)' if i % 5 == 0 else role_name) for i, (pk, role_name) in enumerate(cast)]
+    changed = renamed[::5]
+    runs = [
+        (f'add {len(cast)} rows one by one', lambda _: one_by_one(cast), clear),
+        (f'add {len(cast)} rows in bulk', lambda _: in_bulk(cast), clear),
+        (f'rename {len(changed)} of {len(cast)} rows one by one', lambda _: rename_one_by_one(changed), full_cast),
+        (f'rename {len(changed)} of {len(cast)} rows in bulk', lambda _: in_bulk(renamed), full_cast),
+    ]
+    results = []
+    for name, func, setup in runs:
+        result = measure(name, func, repeat, setup=setup)
+        setup()
+        with CaptureQueriesContext(connection) as queries:
+            func(None)
+        result['queries'] = len(queries)
+        results.append(result)
+    for row_by_row, bulk in (results[0:2], results[2:4]):
+        bulk['speedup'] = round(row_by_row['median_ms'] / bulk['median_ms'], 1)
+    return results
+
+
+@suite('deletion')
+@override_settings(CACHES=DUMMY_CACHES)
+def deletion_suite(repeat, batch_size=1000):
+    # Deleting the largest genre in one cascade, as the delete views did within the request, against hiding it (all
+    # the request does now) and the background removal, with its longest batch: the longest any lock is held.
+    genre = Genre.objects.order_by('-movie_count', 'pk').first()
+    if genre is None:
+        return []
+    batches = []
+
+    def rolled_back(func):
+        def run():
+            savepoint = transaction.savepoint()
+            try:
+                func()
+            finally:
+                transaction.savepoint_rollback(savepoint)
+        return run
+
+    def load():
+        # Model.delete() clears the pk of the instance it is called on, rolled back or not.
+        return Genre.objects.get(pk=genre.pk)
+
+    def remove_in_batches():
+        deletion = request_deletion(load())
+        start = time.perf_counter()
+        for _ in run_deletion(deletion, batch_size):
+            batches.append((time.perf_counter() - start) * 1000)
+            start = time.perf_counter()
+
+    results = [
+        measure(f'cascade delete {genre.movie_count} movies', rolled_back(lambda: load().delete()), repeat),
+        measure('hide genre', rolled_back(lambda: request_deletion(load())), repeat),
+        measure(f'remove in batches of {batch_size}', rolled_back(remove_in_batches), repeat),
+    ]
+    results[-1]['batches'] = len(batches) // repeat
+    results[-1]['longest_batch_ms'] = round(max(batches), 3)
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def describe_run(repeat, scale=None):
+    return {
+        'created': timezone.now().isoformat(),
+        'commit': git_commit(),
+        'database': connection.vendor,
+        'python': platform.python_version(),
+        'django': django.get_version(),
+        'repeat': repeat,
+        'scale': scale,
+        'catalog': {
+            'movies': Movie.objects.count(),
+            'persons': Person.objects.count(),
+            'reviews': Review.objects.count(),
+        },
+    }
+
+
+def compare_results(baseline, current, threshold=0.2, min_delta_ms=1.0):
+    """
+    Pairs the results of two benchmark runs by suite and name. A result has
+    regressed when its median grew by more than `threshold` (a fraction) and
+    by at least min_delta_ms, or when it ran more queries than before.
+    Returns (suite, name, before, after, regressed) rows; before and after
+    are the result dicts.
+    """
+    rows = []
+    for suite_name, results in current['suites'].items():
+        previous = {result['name']: result for result in baseline['suites'].get(suite_name, [])}
+        for result in results:
+            before = previous.get(result['name'])
+            if before is None:
+                continue
+            delta = result['median_ms'] - before['median_ms']
+            slower = delta >= min_delta_ms and delta > threshold * before['median_ms']
+            more_queries = result.get('queries', 0) > before.get('queries', result.get('queries', 0))
+            rows.append((suite_name, result['name'], before, result, slower or more_queries))
+    return rows
@@ -0,0 +1,241 @@
+import hashlib
+import time
+import uuid
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+from movies.routing import replica_may_predate
+
+GENERATION_KEY = 'movies:generation'
+
+
+def stamp_time(stamp):
+    return int(stamp.partition('-')[0])
+
+
+class DetailCache:
+    """
+    Read-through cache for assembled detail page contexts. Every object has a
+    version stamp and entries are keyed by it, so replacing the stamp when a
+    dependent row changes retires all entries built from the old data. Stamps
+    are replaced at write time and again once the transaction commits: readers
+    key entries by the stamp they saw before querying, so anything cached from
+    pre-commit data in between is retired by the second replacement. Entries
+    built from a replica that may not have replayed the write behind their
+    stamp are served but not stored (see movies.routing.replica_may_predate).
+    """
+
+    def __init__(self, alias=None, timeout=None):
+        self.alias = alias
+        self.timeout = timeout
+
+    @property
+    def cache(self):
+        return caches[self.alias or getattr(settings, 'MOVIES_DETAIL_CACHE', 'default')]
+
+    def get_timeout(self):
+        return self.timeout or getattr(settings, 'MOVIES_DETAIL_CACHE_TIMEOUT', 300)
+
+    def _stamp(self, key):
+        # '<created, epoch seconds>-<random>', so a stamp doubles as a Last-Modified time.
+        stamp = self.cache.get(key)
+        if stamp is None:
+            self.cache.add(key, f'{int(time.time())}-{uuid.uuid4().hex}', None)
+            stamp = self.cache.get(key, '0-')
+        return stamp
+
+    def validators(self, model_name, pk):
+        generation = self._stamp(GENERATION_KEY)
+        stamp = self._stamp(f'movies:version:{model_name}:{pk}')
+        return f'{generation}.{stamp}', max(stamp_time(generation), stamp_time(stamp))
+
+    def version(self, model_name, pk):
+        return self.validators(model_name, pk)[0]
+
+    def versions(self, model_name, pks):
+        """Version stamps of many objects of one model, read with a single get_many."""
+        keys = {f'movies:version:{model_name}:{pk}': pk for pk in pks}
+        stamps = self.cache.get_many(list(keys))
+        for key in keys.keys() - stamps.keys():
+            stamps[key] = self._stamp(key)
+        return {keys[key]: stamp for key, stamp in stamps.items()}
+
+    def get_or_build(self, model_name, pk, build):
+        version, last_modified = self.validators(model_name, pk)
+        key = f'movies:detail:{model_name}:{pk}:{version}'
+        value = self.cache.get(key)
+        if value is not None:
+            self.record(model_name, 'hits')
+            return value
+        self.record(model_name, 'misses')
+        value = build()
+        if not replica_may_predate(last_modified):
+            self.cache.set(key, value, self.get_timeout())
+        return value
+
+    def get_or_build_many(self, model_name, builders, timeout=None):
+        """
+        get_or_build for several objects of one model (builders maps pk to a
+        build function), reading their stamps and entries with one get_many each.
+        """
+        generation = self._stamp(GENERATION_KEY)
+        stamps = self.versions(model_name, builders)
+        keys = {pk: f'movies:detail:{model_name}:{pk}:{generation}.{stamps[pk]}' for pk in builders}
+        found = self.cache.get_many(list(keys.values()))
+        values, built, stored = {}, {}, {}
+        for pk, key in keys.items():
+            if key in found:
+                values[pk] = found[key]
+                continue
+            values[pk] = built[key] = builders[pk]()
+            if not replica_may_predate(max(stamp_time(generation), stamp_time(stamps[pk]))):
+                stored[key] = built[key]
+        if stored:
+            self.cache.set_many(stored, timeout or self.get_timeout())
+        self.record(model_name, 'hits', len(values) - len(built))
+        self.record(model_name, 'misses', len(built))
+        return values
+
+    async def aget_or_build(self, model_name, pk, abuild):
+        version, last_modified = await sync_to_async(self.validators)(model_name, pk)
+        key = f'movies:detail:{model_name}:{pk}:{version}'
+        value = await self.cache.aget(key)
+        if value is not None:
+            await sync_to_async(self.record)(model_name, 'hits')
+            return value
+        await sync_to_async(self.record)(model_name, 'misses')
+        value = await abuild()
+        if not replica_may_predate(last_modified):
+            await self.cache.aset(key, value, self.get_timeout())
+        return value
+
+    def record(self, model_name, outcome, count=1):
+        key = f'movies:stats:{model_name}:{outcome}'
+        if count and not self.cache.add(key, count, None):
+            try:
+                self.cache.incr(key, count)
+            except ValueError:
+                pass
+
+    def stats(self, model_names=('movie', 'person', 'award')):
+        keys = {f'movies:stats:{name}:{outcome}': (name, outcome) for name in model_names for outcome in ('hits', 'misses')}
+        counts = self.cache.get_many(list(keys))
+        stats = {name: {'hits': 0, 'misses': 0} for name in model_names}
+        for key, (name, outcome) in keys.items():
+            stats[name][outcome] = counts.get(key, 0)
+        return stats
+
+    def _replace(self, keys):
+        # A replacement stamp is always dated after the one it replaces, so If-Modified-Since
+        # cannot miss two changes made within the same second.
+        now = int(time.time())
+        stamps = self.cache.get_many(keys)
+        self.cache.set_many({
+            key: f'{max(now, stamp_time(stamps[key]) + 1) if key in stamps else now}-{uuid.uuid4().hex}'
+            for key in keys
+        }, None)
+
+    def invalidate(self, model_name, pks):
+        keys = [f'movies:version:{model_name}:{pk}' for pk in set(pks) if pk is not None]
+        if keys:
+            self._replace(keys)
+            transaction.on_commit(lambda: self._replace(keys))
+
+    def invalidate_all(self):
+        self._replace([GENERATION_KEY])
+        transaction.on_commit(lambda: self._replace([GENERATION_KEY]))
+
+
+detail_cache = DetailCache()
+
+
+class RowCache:
+    """
+    Pre-rendered HTML of list table rows (see the rowcache template tag). A
+    row's key covers its fragment's template source and the version stamps of
+    the row object and of the objects it shows through foreign keys, so saving
+    any of them, or editing the template, makes the row render afresh.
+    """
+
+    def __init__(self, versions=detail_cache, timeout=None):
+        self.versions = versions
+        self.timeout = timeout
+
+    @property
+    def cache(self):
+        return self.versions.cache
+
+    def get_timeout(self):
+        return self.timeout or getattr(settings, 'MOVIES_ROW_CACHE_TIMEOUT', 3600)
+
+    def keys(self, fragment, rows, relations=()):
+        """
+        Maps each row's pk to its cache key, reading all the stamps involved
+        with one get_many per model. The key is None for rows read from a
+        replica that may predate their stamps, which must not be cached.
+        """
+        if not rows:
+            return {}
+        model = type(rows[0])
+        dependencies = [(model._meta.model_name, 'pk')] + [
+            (field.related_model._meta.model_name, field.attname) for field in map(model._meta.get_field, relations)
+        ]
+        stamps = {
+            (model_name, attname): self.versions.versions(model_name, {getattr(row, attname) for row in rows})
+            for model_name, attname in dependencies
+        }
+        generation = self.versions._stamp(GENERATION_KEY)
+        keys = {}
+        for row in rows:
+            row_stamps = [generation] + [stamps[dependency][getattr(row, dependency[1])] for dependency in dependencies]
+            if replica_may_predate(max(map(stamp_time, row_stamps))):
+                keys[row.pk] = None
+                continue
+            version = ':'.join(row_stamps)
+            keys[row.pk] = f'movies:row:{fragment}:{row.pk}:{hashlib.md5(version.encode()).hexdigest()}'
+        return keys
+
+    def get_many(self, keys):
+        return self.cache.get_many(keys)
+
+    def set(self, key, html):
+        self.cache.set(key, html, self.get_timeout())
+
+
+row_cache = RowCache()
+
+
+class CachedDetailMixin:
+    """
+    Serves a DetailView's context from the detail cache. Subclasses must return
+    fully evaluated data from get_context_data, since the context is pickled;
+    the querysets named by get_related_querysets() are evaluated into lists.
+    """
+
+    def get(self, request, *args, **kwargs):
+        pk = kwargs.get(self.pk_url_kwarg)
+        if pk is None:
+            return super().get(request, *args, **kwargs)
+        context = dict(detail_cache.get_or_build(self.model._meta.model_name, pk, self.build_context))
+        self.object = context['object']
+        context['view'] = self
+        return self.render_to_response(context)
+
+    def get_related_querysets(self):
+        return {}
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        for name, queryset in self.get_related_querysets().items():
+            if name not in context:
+                context[name] = list(queryset)
+        return context
+
+    def build_context(self):
+        self.object = self.get_object()
+        context = self.get_context_data(object=self.object)
+        del context['view']
+        return context
@@ -0,0 +1,118 @@
+import time
+
+from django.db import transaction
+
+from movies.cache import detail_cache
+from movies.filmography import credits_table_enabled, rebuild_cast_credits
+from movies.models import Cast, Person
+
+ACTOR_ROLES = (Person.ACTOR, Person.BOTH)
+DIRECTOR_ROLES = (Person.DIRECTOR, Person.BOTH)
+
+
+def parse_rows(text, columns):
+    """
+    Splits pasted tab-separated text into (line number, cells) pairs with
+    `columns` cells each, skipping blank lines. Cells past `columns` (such as
+    the names the editor writes after each id) are ignored and missing ones
+    are empty. A line without tabs is split at its first runs of whitespace.
+    """
+    rows = []
+    for number, line in enumerate(text.splitlines(), start=1):
+        if not line.strip():
+            continue
+        cells = line.split('\t') if '\t' in line else line.split(None, columns - 1)
+        cells = [cell.strip() for cell in cells]
+        rows.append((number, (cells + [''] * columns)[:columns]))
+    return rows
+
+
+def cast_text(casts):
+    return '\n'.join(f'{cast.person_id}\t{cast.role_name}\t{cast.person}' for cast in casts)
+
+
+def directors_text(directors):
+    return '\n'.join(f'{person.pk}\t{person}' for person in directors)
+
+
+class CastChanges:
+    """
+    The writes turning a movie's cast rows into `wanted` ((person id, role
+    name) pairs): a person's rows whose role name is still wanted are kept,
+    the others are renamed to the person's new role names while both last,
+    and what remains is deleted or created.
+    """
+
+    def __init__(self, movie, existing, wanted):
+        roles, current = {}, {}
+        for person_id, role_name in wanted:
+            roles.setdefault(person_id, []).append(role_name)
+        for cast in existing:
+            current.setdefault(cast.person_id, []).append(cast)
+        self.created, self.updated, self.deleted = [], [], []
+        for person_id in roles.keys() | current.keys():
+            rows, new = current.get(person_id, []), roles.get(person_id, [])
+            kept = {cast.role_name for cast in rows} & set(new)
+            stale = [cast for cast in rows if cast.role_name not in kept]
+            new = list(dict.fromkeys(role_name for role_name in new if role_name not in kept))
+            for cast, role_name in zip(stale, new):
+                cast.role_name = role_name
+                self.updated.append(cast)
+            self.deleted.extend(stale[len(new):])
+            self.created.extend(Cast(movie=movie, person_id=person_id, role_name=role_name)
+                                for role_name in new[len(stale):])
+        # New rows are listed in the order they were pasted.
+        order = {pair: index for index, pair in enumerate(wanted)}
+        self.created.sort(key=lambda cast: order[cast.person_id, cast.role_name])
+        self.directors_added, self.directors_removed = [], []
+        self.seconds = 0.0
+
+    def __bool__(self):
+        return bool(self.created or self.updated or self.deleted or self.directors_added or self.directors_removed)
+
+    def __str__(self):
+        return (
+            f'{len(self.created)} cast rows added, {len(self.updated)} renamed, {len(self.deleted)} removed; '
+            f'{len(self.directors_added)} directors added, {len(self.directors_removed)} removed '
+            f'in {self.seconds * 1000:.1f} ms'
+        )
+
+
+def edit_cast(movie, wanted, director_ids):
+    """
+    Makes a movie's cast exactly `wanted` ((person id, role name) pairs) and
+    its directors exactly `director_ids` in one transaction: a delete, a
+    bulk_update and a bulk_create for the cast diff and one add and one
+    remove for the directors, however many rows change. Person ids are
+    expected to be validated already (see BulkCastForm). Returns the
+    CastChanges applied.
+    """
+    start = time.perf_counter()
+    with transaction.atomic():
+        existing = Cast.objects.select_for_update().filter(movie=movie).order_by('pk')
+        changes = CastChanges(movie, list(existing), wanted)
+        if changes.deleted:
+            Cast.objects.filter(pk__in=[cast.pk for cast in changes.deleted]).delete()
+        if changes.updated:
+            Cast.objects.bulk_update(changes.updated, ['role_name'])
+        if changes.created:
+            Cast.objects.bulk_create(changes.created)
+
+        # add() and remove() send m2m_changed, which keeps the facets, credits and cached pages in step.
+        current = set(movie.directors.values_list('pk', flat=True))
+        changes.directors_added = [pk for pk in dict.fromkeys(director_ids) if pk not in current]
+        changes.directors_removed = sorted(current - set(director_ids))
+        if changes.directors_removed:
+            movie.directors.remove(*changes.directors_removed)
+        if changes.directors_added:
+            movie.directors.add(*changes.directors_added)
+
+        # bulk_create and bulk_update send no post_save, so do what its receivers would for the cast rows.
+        written = changes.created + changes.updated
+        if written:
+            if credits_table_enabled():
+                rebuild_cast_credits(movie.pk)
+            detail_cache.invalidate('movie', [movie.pk])
+            detail_cache.invalidate('person', {cast.person_id for cast in written})
+    changes.seconds = time.perf_counter() - start
+    return changes
@@ -0,0 +1,396 @@
+import csv
+import itertools
+import json
+import time
+from pathlib import Path
+
+from django.core.management.color import no_style
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+
+from movies.cache import detail_cache
+from movies.counts import rebuild_movie_counts
+from movies.filmography import credits_table_enabled, rebuild_credits
+from movies.models import Award, Cast, Genre, Movie, MovieAward, Person, Review
+from movies.pagination import CursorEncoder
+from movies.ratings import rebuild_ratings
+from movies.sharding import is_sharded, place, sync_sequence
+
+FORMATS = ('jsonl', 'csv')
+
+
+class CatalogEntity:
+    def __init__(self, name, model, fields, references=None, natural_keys=None, upsert=True):
+        self.name = name
+        self.model = model
+        self.fields = fields
+        self.references = references or {}
+        # Foreign keys written as a unique field of the related row (e.g. a username) instead of its id.
+        self.natural_keys = natural_keys or {}
+        self.upsert = upsert
+        self.field_map = {name: model._meta.get_field(name) for name in fields}
+        # Columns the files do not carry still need their model defaults on insert.
+        self.defaults = [
+            field for field in model._meta.concrete_fields
+            if field.name not in self.field_map and not field.primary_key
+        ]
+        self.prepared_defaults = {}
+
+    def to_python(self, name, value):
+        field = self.field_map[name]
+        if field.is_relation:
+            field = field.target_field
+        if value == '' and field.null:
+            return None
+        return field.to_python(value)
+
+    def row_values(self, row, connection):
+        values = []
+        for name, field in self.field_map.items():
+            value = self.to_python(name, row.get(name))
+            target = field.target_field if field.is_relation else field
+            values.append(target.get_db_prep_save(value, connection))
+        values.extend(self.default_values(connection))
+        return values
+
+    def default_values(self, connection):
+        if connection.alias not in self.prepared_defaults:
+            self.prepared_defaults[connection.alias] = [
+                field.get_db_prep_save(field.get_default(), connection) for field in self.defaults
+            ]
+        return self.prepared_defaults[connection.alias]
+
+    def insert_sql(self, rows, connection):
+        quote = connection.ops.quote_name
+        columns = [field.column for field in self.field_map.values()] + [field.column for field in self.defaults]
+        placeholders = '(' + ', '.join(['%s'] * len(columns)) + ')'
+        sql = (
+            f'INSERT INTO {quote(self.model._meta.db_table)} ({", ".join(quote(column) for column in columns)}) '
+            f'VALUES {", ".join([placeholders] * rows)}'
+        )
+        if not self.upsert:
+            return sql + ' ON CONFLICT DO NOTHING'
+        pk_column = self.model._meta.pk.column
+        updates = ', '.join(
+            f'{quote(field.column)} = EXCLUDED.{quote(field.column)}'
+            for field in self.field_map.values() if field.column != pk_column
+        )
+        return sql + f' ON CONFLICT ({quote(pk_column)}) DO UPDATE SET {updates}'
+
+    @property
+    def export_columns(self):
+        return [
+            f'{name}__{self.natural_keys[name]}' if name in self.natural_keys else self.field_map[name].attname
+            for name in self.fields
+        ]
+
+    def rows_per_statement(self, connection):
+        max_params = connection.features.max_query_params
+        width = len(self.field_map) + len(self.defaults)
+        return max(1, min(1000, max_params // width)) if max_params else 1000
+
+
+DirectorLink = Movie.directors.through
+
+ENTITIES = {
+    entity.name: entity for entity in [
+        CatalogEntity('genres', Genre, ['id', 'name']),
+        CatalogEntity('persons', Person, ['id', 'first_name', 'last_name', 'birth_date', 'death_date', 'role']),
+        CatalogEntity('awards', Award, ['id', 'name']),
+        CatalogEntity('movies', Movie, ['id', 'title', 'description', 'release_year', 'duration_minutes', 'genre'],
+                      references={'genre': 'genres'}),
+        CatalogEntity('directors', DirectorLink, ['movie', 'person'],
+                      references={'movie': 'movies', 'person': 'persons'}, upsert=False),
+        CatalogEntity('casts', Cast, ['id', 'movie', 'person', 'role_name'],
+                      references={'movie': 'movies', 'person': 'persons'}),
+        CatalogEntity('movie_awards', MovieAward, ['id', 'movie', 'award', 'category'],
+                      references={'movie': 'movies', 'award': 'awards'}),
+        CatalogEntity('reviews', Review, ['id', 'movie', 'user', 'rating', 'text', 'created_at'],
+                      references={'movie': 'movies'}, natural_keys={'user': 'username'}),
+    ]
+}
+
+REFERENCED_ENTITIES = {target for entity in ENTITIES.values() for target in entity.references.values()}
+
+# Movies carry their directors (and, in JSONL, their cast) nested, so those are not exported separately.
+EXPORT_ENTITIES = {
+    'jsonl': ['genres', 'persons', 'awards', 'movies', 'movie_awards', 'reviews'],
+    'csv': ['genres', 'persons', 'awards', 'movies', 'casts', 'movie_awards', 'reviews'],
+}
+
+
+def read_rows(path):
+    path = Path(path)
+    with path.open(newline='', encoding='utf-8') as handle:
+        if path.suffix == '.csv':
+            yield from csv.DictReader(handle)
+        else:
+            for line in handle:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def find_entity_files(directory):
+    directory = Path(directory)
+    for name in ENTITIES:
+        for extension in FORMATS:
+            path = directory / f'{name}.{extension}'
+            if path.exists():
+                yield name, path
+                break
+
+
+class CatalogStats:
+    def __init__(self, entity):
+        self.entity = entity
+        self.rows = 0
+        self.skipped = 0
+        self.started = time.perf_counter()
+        self.seconds = 0.0
+
+    def finish(self):
+        self.seconds = time.perf_counter() - self.started
+        return self
+
+    @property
+    def rate(self):
+        return self.rows / self.seconds if self.seconds else 0.0
+
+
+class CatalogImporter:
+    """
+    Streams catalog rows into the database in fixed-size batches of multi-row
+    INSERT ... ON CONFLICT statements, bypassing model instantiation. Rows carry
+    their primary keys, so re-importing the same files upserts in place instead
+    of duplicating. Foreign keys are checked against in-memory sets of known ids
+    and rows pointing at unknown objects are skipped.
+    """
+
+    def __init__(self, batch_size=5000, using=DEFAULT_DB_ALIAS):
+        self.batch_size = batch_size
+        # Resolved once: going through the thread-local connection proxy per value is measurable.
+        self.connection = connections[using]
+        self.known = {}
+        self.natural = {}
+        self.touched_models = set()
+
+    def known_ids(self, entity_name):
+        if entity_name not in self.known:
+            model = ENTITIES[entity_name].model
+            self.known[entity_name] = set(model.objects.using(self.connection.alias).values_list('pk', flat=True).iterator(chunk_size=10000))
+        return self.known[entity_name]
+
+    def natural_ids(self, entity, name):
+        key = (entity.name, name)
+        if key not in self.natural:
+            field = entity.field_map[name]
+            lookup = entity.natural_keys[name]
+            rows = field.related_model._default_manager.using(self.connection.alias).values_list(lookup, 'pk')
+            self.natural[key] = dict(rows.iterator(chunk_size=10000))
+        return self.natural[key]
+
+    def resolve_natural_keys(self, entity, row):
+        for name, lookup in entity.natural_keys.items():
+            value = row.get(name)
+            if value in (None, ''):
+                continue
+            ids = self.natural_ids(entity, name)
+            if value not in ids:
+                manager = entity.field_map[name].related_model._default_manager.db_manager(self.connection.alias)
+                ids[value] = manager.create(**{lookup: value}).pk
+            row[name] = ids[value]
+        return row
+
+    def resolves(self, entity, row):
+        for field, target in entity.references.items():
+            value = row.get(field)
+            if value in (None, '') or entity.to_python(field, value) not in self.known_ids(target):
+                return False
+        return True
+
+    def save(self, entity, rows):
+        if not rows:
+            return
+        step = entity.rows_per_statement(self.connection)
+        with transaction.atomic(using=self.connection.alias), self.connection.cursor() as cursor:
+            for start in range(0, len(rows), step):
+                chunk = rows[start:start + step]
+                sql = entity.insert_sql(len(chunk), self.connection)
+                cursor.execute(sql, [value for row in chunk for value in row])
+        if entity.upsert:
+            # Only ids that other rows are checked against are kept; the rest would only grow with the import.
+            if entity.name in REFERENCED_ENTITIES:
+                self.known_ids(entity.name).update(row[0] for row in rows)
+            self.touched_models.add(entity.model)
+
+    def import_rows(self, entity_name, rows):
+        entity = ENTITIES[entity_name]
+        stats = CatalogStats(entity_name)
+        batch = []
+        nested = {'directors': [], 'casts': []}
+        for row in rows:
+            if entity.natural_keys:
+                row = self.resolve_natural_keys(entity, row)
+            if not self.resolves(entity, row):
+                stats.skipped += 1
+                continue
+            batch.append(entity.row_values(row, self.connection))
+            if entity_name == 'movies':
+                self.collect_nested(row, nested)
+            stats.rows += 1
+            if len(batch) >= self.batch_size:
+                self.flush(entity, batch, nested)
+                batch = []
+        self.flush(entity, batch, nested)
+        return stats.finish()
+
+    def collect_nested(self, row, nested):
+        directors = row.get('directors') or []
+        if isinstance(directors, str):
+            directors = [person for person in directors.split(';') if person]
+        nested['directors'].extend({'movie': row['id'], 'person': person} for person in directors)
+        cast = row.get('cast') or []
+        nested['casts'].extend({**member, 'movie': row['id']} for member in cast)
+
+    def flush(self, entity, batch, nested):
+        affected = set()
+        if entity.model is Review and batch:
+            # Raw upserts bypass the rating signals, so rebuild every movie a review left or joined.
+            movie = entity.fields.index('movie')
+            ids = [row[0] for row in batch]
+            alias = self.connection.alias
+            if is_sharded():
+                previous = list(Review.objects.filter(pk__in=ids))
+                # The rows are upserted here and then placed, so stored copies on other shards would be left behind.
+                for review in previous:
+                    if review._state.db != alias:
+                        Review._base_manager.using(review._state.db).filter(pk=review.pk)._raw_delete(review._state.db)
+                affected = {review.movie_id for review in previous} | {row[movie] for row in batch}
+            else:
+                previous = Review.objects.using(alias).filter(pk__in=ids)
+                affected = set(previous.values_list('movie_id', flat=True)) | {row[movie] for row in batch}
+        self.save(entity, batch)
+        if entity.model is Review and batch and is_sharded():
+            place(list(Review._base_manager.using(self.connection.alias).filter(pk__in=ids)), self.connection.alias)
+        rebuild_ratings(affected)
+        for name, rows in nested.items():
+            child = ENTITIES[name]
+            self.save(child, [child.row_values(row, self.connection) for row in rows if self.resolves(child, row)])
+            rows.clear()
+
+    def import_path(self, path, entity_name=None):
+        files = [(entity_name, Path(path))] if entity_name else find_entity_files(path)
+        for name, file_path in files:
+            yield self.import_rows(name, read_rows(file_path))
+        self.reset_sequences()
+        if Review in self.touched_models and is_sharded():
+            sync_sequence()
+        # Raw upserts send no signals, so retire every cached page at once and rebuild the derived counts and credits.
+        detail_cache.invalidate_all()
+        rebuild_movie_counts()
+        if credits_table_enabled():
+            rebuild_credits()
+
+    def reset_sequences(self):
+        statements = self.connection.ops.sequence_reset_sql(no_style(), list(self.touched_models))
+        if statements:
+            with self.connection.cursor() as cursor:
+                for sql in statements:
+                    cursor.execute(sql)
+
+
+def chunked(iterable, size):
+    iterator = iter(iterable)
+    while chunk := list(itertools.islice(iterator, size)):
+        yield chunk
+
+
+class _Passthrough:
+    def write(self, value):
+        return value
+
+
+class CatalogExporter:
+    """
+    Streams catalog rows out of the database through a server-side cursor, one
+    chunk at a time, so memory stays flat however large the tables grow. Movies
+    carry their directors (and in JSONL their cast) nested, in the same shape
+    the importer reads back.
+    """
+
+    content_types = {'jsonl': 'application/x-ndjson', 'csv': 'text/csv'}
+
+    def __init__(self, chunk_size=2000, using=DEFAULT_DB_ALIAS):
+        self.chunk_size = chunk_size
+        self.using = using
+
+    def rows(self, entity_name, nest_cast=True):
+        entity = ENTITIES[entity_name]
+        manager = entity.model._default_manager
+        # Left unpinned on the default database, so sharded reviews are read from every shard.
+        queryset = manager.all() if self.using == DEFAULT_DB_ALIAS else manager.using(self.using)
+        # Shards hold no users to join, so sharded reviews look their natural keys up per chunk instead.
+        separate = entity.model is Review and is_sharded()
+        columns = [entity.field_map[name].attname for name in entity.fields] if separate else entity.export_columns
+        queryset = queryset.order_by('pk').values_list(*columns)
+        for chunk in chunked(queryset.iterator(chunk_size=self.chunk_size), self.chunk_size):
+            rows = [dict(zip(entity.fields, values)) for values in chunk]
+            if separate:
+                self.attach_natural_keys(entity, rows)
+            if entity.model is Movie:
+                self.attach_nested(rows, nest_cast)
+            yield from rows
+
+    def attach_natural_keys(self, entity, rows):
+        for name, lookup in entity.natural_keys.items():
+            related = entity.field_map[name].related_model._default_manager.using(self.using)
+            values = dict(related.filter(pk__in={row[name] for row in rows}).values_list('pk', lookup))
+            for row in rows:
+                row[name] = values.get(row[name])
+
+    def attach_nested(self, rows, nest_cast):
+        movies = {}
+        for row in rows:
+            row['directors'] = []
+            if nest_cast:
+                row['cast'] = []
+            movies[row['id']] = row
+        links = DirectorLink.objects.using(self.using).filter(movie_id__in=movies).order_by('pk')
+        for movie_id, person_id in links.values_list('movie_id', 'person_id'):
+            movies[movie_id]['directors'].append(person_id)
+        if nest_cast:
+            cast = Cast.objects.using(self.using).filter(movie_id__in=movies).order_by('pk')
+            for movie_id, pk, person_id, role_name in cast.values_list('movie_id', 'pk', 'person_id', 'role_name'):
+                movies[movie_id]['cast'].append({'id': pk, 'person': person_id, 'role_name': role_name})
+
+    def render(self, entity_name, format):
+        if format == 'csv':
+            return self.render_csv(entity_name)
+        return self.render_jsonl(entity_name)
+
+    def render_jsonl(self, entity_name):
+        for row in self.rows(entity_name):
+            yield json.dumps(row, cls=CursorEncoder, ensure_ascii=False) + '\n'
+
+    def render_csv(self, entity_name):
+        header = list(ENTITIES[entity_name].fields)
+        if entity_name == 'movies':
+            header.append('directors')
+        writer = csv.writer(_Passthrough())
+        yield writer.writerow(header)
+        for row in self.rows(entity_name, nest_cast=False):
+            if 'directors' in row:
+                row['directors'] = ';'.join(str(pk) for pk in row['directors'])
+            yield writer.writerow([row[name] for name in header])
+
+    def export_path(self, directory, format, entity_names=None):
+        directory = Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+        for name in entity_names or EXPORT_ENTITIES[format]:
+            stats = CatalogStats(name)
+            with (directory / f'{name}.{format}').open('w', newline='', encoding='utf-8') as handle:
+                for line in self.render(name, format):
+                    handle.write(line)
+                    stats.rows += 1
+            if format == 'csv':
+                stats.rows -= 1
+            yield stats.finish()
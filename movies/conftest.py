@@ -1,6 +1,32 @@
 import pytest
 from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.db import connections
 from movies.models import Movie, Award, Person, Genre, Review, MovieAward
+from movies.autocomplete import reset_indexes
+from movies.facets import reset_facet_index
+from movies.popularity import reset_view_counter
+from movies.search import reset_search_backend
+from movies.sharding import create_shard_tables
+
+
+@pytest.fixture(autouse=True)
+def search_backend():
+    reset_search_backend()
+    reset_indexes()
+    reset_facet_index()
+    reset_view_counter()
+    yield
+    reset_search_backend()
+    reset_indexes()
+    reset_facet_index()
+    reset_view_counter()
+
+
+@pytest.fixture(autouse=True)
+def clear_caches():
+    for cache in caches.all():
+        cache.clear()
 
 
 @pytest.fixture
@@ -58,3 +84,41 @@ def review(user, movie):
         rating=8,
         text='Great movie!'
     )
+
+
+@pytest.fixture
+def replica_aliases():
+    # Two more aliases onto the test database, standing in for replicas, and one whose database cannot be opened.
+    default = connections['default'].settings_dict
+    aliases = connections.configure_settings({
+        'default': dict(default),
+        'replica_a': dict(default),
+        'replica_b': dict(default),
+        'replica_down': {'ENGINE': 'django.db.backends.sqlite3', 'NAME': '/nonexistent/replica.sqlite3'},
+    })
+    del aliases['default']
+    connections.settings.update(aliases)
+    yield list(aliases)
+    for alias in aliases:
+        connections[alias].close()
+        del connections[alias]
+        del connections.settings[alias]
+
+
+@pytest.fixture
+def review_shards(tmp_path, settings):
+    # Reviews spread over the test database and two SQLite files, which hold only the review table.
+    aliases = connections.configure_settings({
+        'default': dict(connections['default'].settings_dict),
+        'shard_a': {'ENGINE': 'django.db.backends.sqlite3', 'NAME': str(tmp_path / 'shard_a.sqlite3')},
+        'shard_b': {'ENGINE': 'django.db.backends.sqlite3', 'NAME': str(tmp_path / 'shard_b.sqlite3')},
+    })
+    del aliases['default']
+    connections.settings.update(aliases)
+    settings.MOVIES_REVIEW_SHARDS = ['default', *aliases]
+    create_shard_tables()
+    yield settings.MOVIES_REVIEW_SHARDS
+    for alias in aliases:
+        connections[alias].close()
+        del connections[alias]
+        del connections.settings[alias]
@@ -0,0 +1,34 @@
+from collections import Counter
+
+from django.db import transaction
+from django.db.models import Count, F
+
+from movies.cache import detail_cache
+from movies.models import Genre, Movie
+
+
+def apply_movie_count_changes(changes):
+    """Applies (genre_id, delta) pairs to Genre.movie_count, locking genres in pk order."""
+    deltas = Counter()
+    for genre_id, delta in changes:
+        deltas[genre_id] += delta
+    deltas = {genre_id: delta for genre_id, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    with transaction.atomic():
+        for genre_id in sorted(deltas):
+            Genre.objects.filter(pk=genre_id).update(movie_count=F('movie_count') + deltas[genre_id])
+        detail_cache.invalidate('home', ['genres'])
+
+
+def rebuild_movie_counts(genre_ids=None):
+    genres = Genre.objects.all() if genre_ids is None else Genre.objects.filter(pk__in=genre_ids)
+    with transaction.atomic():
+        genres = list(genres.select_for_update().only('movie_count').order_by('pk'))
+        counts = dict(
+            Movie.objects.filter(genre__in=genres).values_list('genre_id').annotate(n=Count('pk')).order_by()
+        )
+        for genre in genres:
+            genre.movie_count = counts.get(genre.pk, 0)
+        Genre.objects.bulk_update(genres, ['movie_count'], batch_size=1000)
+        detail_cache.invalidate('home', ['genres'])
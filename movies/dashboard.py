@@ -0,0 +1,73 @@
+from django.conf import settings
+from django.db.models import Sum
+
+from movies.cache import detail_cache
+from movies.models import Award, Genre, Movie, MovieAward, Review
+
+# Rows shown per home page section; every section is a capped query, so the page costs the same at any catalog size.
+SECTION_SIZE = 8
+GENRE_LIMIT = 12
+
+
+def recent_movies():
+    movies = Movie.objects.select_related('genre').only(
+        'title', 'release_year', 'rating_avg', 'rating_count', 'genre__name',
+    )
+    return list(movies.order_by('-pk')[:SECTION_SIZE])
+
+
+def recent_reviews():
+    reviews = Review.objects.live().select_related('movie', 'user').only(
+        'rating', 'created_at', 'movie__title', 'movie__release_year', 'user__username',
+    )
+    return list(reviews.order_by('-created_at', '-pk')[:SECTION_SIZE])
+
+
+def genre_counts():
+    # Genre.movie_count is a maintained counter, so no movie is counted here.
+    genres = Genre.objects.filter(movie_count__gt=0).order_by('-movie_count', 'name')
+    return {
+        'genres': list(genres.values('pk', 'name', 'movie_count')[:GENRE_LIMIT]),
+        'total': Genre.objects.aggregate(total=Sum('movie_count'))['total'] or 0,
+    }
+
+
+def latest_awards():
+    awards = MovieAward.objects.filter(movie__pending_delete=False).select_related('movie', 'award').only(
+        'category', 'movie__title', 'movie__release_year', 'award__name',
+    )
+    return list(awards.order_by('-pk')[:SECTION_SIZE])
+
+
+SECTIONS = {
+    'movies': recent_movies,
+    'reviews': recent_reviews,
+    'genres': genre_counts,
+    'awards': latest_awards,
+}
+
+# Sections showing each model's rows, retired by movies.signals when one is saved or deleted.
+SECTION_DEPENDENCIES = {
+    Movie: ('movies', 'reviews', 'genres', 'awards'),
+    Genre: ('movies', 'genres'),
+    Review: ('reviews',),
+    MovieAward: ('awards',),
+    Award: ('awards',),
+}
+
+
+def get_timeout():
+    return getattr(settings, 'MOVIES_HOME_CACHE_TIMEOUT', 60)
+
+
+def home_sections():
+    """
+    The home page sections, each cached for MOVIES_HOME_CACHE_TIMEOUT seconds
+    under a version stamp that writes to the rows it shows replace. Bulk
+    writes send no signals; their sections catch up when the entry expires.
+    """
+    return detail_cache.get_or_build_many('home', SECTIONS, get_timeout())
+
+
+def invalidate_sections(model):
+    detail_cache.invalidate('home', SECTION_DEPENDENCIES.get(model, ()))
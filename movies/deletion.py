@@ -0,0 +1,216 @@
+import logging
+import threading
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import DatabaseError, connections, models, transaction
+from django.db.models import Q
+from django.db.models.deletion import get_candidate_relations_to_delete
+from django.dispatch import Signal
+from django.http import HttpResponseRedirect
+from django.utils import timezone
+
+from movies.models import Deletion, Genre, Movie, Person
+from movies.sharding import SHARDED_MODEL, get_review_shards, is_sharded, shard_for
+
+logger = logging.getLogger(__name__)
+
+DELETABLE = {'genre': Genre, 'person': Person, 'movie': Movie}
+
+# Sent with the pks of rows just marked pending_delete, once per model, so movies.signals can take them out of the
+# indexes, counters and cached pages that do not read through the models' default managers.
+deletion_requested = Signal()
+
+
+def get_batch_size():
+    return getattr(settings, 'MOVIES_DELETE_BATCH_SIZE', 1000)
+
+
+def deletes_in_background():
+    return getattr(settings, 'MOVIES_DELETE_IN_BACKGROUND', True)
+
+
+def get_claim_seconds():
+    return getattr(settings, 'MOVIES_DELETE_CLAIM_SECONDS', 300)
+
+
+class DeletionClaimLost(Exception):
+    """Another run took over a Deletion whose claim had lapsed."""
+
+
+def save_progress(deletion, fields):
+    # Written only while the row is still claimed by this run, so a run whose claim lapsed stops at its next batch.
+    deletion.updated_at = timezone.now()
+    values = {field: getattr(deletion, field) for field in (*fields, 'updated_at')}
+    if not Deletion.objects.filter(pk=deletion.pk, claimed_by=deletion.claimed_by).update(**values):
+        raise DeletionClaimLost(deletion)
+
+
+def request_deletion(obj):
+    """
+    Hides a Genre, Person or Movie at once and queues it for delete_pending(),
+    which the background worker starts on once the transaction commits. A
+    genre's movies are hidden along with it. Costs a few statements however
+    many rows the delete will cascade to. Returns the queued Deletion.
+    """
+    model = type(obj)
+    with transaction.atomic():
+        model._base_manager.filter(pk=obj.pk).update(pending_delete=True)
+        obj.pending_delete = True
+        if model is Genre:
+            movies = Movie.objects.filter(genre=obj)
+            movie_ids = list(movies.values_list('pk', flat=True))
+            movies.update(pending_delete=True)
+            deletion_requested.send(Movie, pks=movie_ids)
+        deletion_requested.send(model, pks=[obj.pk])
+        deletion = Deletion.objects.create(model_name=model._meta.model_name, object_id=obj.pk, label=str(obj)[:255])
+        transaction.on_commit(worker.start)
+    return deletion
+
+
+def cascade(queryset, seen=()):
+    """
+    (alias, queryset) pairs of the rows deleting `queryset` cascades to,
+    children before their parents. Sharded reviews are listed per shard by
+    the ids of their movies, as shards cannot join the movie table.
+    """
+    model = queryset.model
+    for relation in get_candidate_relations_to_delete(model._meta):
+        related = relation.related_model
+        if relation.on_delete is not models.CASCADE or related in seen:
+            continue
+        if related._meta.label_lower == SHARDED_MODEL and is_sharded():
+            ids = list(queryset.values_list('pk', flat=True))
+            aliases = {shard_for(pk) for pk in ids} if model is Movie else get_review_shards()
+            for alias in sorted(aliases):
+                yield alias, related._base_manager.using(alias).filter(**{f'{relation.field.attname}__in': ids})
+            continue
+        children = related._base_manager.filter(**{f'{relation.field.name}__in': queryset})
+        yield from cascade(children, (*seen, model))
+        yield children.db, children
+
+
+def delete_in_batches(deletion, alias, queryset, batch_size):
+    # Raw deletes send no signals: the rows belong to objects already taken out of every index by request_deletion.
+    model = queryset.model
+    while True:
+        with transaction.atomic(using=alias):
+            pks = list(queryset.values_list('pk', flat=True)[:batch_size])
+            if not pks:
+                return
+            rows = model._base_manager.using(alias).filter(pk__in=pks)._raw_delete(alias)
+        deletion.rows_deleted += rows
+        deletion.stage = model._meta.verbose_name_plural
+        save_progress(deletion, ['rows_deleted', 'stage'])
+        yield deletion
+
+
+def delete_objects(deletion, queryset, batch_size):
+    # Everything the objects cascade to goes first, so the final delete() has nothing left to collect and its
+    # signals (search index, autocomplete, counters) run for only the handful of objects themselves.
+    for alias, children in cascade(queryset):
+        yield from delete_in_batches(deletion, alias, children, batch_size)
+    with transaction.atomic():
+        rows, _ = queryset.delete()
+    deletion.rows_deleted += rows
+    deletion.stage = queryset.model._meta.verbose_name_plural
+    save_progress(deletion, ['rows_deleted', 'stage'])
+    yield deletion
+
+
+def run_deletion(deletion, batch_size=None):
+    """Removes one queued object, yielding the Deletion after every batch so callers can report progress."""
+    batch_size = batch_size or get_batch_size()
+    model = DELETABLE[deletion.model_name]
+    if model is Genre:
+        movies = Movie._base_manager.filter(genre_id=deletion.object_id).order_by('pk')
+        while ids := list(movies.values_list('pk', flat=True)[:batch_size]):
+            yield from delete_objects(deletion, Movie._base_manager.filter(pk__in=ids), batch_size)
+    yield from delete_objects(deletion, model._base_manager.filter(pk=deletion.object_id), batch_size)
+    deletion.finished_at = timezone.now()
+    deletion.stage = ''
+    save_progress(deletion, ['finished_at', 'stage'])
+    yield deletion
+
+
+def delete_pending(batch_size=None):
+    """
+    Works through the queue of requested deletions, oldest first, yielding
+    each Deletion after every batch. Batches are separate transactions, so
+    locks are held briefly, and a run that stops part way is picked up by
+    the next one: every step only deletes what is still there. Each Deletion
+    is claimed first, so concurrent runs (the worker of every process and
+    process_deletions) never work on the same one; a claim whose run has
+    saved no progress for MOVIES_DELETE_CLAIM_SECONDS can be taken over.
+    """
+    token = uuid.uuid4().hex
+    while (deletion := claim_next(token)) is not None:
+        try:
+            yield from run_deletion(deletion, batch_size)
+        except DeletionClaimLost:
+            logger.warning('Deletion of %s was taken over by another run.', deletion)
+
+
+def claim_next(token):
+    # One conditional UPDATE per attempt: of runs racing for the same row, only the first matches it.
+    while True:
+        claimable = Q(claimed_by='') | Q(updated_at__lt=timezone.now() - timedelta(seconds=get_claim_seconds()))
+        pk = Deletion.objects.filter(claimable, finished_at=None).order_by('pk').values_list('pk', flat=True).first()
+        if pk is None:
+            return None
+        claimed = Deletion.objects.filter(claimable, pk=pk, finished_at=None).update(
+            claimed_by=token, updated_at=timezone.now(),
+        )
+        if claimed:
+            return Deletion.objects.get(pk=pk)
+
+
+class DeletionWorker:
+    """
+    Per-process background thread running delete_pending() whenever a
+    deletion is requested, until the queue is empty. Requests made while it
+    runs are picked up before it stops. With MOVIES_DELETE_IN_BACKGROUND off
+    the queue is left to the process_deletions command.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.thread = None
+        self.wanted = False
+
+    def start(self):
+        if not deletes_in_background():
+            return
+        with self.lock:
+            self.wanted = True
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self.run, daemon=True)
+                self.thread.start()
+
+    def run(self):
+        try:
+            while True:
+                with self.lock:
+                    if not self.wanted:
+                        self.thread = None
+                        return
+                    self.wanted = False
+                for deletion in delete_pending():
+                    logger.info('Deleting %s: %s rows removed (%s)', deletion, deletion.rows_deleted,
+                                deletion.stage or 'done')
+        except DatabaseError:
+            logger.exception('Deleting pending objects failed; the next request or process_deletions resumes it.')
+        finally:
+            connections.close_all()
+
+
+worker = DeletionWorker()
+
+
+class DeferredDeleteMixin:
+    """Makes a DeleteView hide its object and queue it for removal instead of deleting it within the request."""
+
+    def form_valid(self, form):
+        request_deletion(self.object)
+        return HttpResponseRedirect(self.get_success_url())
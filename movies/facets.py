@@ -0,0 +1,465 @@
+import threading
+import time
+
+import numpy as np
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import Q
+
+from movies.cache import detail_cache
+from movies.models import Award, Genre, Movie, MovieAward, Person
+
+# (query string value, label, lower bound, upper bound) in minutes; the upper bound is exclusive.
+DURATION_BUCKETS = (
+    ('under-90', 'Under 90 min', 0, 90),
+    ('90-120', '90–120 min', 90, 120),
+    ('120-150', '120–150 min', 120, 150),
+    ('150-plus', '150 min or more', 150, None),
+)
+DURATION_KEYS = [key for key, _, _, _ in DURATION_BUCKETS]
+DURATION_EDGES = np.array([upper for _, _, _, upper in DURATION_BUCKETS[:-1]])
+RATING_THRESHOLDS = (9, 8, 7, 6, 5)
+# Directors and awards listed per facet, most frequent first; selected values are listed as well.
+VALUE_LIMIT = 10
+
+FACETS = (
+    ('genre', 'Genre'),
+    ('decade', 'Decade'),
+    ('duration', 'Duration'),
+    ('director', 'Director'),
+    ('award', 'Award'),
+    ('min_rating', 'Rating'),
+)
+# Facets whose values are ORed when several are picked; min_rating takes a single value.
+MULTI_VALUED = ('genre', 'decade', 'duration', 'director', 'award')
+
+MOVIE_ROW = np.dtype([('pk', 'i8'), ('genre', 'i8'), ('year', 'i8'), ('minutes', 'i8'),
+                      ('rating', 'f8'), ('ratings', 'i8')])
+LINK_ROW = np.dtype([('movie', 'i8'), ('target', 'i8')])
+INDEX_KEY = 'index'
+
+
+def get_max_age():
+    return getattr(settings, 'MOVIES_FACET_INDEX_MAX_AGE', 60)
+
+
+def get_search_limit():
+    return getattr(settings, 'MOVIES_FACET_SEARCH_LIMIT', 10000)
+
+
+def parse_ids(values):
+    return frozenset(int(value) for value in values if value.isdecimal() and len(value) < 10)
+
+
+def any_of(conditions):
+    combined = Q()
+    for condition in conditions:
+        combined |= condition
+    return combined
+
+
+class FacetSelection:
+    """The facet values picked in a movie list query string. Values of one facet are ORed, facets are ANDed."""
+
+    def __init__(self, chosen=None, min_rating=None):
+        chosen = chosen or {}
+        self.chosen = {name: frozenset(chosen.get(name, ())) for name in MULTI_VALUED}
+        self.min_rating = min_rating
+
+    @classmethod
+    def from_query(cls, params):
+        chosen = {name: parse_ids(params.getlist(name)) for name in ('genre', 'decade', 'director', 'award')}
+        chosen['decade'] = frozenset(decade for decade in chosen['decade'] if decade % 10 == 0)
+        chosen['duration'] = frozenset(key for key in params.getlist('duration') if key in DURATION_KEYS)
+        rating = params.get('min_rating', '')
+        min_rating = int(rating) if rating.isdecimal() and int(rating) in RATING_THRESHOLDS else None
+        return cls(chosen, min_rating)
+
+    def __bool__(self):
+        return self.min_rating is not None or any(self.chosen.values())
+
+    def is_selected(self, name, value):
+        if name == 'min_rating':
+            return value == self.min_rating
+        return value in self.chosen[name]
+
+    def filter(self, queryset):
+        chosen = self.chosen
+        if chosen['genre']:
+            queryset = queryset.filter(genre_id__in=chosen['genre'])
+        if chosen['decade']:
+            queryset = queryset.filter(any_of(
+                Q(release_year__gte=decade, release_year__lt=decade + 10) for decade in chosen['decade']
+            ))
+        if chosen['duration']:
+            queryset = queryset.filter(any_of(
+                Q(duration_minutes__gte=lower, **({'duration_minutes__lt': upper} if upper else {}))
+                for key, _, lower, upper in DURATION_BUCKETS if key in chosen['duration']
+            ))
+        if chosen['director']:
+            directing = Movie.directors.through.objects.filter(person_id__in=chosen['director'])
+            queryset = queryset.filter(pk__in=directing.values('movie_id'))
+        if chosen['award']:
+            awarded = MovieAward.objects.filter(award_id__in=chosen['award'])
+            queryset = queryset.filter(pk__in=awarded.values('movie_id'))
+        if self.min_rating is not None:
+            queryset = queryset.filter(rating_count__gt=0, rating_avg__gte=self.min_rating)
+        return queryset
+
+
+class FacetIndex:
+    """
+    Every movie's facet values held as column arrays sorted by pk, with the
+    director and award links as (position, id) pairs. Counting every facet
+    under any selection is then a handful of vectorised passes over memory
+    instead of a GROUP BY per facet. Each facet is counted under the other
+    facets' filters only, so its unpicked values show what picking them adds.
+    Deleted movies are only marked dead; a rebuild drops them.
+    """
+
+    def __init__(self, stamp=None):
+        self.lock = threading.RLock()
+        self.stamp = stamp
+        self.built_at = time.monotonic()
+        self.ids = np.empty(0, dtype=np.int64)
+        self.alive = np.empty(0, dtype=bool)
+        self.genre = np.empty(0, dtype=np.int64)
+        self.decade = np.empty(0, dtype=np.int64)
+        self.duration = np.empty(0, dtype=np.int64)
+        # Whole stars of rating_avg plus one, 0 for movies nobody rated; the rating thresholds are whole numbers.
+        self.stars = np.empty(0, dtype=np.int64)
+        self.links = {
+            'director': (np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)),
+            'award': (np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)),
+        }
+        self.labels = {'genre': {}, 'award': {}}
+
+    @classmethod
+    def build(cls, stamp=None):
+        index = cls(stamp)
+        movies = Movie.objects.order_by('pk').values_list(
+            'pk', 'genre_id', 'release_year', 'duration_minutes', 'rating_avg', 'rating_count',
+        )
+        rows = np.fromiter(movies.iterator(chunk_size=20000), dtype=MOVIE_ROW)
+        index.ids = rows['pk'].copy()
+        index.alive = np.ones(len(rows), dtype=bool)
+        index.genre = rows['genre'].copy()
+        index.decade = rows['year'] // 10
+        index.duration = np.searchsorted(DURATION_EDGES, rows['minutes'], side='right')
+        index.stars = np.where(rows['ratings'] > 0, np.floor(rows['rating']).astype(np.int64) + 1, 0)
+        directing = Movie.directors.through.objects.filter(person__pending_delete=False)
+        directing = directing.values_list('movie_id', 'person_id')
+        index.links['director'] = index.locate(np.fromiter(directing.iterator(chunk_size=20000), dtype=LINK_ROW))
+        awards = MovieAward.objects.values_list('movie_id', 'award_id')
+        index.links['award'] = index.locate(np.fromiter(awards.iterator(chunk_size=20000), dtype=LINK_ROW))
+        index.labels['genre'] = dict(Genre.objects.values_list('pk', 'name'))
+        index.labels['award'] = dict(Award.objects.values_list('pk', 'name'))
+        return index
+
+    def age(self):
+        return time.monotonic() - self.built_at
+
+    def position(self, pk):
+        position = int(np.searchsorted(self.ids, pk))
+        return position if position < len(self.ids) and self.ids[position] == pk else None
+
+    def locate(self, links):
+        # (movie pk, target) rows to (movie position, target) arrays, dropping rows of movies not indexed.
+        positions = np.searchsorted(self.ids, links['movie'])
+        found = positions < len(self.ids)
+        found[found] = self.ids[positions[found]] == links['movie'][found]
+        return positions[found], links['target'][found].copy()
+
+    def put_movie(self, pk, genre_id, year, minutes):
+        with self.lock:
+            position = self.position(pk)
+            if position is None:
+                position = int(np.searchsorted(self.ids, pk))
+                self.ids = np.insert(self.ids, position, pk)
+                self.alive = np.insert(self.alive, position, True)
+                self.genre = np.insert(self.genre, position, genre_id)
+                self.decade = np.insert(self.decade, position, year // 10)
+                self.duration = np.insert(self.duration, position, np.searchsorted(DURATION_EDGES, minutes, 'right'))
+                self.stars = np.insert(self.stars, position, 0)
+                for name, (positions, targets) in self.links.items():
+                    self.links[name] = np.where(positions >= position, positions + 1, positions), targets
+                return
+            self.alive[position] = True
+            self.genre[position] = genre_id
+            self.decade[position] = year // 10
+            self.duration[position] = np.searchsorted(DURATION_EDGES, minutes, side='right')
+
+    def remove_movie(self, pk):
+        with self.lock:
+            position = self.position(pk)
+            if position is not None:
+                self.alive[position] = False
+
+    def set_ratings(self, rows):
+        with self.lock:
+            for pk, rating_avg, rating_count in rows:
+                position = self.position(pk)
+                if position is not None:
+                    self.stars[position] = int(rating_avg) + 1 if rating_count else 0
+
+    def set_links(self, name, movie_ids, links):
+        """Replaces the `name` links of the given movies with (movie pk, target) pairs."""
+        with self.lock:
+            positions, targets = self.links[name]
+            moved = [position for position in map(self.position, movie_ids) if position is not None]
+            keep = ~np.isin(positions, moved)
+            added_positions, added_targets = self.locate(np.array(links, dtype=LINK_ROW))
+            self.links[name] = (np.concatenate([positions[keep], added_positions]),
+                                np.concatenate([targets[keep], added_targets]))
+
+    def set_label(self, name, pk, label):
+        with self.lock:
+            self.labels[name][pk] = label
+
+    def masks(self, selection, within=None):
+        chosen, masks = selection.chosen, {}
+        if chosen['genre']:
+            masks['genre'] = lookup(self.genre, chosen['genre'])
+        if chosen['decade']:
+            masks['decade'] = lookup(self.decade, [decade // 10 for decade in chosen['decade']])
+        if chosen['duration']:
+            masks['duration'] = lookup(self.duration, [DURATION_KEYS.index(key) for key in chosen['duration']])
+        for name in ('director', 'award'):
+            if chosen[name]:
+                positions, targets = self.links[name]
+                mask = np.zeros(len(self.ids), dtype=bool)
+                mask[positions[lookup(targets, chosen[name])]] = True
+                masks[name] = mask
+        if selection.min_rating is not None:
+            masks['min_rating'] = self.stars > selection.min_rating
+        if within is not None:
+            within = np.asarray(within, dtype=np.int64)
+            mask = np.zeros(len(self.ids), dtype=bool)
+            if len(self.ids):
+                positions = np.minimum(np.searchsorted(self.ids, within), len(self.ids) - 1)
+                mask[positions[self.ids[positions] == within]] = True
+            masks[None] = mask
+        return masks
+
+    def counts(self, selection, within=None, limit=VALUE_LIMIT):
+        """
+        {facet: {value: count}} for the live movies matching `selection`
+        (and whose pks are in `within`, if given), each facet ignoring its own
+        picks. Decades are keyed by their first year, durations by bucket key;
+        directors and awards are cut to the `limit` most frequent plus the
+        picked ones.
+        """
+        with self.lock:
+            masks = self.masks(selection, within)
+            combined = {}
+
+            def matching(excluded):
+                key = frozenset(name for name in masks if name != excluded)
+                if key not in combined:
+                    mask = self.alive.copy()
+                    for name in key:
+                        mask &= masks[name]
+                    combined[key] = mask
+                return combined[key]
+
+            stars = tally(self.stars, matching('min_rating'), minlength=12)
+            return {
+                'genre': nonzero(tally(self.genre, matching('genre'))),
+                'decade': {decade * 10: count
+                           for decade, count in nonzero(tally(self.decade, matching('decade'))).items()},
+                'duration': {DURATION_KEYS[bucket]: count
+                             for bucket, count in nonzero(tally(self.duration, matching('duration'))).items()},
+                'director': self.link_counts('director', matching('director'), selection.chosen['director'], limit),
+                'award': self.link_counts('award', matching('award'), selection.chosen['award'], limit),
+                'min_rating': {threshold: int(stars[threshold + 1:].sum()) for threshold in RATING_THRESHOLDS},
+            }
+
+    def link_counts(self, name, mask, chosen, limit):
+        positions, targets = self.links[name]
+        counts = tally(targets, mask[positions])
+        top = np.flatnonzero(counts)
+        if len(top) > limit:
+            top = top[np.argpartition(counts[top], -limit)[-limit:]]
+        picked = [value for value in chosen if value < len(counts)]
+        values = np.union1d(top, np.array(picked, dtype=np.int64))
+        return dict(zip(values.tolist(), counts[values].tolist()))
+
+
+def lookup(codes, values):
+    # Both much faster than np.isin(), which sorts: a few comparisons, or a boolean table indexed by code.
+    values = list(values)
+    if len(values) <= 4:
+        mask = codes == values[0]
+        for value in values[1:]:
+            mask |= codes == value
+        return mask
+    table = np.zeros(int(codes.max(initial=-1)) + 1, dtype=bool)
+    table[[value for value in values if value < len(table)]] = True
+    return table[codes]
+
+
+def tally(codes, mask, minlength=0):
+    # Copying out the matching codes pays off for narrow selections; otherwise weighting by the mask is faster.
+    if np.count_nonzero(mask) * 16 < len(mask):
+        return np.bincount(codes[mask], minlength=minlength)
+    return np.bincount(codes, weights=mask, minlength=minlength).astype(np.int64)
+
+
+def nonzero(counts):
+    values = np.flatnonzero(counts)
+    return dict(zip(values.tolist(), counts[values].tolist()))
+
+
+_index = None
+_index_lock = threading.Lock()
+_refreshing = threading.Event()
+
+
+def get_facet_index():
+    """
+    The process's facet index, built on first use. Writes made by this process
+    patch it when they commit; writes anywhere replace a shared stamp, and an
+    index older than MOVIES_FACET_INDEX_MAX_AGE seconds that has missed one is
+    rebuilt in a background thread while requests keep using it.
+    """
+    global _index
+    stamp = detail_cache.version('facets', INDEX_KEY)
+    index = _index
+    if index is None:
+        with _index_lock:
+            if _index is None:
+                _index = FacetIndex.build(stamp)
+            return _index
+    if index.stamp != stamp and index.age() >= get_max_age() and not _refreshing.is_set():
+        _refreshing.set()
+        threading.Thread(target=_rebuild, args=(stamp,), name='facet-index', daemon=True).start()
+    return index
+
+
+def _rebuild(stamp):
+    global _index
+    try:
+        index = FacetIndex.build(stamp)
+        with _index_lock:
+            _index = index
+    finally:
+        connections.close_all()
+        _refreshing.clear()
+
+
+def reset_facet_index():
+    global _index
+    _index = None
+
+
+def _changed(update=None):
+    detail_cache.invalidate('facets', [INDEX_KEY])
+    index = _index
+    if index is not None and update is not None:
+        transaction.on_commit(lambda: update(index))
+
+
+def index_movie(movie):
+    pk, genre_id, year, minutes = movie.pk, movie.genre_id, movie.release_year, movie.duration_minutes
+    _changed(lambda index: index.put_movie(pk, genre_id, year, minutes))
+
+
+def unindex_movie(pk):
+    _changed(lambda index: index.remove_movie(pk))
+
+
+def index_ratings(movies):
+    rows = [(movie.pk, movie.rating_avg, movie.rating_count) for movie in movies]
+    _changed(lambda index: index.set_ratings(rows))
+
+
+def index_directors(movie_ids):
+    movie_ids = list(movie_ids)
+    _changed(lambda index: index.set_links('director', movie_ids, list(
+        Movie.directors.through.objects.filter(movie_id__in=movie_ids, person__pending_delete=False)
+        .values_list('movie_id', 'person_id')
+    )))
+
+
+def index_awards(movie_ids):
+    movie_ids = list(movie_ids)
+    _changed(lambda index: index.set_links('award', movie_ids, list(
+        MovieAward.objects.filter(movie_id__in=movie_ids).values_list('movie_id', 'award_id')
+    )))
+
+
+def index_label(name, pk, label):
+    _changed(lambda index: index.set_label(name, pk, label))
+
+
+def index_bulk_changes():
+    # Bulk writes send no signals; other processes and this one pick them up with the next rebuild.
+    _changed()
+
+
+def value_label(name, value):
+    if name == 'decade':
+        return f'{value}s'
+    if name == 'duration':
+        return DURATION_BUCKETS[DURATION_KEYS.index(value)][1]
+    if name == 'min_rating':
+        return f'{value}+ ★'
+    return None
+
+
+def facet_counts(selection, within=None):
+    """
+    The facets shown beside the movie list: a list of {'name', 'title',
+    'values'} dicts whose values carry value, label, count and selected.
+    Director names cost one query; everything else comes from the index.
+    """
+    index = get_facet_index()
+    counts = index.counts(selection, within)
+    for name in MULTI_VALUED:
+        # Picked values stay listed, even without matches, so they can be unpicked.
+        for value in selection.chosen[name]:
+            counts[name].setdefault(value, 0)
+    labels = {name: dict(index.labels[name]) for name in index.labels}
+    if counts['director']:
+        persons = Person.objects.filter(pk__in=counts['director']).only('first_name', 'last_name')
+        labels['director'] = {person.pk: str(person) for person in persons}
+    orderings = {
+        'genre': lambda item: (-item[1], labels['genre'].get(item[0], '')),
+        'decade': lambda item: -item[0],
+        'duration': lambda item: DURATION_KEYS.index(item[0]),
+        'director': lambda item: (-item[1], labels['director'].get(item[0], '')),
+        'award': lambda item: (-item[1], labels['award'].get(item[0], '')),
+        'min_rating': lambda item: -item[0],
+    }
+    facets = []
+    for name, title in FACETS:
+        values = []
+        for value, count in sorted(counts[name].items(), key=orderings[name]):
+            selected = selection.is_selected(name, value)
+            label = labels[name].get(value) if name in labels else value_label(name, value)
+            # Values of deleted genres, awards or directors linger in the index until the next rebuild.
+            if label is not None and (count or selected):
+                values.append({'value': value, 'label': label, 'count': count, 'selected': selected})
+        facets.append({'name': name, 'title': title, 'values': values})
+    return facets
+
+
+def clear_url(params):
+    query = params.copy()
+    for name in ('cursor',) + tuple(name for name, _ in FACETS):
+        query.pop(name, None)
+    return f'?{query.urlencode()}'
+
+
+def toggle_url(params, name, value):
+    """Query string of the list with `value` picked or unpicked, starting again from the first page."""
+    query = params.copy()
+    query.pop('cursor', None)
+    value = str(value)
+    current = query.getlist(name)
+    if name == 'min_rating':
+        current = [] if current == [value] else [value]
+    else:
+        current = [item for item in current if item != value] if value in current else current + [value]
+    query.setlist(name, current)
+    return f'?{query.urlencode()}'
@@ -0,0 +1,111 @@
+from itertools import islice
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import CharField, F, Value
+
+from movies.models import Cast, Credit, Movie
+
+# Column order of a filmography row. In a union Django selects model fields before annotations, so both
+# branches list their fields (movie_id, and role_name on Cast) first and annotate the rest in this order.
+CREDIT_FIELDS = ('movie_id', 'role_name', 'kind', 'title', 'release_year')
+CREDIT_ORDERING = ('-release_year', 'title', 'movie_id', 'kind')
+
+Directing = Movie.directors.through
+
+
+def credits_table_enabled():
+    return getattr(settings, 'MOVIES_CREDITS_TABLE', False)
+
+
+def _credit_rows(directing, casts):
+    movie_columns = {'title': F('movie__title'), 'release_year': F('movie__release_year')}
+    directing = directing.annotate(
+        role_name=Value('', output_field=CharField()),
+        kind=Value(Credit.DIRECTOR, output_field=CharField()),
+        **movie_columns,
+    )
+    casts = casts.annotate(kind=Value(Credit.ACTOR, output_field=CharField()), **movie_columns)
+    return directing, casts
+
+
+def filmography(person):
+    """
+    A person's directing and acting credits as one queryset of named rows
+    (CREDIT_FIELDS), newest first. Reads the Credit table when
+    MOVIES_CREDITS_TABLE is on, otherwise a single UNION ALL over the director
+    links and cast rows.
+    """
+    if credits_table_enabled():
+        credits = Credit.objects.filter(person=person, movie__pending_delete=False)
+        return credits.values_list(*CREDIT_FIELDS, named=True).order_by(*CREDIT_ORDERING)
+    live = {'person': person, 'movie__pending_delete': False}
+    directing, casts = _credit_rows(Directing.objects.filter(**live), Cast.objects.filter(**live))
+    return (
+        directing.values_list(*CREDIT_FIELDS, named=True)
+        .union(casts.values_list(*CREDIT_FIELDS, named=True), all=True)
+        .order_by(*CREDIT_ORDERING)
+    )
+
+
+def sync_cast_credit(cast):
+    movie = Movie.objects.values('title', 'release_year').get(pk=cast.movie_id)
+    Credit.objects.update_or_create(cast=cast, defaults={
+        'person_id': cast.person_id, 'movie_id': cast.movie_id, 'kind': Credit.ACTOR, 'role_name': cast.role_name,
+        **movie,
+    })
+
+
+def rebuild_cast_credits(movie_id):
+    """Rewrites the acting credits of one movie from its cast rows, for writes that bypass post_save."""
+    Credit.objects.filter(movie_id=movie_id, kind=Credit.ACTOR).delete()
+    _, casts = _credit_rows(Directing.objects.none(), Cast.objects.filter(movie_id=movie_id))
+    fields = ('person_id', 'movie_id', 'role_name', 'kind', 'title', 'release_year', 'pk')
+    Credit.objects.bulk_create(
+        Credit(**dict(zip(fields[:-1] + ('cast_id',), row))) for row in casts.order_by().values_list(*fields)
+    )
+
+
+def add_directing_credits(pairs):
+    """Creates the directing credits for (movie_id, person_id) pairs that do not have one yet."""
+    pairs = set(pairs)
+    if not pairs:
+        return
+    movies = {row['pk']: row for row in Movie.objects.filter(pk__in={movie_id for movie_id, _ in pairs})
+              .values('pk', 'title', 'release_year')}
+    Credit.objects.bulk_create([
+        Credit(person_id=person_id, movie_id=movie_id, kind=Credit.DIRECTOR,
+               title=movies[movie_id]['title'], release_year=movies[movie_id]['release_year'])
+        for movie_id, person_id in pairs if movie_id in movies
+    ], ignore_conflicts=True)
+
+
+def remove_directing_credits(movie_ids=None, person_ids=None):
+    credits = Credit.objects.filter(kind=Credit.DIRECTOR)
+    if movie_ids is not None:
+        credits = credits.filter(movie_id__in=movie_ids)
+    if person_ids is not None:
+        credits = credits.filter(person_id__in=person_ids)
+    credits.delete()
+
+
+def update_movie_credits(movie):
+    Credit.objects.filter(movie=movie).exclude(title=movie.title, release_year=movie.release_year).update(
+        title=movie.title, release_year=movie.release_year,
+    )
+
+
+def rebuild_credits(person_ids=None, batch_size=1000):
+    """Rewrites the Credit table from the director links and cast rows, for every person or only `person_ids`."""
+    directing, casts = Directing.objects.all(), Cast.objects.all()
+    if person_ids is not None:
+        directing, casts = directing.filter(person_id__in=person_ids), casts.filter(person_id__in=person_ids)
+    directing, casts = _credit_rows(directing, casts)
+    fields = ('person_id', 'movie_id', 'role_name', 'kind', 'title', 'release_year')
+    with transaction.atomic():
+        (Credit.objects.filter(person_id__in=person_ids) if person_ids is not None else Credit.objects.all()).delete()
+        # Directing rows have no cast, so zip() leaves their cast_id unset.
+        for queryset, extra in ((directing, ()), (casts, ('pk',))):
+            rows = queryset.order_by().values_list(*fields, *extra).iterator(chunk_size=batch_size)
+            while batch := list(islice(rows, batch_size)):
+                Credit.objects.bulk_create(Credit(**dict(zip(fields + ('cast_id',), row))) for row in batch)
@@ -1,5 +1,7 @@
 from django import forms
+from .casting import ACTOR_ROLES, DIRECTOR_ROLES, parse_rows
 from .models import Movie, Genre, Person, Cast, Award, MovieAward, Review
+from .widgets import AutocompleteSelect, AutocompleteSelectMultiple
 
 
 class MovieForm(forms.ModelForm):
@@ -11,8 +13,9 @@ class MovieForm(forms.ModelForm):
             'description': forms.Textarea(attrs={'class': 'form-control', 'placeholder': 'Opis...'}),
             'release_year': forms.NumberInput(attrs={'class': 'form-control', 'placeholder': 'Rok wydania'}),
             'duration_minutes': forms.NumberInput(attrs={'class': 'form-control', 'placeholder': 'Czas trwania'}),
-            'genre': forms.Select(attrs={'class': 'form-control'}),
-            'directors': forms.SelectMultiple(attrs={'class': 'form-control', 'placeholder': 'Wybierz reżyserów'}),
+            'genre': AutocompleteSelect('genre', attrs={'class': 'form-control'}),
+            'directors': AutocompleteSelectMultiple('person', params={'role': 'director'},
+                                                    attrs={'class': 'form-control', 'placeholder': 'Wybierz reżyserów'}),
         }
 
     def __init__(self, *args, **kwargs):
@@ -36,6 +39,77 @@ class CastForm(forms.ModelForm):
     class Meta:
         model = Cast
         fields = ['movie', 'person', 'role_name']
+        widgets = {
+            'movie': AutocompleteSelect('movie'),
+            'person': AutocompleteSelect('person', params={'role': 'actor'}),
+        }
+
+
+def parse_person_id(value):
+    # Decimal digits only (isdigit() passes '²', which int() rejects) and short enough for an integer pk column.
+    return int(value) if value.isdecimal() and len(value) < 10 else None
+
+
+class BulkCastForm(forms.Form):
+    cast = forms.CharField(
+        required=False, widget=forms.Textarea(attrs={'rows': 15, 'class': 'font-monospace'}),
+        help_text='One actor per line: person id, a tab and the role name. Anything after a second tab is ignored.',
+    )
+    directors = forms.CharField(
+        required=False, widget=forms.Textarea(attrs={'rows': 4, 'class': 'font-monospace'}),
+        help_text='One person id per line.',
+    )
+
+    def clean_cast(self):
+        rows, errors, seen = [], [], set()
+        for number, (value, role_name) in parse_rows(self.cleaned_data['cast'], 2):
+            person_id = parse_person_id(value)
+            if person_id is None:
+                errors.append(f'Line {number}: "{value}" is not a person id.')
+            elif not role_name:
+                errors.append(f'Line {number}: the role name is missing.')
+            elif len(role_name) > Cast._meta.get_field('role_name').max_length:
+                errors.append(f'Line {number}: the role name is too long.')
+            elif (person_id, role_name) in seen:
+                errors.append(f'Line {number}: the same person and role appear twice.')
+            else:
+                seen.add((person_id, role_name))
+                rows.append((number, person_id, role_name))
+        if errors:
+            raise forms.ValidationError(errors)
+        return rows
+
+    def clean_directors(self):
+        rows, errors = [], []
+        for number, (value,) in parse_rows(self.cleaned_data['directors'], 1):
+            person_id = parse_person_id(value)
+            if person_id is None:
+                errors.append(f'Line {number}: "{value}" is not a person id.')
+            else:
+                rows.append((number, person_id))
+        if errors:
+            raise forms.ValidationError(errors)
+        return rows
+
+    def clean(self):
+        cleaned_data = super().clean()
+        cast, directors = cleaned_data.get('cast'), cleaned_data.get('directors')
+        if cast is None or directors is None:
+            return cleaned_data
+        # Every referenced person is read in one query, whatever the number of lines.
+        persons = Person.objects.only('first_name', 'last_name', 'role').in_bulk(
+            {row[1] for row in cast} | {row[1] for row in directors}
+        )
+        for field, rows, roles, noun in (('cast', cast, ACTOR_ROLES, 'an actor'),
+                                         ('directors', directors, DIRECTOR_ROLES, 'a director')):
+            for number, person_id, *_ in rows:
+                if person_id not in persons:
+                    self.add_error(field, f'Line {number}: there is no person {person_id}.')
+                elif persons[person_id].role not in roles:
+                    self.add_error(field, f'Line {number}: {persons[person_id]} is not {noun}.')
+        cleaned_data['wanted_cast'] = [(person_id, role_name) for _, person_id, role_name in cast]
+        cleaned_data['director_ids'] = [person_id for _, person_id in directors]
+        return cleaned_data
 
 
 class AwardForm(forms.ModelForm):
@@ -49,11 +123,21 @@ class MovieAwardForm(forms.ModelForm):
         model = MovieAward
         fields = ['award', 'category']
 
+    def _get_validation_exclusions(self):
+        # The view sets the movie rather than posting it; left excluded, unique_movie_award would never be checked.
+        exclude = super()._get_validation_exclusions()
+        if self.instance.movie_id is not None:
+            exclude.discard('movie')
+        return exclude
+
 
 class ReviewForm(forms.ModelForm):
     class Meta:
         model = Review
         fields = ['movie', 'rating', 'text']
+        widgets = {
+            'movie': AutocompleteSelect('movie'),
+        }
 
     def __init__(self, *args, **kwargs):
         self.user = kwargs.pop('user', None)
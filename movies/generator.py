@@ -0,0 +1,216 @@
+import datetime
+
+import numpy as np
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models import Max
+
+from movies.cache import detail_cache
+from movies.catalog import CatalogStats
+from movies.filmography import Directing, credits_table_enabled, rebuild_credits
+from movies.models import Award, Cast, Credit, Genre, Movie, MovieAward, Person, Review
+
+VOCABULARY = [
+    'night', 'city', 'love', 'war', 'storm', 'river', 'ghost', 'king', 'dream', 'shadow', 'summer', 'winter',
+    'road', 'island', 'secret', 'fire', 'ocean', 'mountain', 'star', 'stranger', 'empire', 'garden', 'silence',
+    'machine', 'letter', 'harbor', 'desert', 'forest', 'mirror', 'train', 'wolf', 'crown', 'echo', 'last',
+    'first', 'broken', 'golden', 'hidden', 'lost', 'silver', 'dark', 'wild', 'quiet', 'burning', 'frozen',
+]
+FIRST_NAMES = [
+    'Anna', 'Piotr', 'Maria', 'John', 'Emma', 'Luca', 'Sofia', 'Kenji', 'Amara', 'Noah', 'Ingrid', 'Mateo',
+    'Chloe', 'Ravi', 'Olga', 'Samuel', 'Yuki', 'Fatima', 'Oscar', 'Lena', 'Diego', 'Hana', 'Victor', 'Zofia',
+]
+LAST_NAMES = [
+    'Kowalski', 'Smith', 'Rossi', 'Tanaka', 'Novak', 'Garcia', 'Okafor', 'Larsen', 'Dubois', 'Schmidt',
+    'Haddad', 'Silva', 'Nowak', 'Ivanova', 'Kim', 'Brown', 'Moreau', 'Santos', 'Fischer', 'Patel',
+]
+GENRES = [
+    'Drama', 'Comedy', 'Thriller', 'Action', 'Romance', 'Horror', 'Documentary', 'Crime', 'Adventure',
+    'Science Fiction', 'Animation', 'Fantasy', 'Mystery', 'Family', 'War', 'Western', 'Musical', 'History',
+]
+AWARDS = ['Oscar', 'Golden Globe', 'BAFTA', 'Palme d\'Or', 'Golden Lion', 'Golden Bear', 'César', 'Goya']
+AWARD_CATEGORIES = ['Best Picture', 'Best Director', 'Best Actor', 'Best Actress', 'Best Screenplay']
+
+# Catalog sizes for generate_catalog and benchmark --scale, named after their movie count.
+SCALES = {
+    '1k': {'movies': 1_000, 'persons': 2_000, 'reviews': 10_000},
+    '100k': {'movies': 100_000, 'persons': 150_000, 'reviews': 1_000_000},
+    '1m': {'movies': 1_000_000, 'persons': 1_000_000, 'reviews': 10_000_000},
+}
+
+# Share of movies that won an award, and of persons who both act and direct or only direct.
+AWARDED_SHARE = 0.03
+ROLE_SHARES = {Person.ACTOR: 0.7, Person.BOTH: 0.15, Person.DIRECTOR: 0.15}
+
+
+class ZipfSampler:
+    """Draws indices into range(size) with P(i) proportional to 1 / (i + 1) ** exponent."""
+
+    def __init__(self, size, exponent):
+        weights = 1.0 / np.arange(1, size + 1, dtype=np.float64) ** exponent
+        self.cumulative = np.cumsum(weights) / weights.sum()
+
+    def sample(self, rng, count):
+        return np.minimum(np.searchsorted(self.cumulative, rng.random(count)), len(self.cumulative) - 1)
+
+
+class CatalogGenerator:
+    """
+    Bulk-inserts a synthetic catalog shaped like real data: reviews per movie
+    and per user follow Zipf's law, cast sizes are log-normal with a long tail
+    and a few prolific people hold most credits. The same seed and sizes
+    produce the same catalog. Rows are added to whatever is already stored.
+    """
+
+    def __init__(self, seed=0, batch_size=5000):
+        self.rng = np.random.default_rng(seed)
+        self.batch_size = batch_size
+
+    def generate(self, movies, persons, reviews, users=None):
+        users = users if users is not None else max(1, reviews // 20)
+        with transaction.atomic():
+            genre_ids = yield from self.stage('genres', self.create_genres)
+            roles = self.rng.choice(list(ROLE_SHARES), size=persons, p=list(ROLE_SHARES.values()))
+            person_ids = yield from self.stage('persons', self.create_persons, roles)
+            movie_ids = yield from self.stage('movies', self.create_movies, movies, genre_ids)
+            yield from self.stage('directors', self.create_directors, movie_ids, person_ids[roles != Person.ACTOR])
+            yield from self.stage('casts', self.create_casts, movie_ids, person_ids[roles != Person.DIRECTOR])
+            yield from self.stage('awards', self.create_awards, movie_ids)
+            user_ids = yield from self.stage('users', self.create_users, users)
+            yield from self.stage('reviews', self.create_reviews, reviews, movie_ids, user_ids)
+            # Bulk inserts send no signals: retire cached pages and derive the credits table at once.
+            detail_cache.invalidate_all()
+            if credits_table_enabled():
+                yield from self.stage('credits', self.create_credits)
+
+    def stage(self, entity, create, *args):
+        stats = CatalogStats(entity)
+        created = create(*args)
+        stats.rows = len(created)
+        yield stats.finish()
+        return created
+
+    def batches(self, count):
+        for start in range(0, count, self.batch_size):
+            yield start, min(start + self.batch_size, count)
+
+    def words(self, count):
+        # Squared uniform draws skew towards the start of the vocabulary, like real word frequencies.
+        return ' '.join(VOCABULARY[int(len(VOCABULARY) * draw ** 2)] for draw in self.rng.random(count))
+
+    def popular(self, ids, exponent):
+        """Returns a function sampling `ids` with Zipf skew; which ids are the popular ones is itself random."""
+        ranked, sampler = self.rng.permutation(ids), ZipfSampler(len(ids), exponent)
+        return lambda count: ranked[sampler.sample(self.rng, count)]
+
+    def create_genres(self):
+        existing = dict(Genre.objects.filter(name__in=GENRES).values_list('name', 'pk'))
+        created = Genre.objects.bulk_create(Genre(name=name) for name in GENRES if name not in existing)
+        return np.array(list(existing.values()) + [genre.pk for genre in created], dtype=np.int64)
+
+    def create_persons(self, roles):
+        ids = []
+        for start, end in self.batches(len(roles)):
+            born = self.rng.integers(1920, 2005, end - start)
+            died = self.rng.random(end - start) < 0.1
+            ids += [person.pk for person in Person.objects.bulk_create(
+                Person(
+                    first_name=FIRST_NAMES[self.rng.integers(len(FIRST_NAMES))],
+                    last_name=LAST_NAMES[self.rng.integers(len(LAST_NAMES))],
+                    birth_date=datetime.date(int(year), 1 + i % 12, 1 + i % 28),
+                    death_date=datetime.date(min(int(year) + 60, 2025), 6, 1) if dead else None,
+                    role=role,
+                )
+                for i, (year, dead, role) in enumerate(zip(born, died, roles[start:end]))
+            )]
+        return np.array(ids, dtype=np.int64)
+
+    def create_movies(self, count, genre_ids):
+        genres = ZipfSampler(len(genre_ids), 1.0)
+        ids = []
+        for start, end in self.batches(count):
+            size = end - start
+            # Skewed towards recent years, like any film database.
+            years = 2025 - (105 * self.rng.random(size) ** 2).astype(int)
+            durations = np.clip(self.rng.normal(105, 20, size), 60, 240).astype(int)
+            ids += [movie.pk for movie in Movie.objects.bulk_create(
+                Movie(title=f'{self.words(int(self.rng.integers(1, 5))).title()} {start + i}',
+                      description=self.words(int(self.rng.integers(15, 60))), release_year=int(year),
+                      duration_minutes=int(duration), genre_id=int(genre_ids[genre]))
+                for i, (year, duration, genre) in enumerate(zip(years, durations, genres.sample(self.rng, size)))
+            )]
+        return np.array(ids, dtype=np.int64)
+
+    def create_directors(self, movie_ids, director_ids):
+        if not len(director_ids):
+            return []
+        directors, created = self.popular(director_ids, 0.8), 0
+        for start, end in self.batches(len(movie_ids)):
+            movies = movie_ids[start:end]
+            # Most movies have one director, some a pair.
+            movies = np.concatenate([movies, movies[self.rng.random(len(movies)) < 0.08]])
+            pairs = dict.fromkeys(zip(movies.tolist(), directors(len(movies)).tolist()))
+            created += len(Directing.objects.bulk_create(
+                Directing(movie_id=movie, person_id=person) for movie, person in pairs
+            ))
+        return range(created)
+
+    def create_casts(self, movie_ids, actor_ids):
+        if not len(actor_ids):
+            return []
+        actors, created = self.popular(actor_ids, 0.9), 0
+        for start, end in self.batches(len(movie_ids)):
+            movies = movie_ids[start:end]
+            sizes = np.minimum(self.rng.lognormal(2.0, 0.9, len(movies)).astype(int), min(300, len(actor_ids)))
+            people = iter(actors(int(sizes.sum())).tolist())
+            casts = []
+            for movie, size in zip(movies.tolist(), sizes.tolist()):
+                members = dict.fromkeys(next(people) for _ in range(size))
+                casts += [Cast(movie_id=movie, person_id=person, role_name=f'Character {n}')
+                          for n, person in enumerate(members, start=1)]
+            created += len(Cast.objects.bulk_create(casts, batch_size=self.batch_size))
+        return range(created)
+
+    def create_awards(self, movie_ids):
+        existing = dict(Award.objects.filter(name__in=AWARDS).values_list('name', 'pk'))
+        created = Award.objects.bulk_create(Award(name=name) for name in AWARDS if name not in existing)
+        award_ids = list(existing.values()) + [award.pk for award in created]
+        winners = movie_ids[self.rng.random(len(movie_ids)) < AWARDED_SHARE]
+        return MovieAward.objects.bulk_create([
+            MovieAward(movie_id=int(movie), award_id=award_ids[self.rng.integers(len(award_ids))],
+                       category=AWARD_CATEGORIES[self.rng.integers(len(AWARD_CATEGORIES))])
+            for movie in winners
+        ], batch_size=self.batch_size)
+
+    def create_users(self, count):
+        first = (User.objects.aggregate(last=Max('pk'))['last'] or 0) + 1
+        password = make_password(None)
+        ids = []
+        for start, end in self.batches(count):
+            ids += [user.pk for user in User.objects.bulk_create(
+                User(username=f'reader{first + i}', password=password) for i in range(start, end)
+            )]
+        return np.array(ids, dtype=np.int64)
+
+    def create_reviews(self, count, movie_ids, user_ids):
+        if not len(movie_ids) or not len(user_ids):
+            return []
+        movies, readers = self.popular(movie_ids, 1.07), self.popular(user_ids, 0.8)
+        quality = dict(zip(movie_ids.tolist(), np.clip(self.rng.normal(6.5, 1.5, len(movie_ids)), 1, 10).tolist()))
+        created = 0
+        for start, end in self.batches(count):
+            size = end - start
+            reviewed, reviewers = movies(size).tolist(), readers(size).tolist()
+            noise = self.rng.normal(0, 1.8, size).tolist()
+            # Review.objects.bulk_create keeps the rating aggregates up to date.
+            created += len(Review.objects.bulk_create(
+                Review(movie_id=movie, user_id=user, rating=int(min(max(round(quality[movie] + error), 1), 10)),
+                       text=self.words(int(self.rng.integers(5, 40))))
+                for movie, user, error in zip(reviewed, reviewers, noise)
+            ))
+        return range(created)
+
+    def create_credits(self):
+        rebuild_credits(batch_size=self.batch_size)
+        return range(Credit.objects.count())
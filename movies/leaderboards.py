@@ -0,0 +1,104 @@
+import math
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Sum
+from django.utils import timezone
+
+from movies.models import Movie, MovieScore, Review
+
+# MovieScore.trending_score is log(sum(exp(decay * (created_at - TRENDING_EPOCH)))) over a movie's reviews. As time
+# passes every movie's decayed activity shrinks by the same factor, so stored scores keep their order and only
+# movies whose reviews changed need recomputing. The log keeps the values small however far the epoch lies behind.
+TRENDING_EPOCH = datetime(2020, 1, 1, tzinfo=dt_timezone.utc)
+# Reviews older than this many half-lives add less than 0.1% of a fresh review and are not read.
+TRENDING_HORIZON = 10
+# A movie trends while its decayed activity is at least that of one review this old.
+TRENDING_WINDOW = timedelta(days=7)
+
+
+def get_prior_weight():
+    return getattr(settings, 'MOVIES_LEADERBOARD_PRIOR_WEIGHT', 10)
+
+
+def get_half_life():
+    return timedelta(days=getattr(settings, 'MOVIES_TRENDING_HALF_LIFE_DAYS', 3.5))
+
+
+def decay_rate():
+    return math.log(2) / get_half_life().total_seconds()
+
+
+def prior_mean():
+    totals = Movie.objects.aggregate(ratings=Sum('rating_sum'), reviews=Sum('rating_count'))
+    return totals['ratings'] / totals['reviews'] if totals['reviews'] else 0.0
+
+
+def bayesian_rating(rating_sum, rating_count, mean, weight):
+    # The average of the movie's ratings plus `weight` phantom ratings at the catalog mean.
+    return (weight * mean + rating_sum) / (weight + rating_count)
+
+
+def logsumexp(values):
+    top = max(values)
+    return top + math.log(sum(math.exp(value - top) for value in values))
+
+
+def trending_scores(movie_ids, now=None):
+    """Trending scores of the given movies that have reviews within the horizon."""
+    rate = decay_rate()
+    since = (now or timezone.now()) - get_half_life() * TRENDING_HORIZON
+    exponents = defaultdict(list)
+    reviews = Review.objects.filter(movie_id__in=movie_ids, created_at__gte=since).order_by()
+    for movie_id, created_at in reviews.values_list('movie_id', 'created_at').iterator(chunk_size=10000):
+        exponents[movie_id].append(rate * (created_at - TRENDING_EPOCH).total_seconds())
+    return {movie_id: logsumexp(values) for movie_id, values in exponents.items()}
+
+
+def trending_threshold(now=None):
+    return decay_rate() * ((now or timezone.now()) - TRENDING_WINDOW - TRENDING_EPOCH).total_seconds()
+
+
+def trending_activity(score, now=None):
+    """Decayed review count behind a trending score: a review written now counts 1, a half-life ago 0.5."""
+    return math.exp(score - decay_rate() * ((now or timezone.now()) - TRENDING_EPOCH).total_seconds())
+
+
+def refresh_scores(full=False, batch_size=1000):
+    """
+    Rewrites the MovieScore rows of movies whose reviews changed since the
+    last run (scores_stale), or of every movie with full=True, in batches of
+    batch_size movies. Unchanged movies keep the catalog mean of the run that
+    scored them; a periodic full refresh brings them onto the current one.
+    Returns the number of movies refreshed.
+    """
+    mean, weight = prior_mean(), get_prior_weight()
+    movies = Movie.objects.all() if full else Movie.objects.filter(scores_stale=True)
+    last_pk, refreshed = 0, 0
+    while True:
+        ids = list(movies.filter(pk__gt=last_pk).order_by('pk').values_list('pk', flat=True)[:batch_size])
+        if not ids:
+            return refreshed
+        last_pk = ids[-1]
+        with transaction.atomic():
+            # The update locks the rows, so a review written meanwhile waits and marks its movie stale again.
+            Movie.objects.filter(pk__in=ids).update(scores_stale=False)
+            rows = list(Movie.objects.filter(pk__in=ids).values_list('pk', 'genre_id', 'rating_sum', 'rating_count'))
+            trending = trending_scores(ids)
+            MovieScore.objects.filter(movie_id__in=[pk for pk, _, _, count in rows if not count]).delete()
+            MovieScore.objects.bulk_create(
+                [
+                    MovieScore(movie_id=pk, genre_id=genre_id, trending_score=trending.get(pk),
+                               bayesian_rating=bayesian_rating(total, count, mean, weight))
+                    for pk, genre_id, total, count in rows if count
+                ],
+                update_conflicts=True, unique_fields=['movie'],
+                update_fields=['genre', 'bayesian_rating', 'trending_score'],
+            )
+        refreshed += len(ids)
+
+
+def update_movie_genre(movie):
+    MovieScore.objects.filter(movie=movie).exclude(genre_id=movie.genre_id).update(genre_id=movie.genre_id)
@@ -0,0 +1,124 @@
+import contextlib
+import http.client
+import socket
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from urllib.parse import urlsplit
+
+from django.urls import reverse
+
+from movies.models import Award, Movie, Person
+
+LIST_VIEWS = ('movie_list', 'person_list', 'genre_list', 'award_list', 'review_list')
+DETAIL_VIEWS = ((Movie, 'movie_detail'), (Person, 'person_detail'), (Award, 'award_detail'))
+API_RESOURCES = ((Movie, 'movies'), (Person, 'persons'))
+
+
+def target_paths(prefix=''):
+    """The read-heavy pages a load test cycles through; prefix='async_' names the async variants."""
+    paths = [reverse(f'{prefix}{url_name}') for url_name in LIST_VIEWS]
+    for model, url_name in DETAIL_VIEWS:
+        pk = model.objects.order_by('pk').values_list('pk', flat=True).first()
+        if pk is not None:
+            paths.append(reverse(f'{prefix}{url_name}', kwargs={'pk': pk}))
+    for model, resource in API_RESOURCES:
+        paths.append(reverse(f'{prefix}api_list', kwargs={'resource': resource}))
+        pk = model.objects.order_by('pk').values_list('pk', flat=True).first()
+        if pk is not None:
+            paths.append(reverse(f'{prefix}api_detail', kwargs={'resource': resource, 'pk': pk}))
+    return paths
+
+
+def run_load(base_url, paths, concurrency=8, total=1000, timeout=30):
+    """
+    Issues `total` GETs cycling over `paths` from `concurrency` threads, each on
+    its own keep-alive connection, and returns throughput and latency figures.
+    """
+    url = urlsplit(base_url)
+    prefix = url.path.rstrip('/')
+    lock = threading.Lock()
+    issued = iter(range(total))
+    latencies = []
+    errors = []
+
+    def worker():
+        conn = http.client.HTTPConnection(url.hostname, url.port or 80, timeout=timeout)
+        try:
+            while True:
+                with lock:
+                    index = next(issued, None)
+                if index is None:
+                    return
+                start = time.perf_counter()
+                try:
+                    conn.request('GET', prefix + paths[index % len(paths)])
+                    response = conn.getresponse()
+                    response.read()
+                    status = response.status
+                except (OSError, http.client.HTTPException) as exc:
+                    conn.close()
+                    status = exc.__class__.__name__
+                elapsed = (time.perf_counter() - start) * 1000
+                with lock:
+                    latencies.append(elapsed)
+                    if status != 200:
+                        errors.append(status)
+        finally:
+            conn.close()
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    seconds = time.perf_counter() - start
+
+    cuts = statistics.quantiles(latencies, n=100, method='inclusive') if len(latencies) > 1 else latencies * 99
+    return {
+        'requests': len(latencies),
+        'errors': len(errors),
+        'seconds': seconds,
+        'rps': len(latencies) / seconds if seconds else 0.0,
+        'p50_ms': cuts[49],
+        'p95_ms': cuts[94],
+        'p99_ms': cuts[98],
+    }
+
+
+def wait_for_port(host, port, timeout=30):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            with socket.create_connection((host, port), timeout=1):
+                return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.1)
+
+
+@contextlib.contextmanager
+def uvicorn_server(app, port, interface='auto', workers=1, host='127.0.0.1'):
+    """Runs `app` under uvicorn in a subprocess for the duration of the block and yields its base URL."""
+    process = subprocess.Popen([
+        sys.executable, '-m', 'uvicorn', app, '--host', host, '--port', str(port),
+        '--interface', interface, '--workers', str(workers), '--no-access-log', '--log-level', 'warning',
+    ])
+    try:
+        try:
+            wait_for_port(host, port)
+        except OSError:
+            if process.poll() is not None:
+                raise RuntimeError(f'uvicorn exited with status {process.returncode} serving {app}')
+            raise
+        yield f'http://{host}:{port}'
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
@@ -0,0 +1,89 @@
+import json
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.test import override_settings
+
+from movies.benchmarks import SUITES, compare_results, describe_run, seed_movies
+from movies.generator import SCALES, CatalogGenerator
+
+
+class Command(BaseCommand):
+    help = (
+        'Runs the named performance benchmark suites against the current database. Results can be written '
+        'as JSON and compared with an earlier run to catch regressions.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('suites', nargs='*', help=f'Suites to run (default: all). Available: {", ".join(SUITES)}')
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--seed', type=int, default=0,
+                            help='Insert this many synthetic movies first and roll them back afterwards.')
+        parser.add_argument('--scale', choices=list(SCALES),
+                            help='Generate a synthetic catalog of this size first and roll it back afterwards.')
+        parser.add_argument('--json', help='Write the results to this file.')
+        parser.add_argument('--compare', help='Compare with the results in this file and fail on regressions.')
+        parser.add_argument('--threshold', type=float, default=0.2,
+                            help='Slowdown of a median, as a fraction, that counts as a regression.')
+        parser.add_argument('--min-delta-ms', type=float, default=1.0,
+                            help='Slowdowns smaller than this are treated as noise.')
+
+    def handle(self, *args, **options):
+        names = options['suites'] or list(SUITES)
+        unknown = [name for name in names if name not in SUITES]
+        if unknown:
+            raise CommandError(f'Unknown suite(s): {", ".join(unknown)}')
+        baseline = None
+        if options['compare']:
+            try:
+                baseline = json.loads(Path(options['compare']).read_text())
+            except (OSError, ValueError) as error:
+                raise CommandError(f'Cannot read {options["compare"]}: {error}')
+
+        run = {'suites': {}}
+        # Everything is rolled back afterwards, so view counts stay buffered rather than flushed from a background
+        # thread that would wait on the run's locks; the buffer is dropped with the settings override.
+        buffer_views = override_settings(MOVIES_VIEW_FLUSH_SECONDS=10 ** 9, MOVIES_VIEW_BUFFER_SIZE=10 ** 9)
+        with transaction.atomic(), buffer_views:
+            if options['seed']:
+                seed_movies(options['seed'])
+            if options['scale']:
+                for stats in CatalogGenerator().generate(**SCALES[options['scale']]):
+                    self.stdout.write(f'  generated {stats.entity:<12} {stats.rows:>10} rows  {stats.seconds:>8.2f} s')
+            run['meta'] = describe_run(options['repeat'], options['scale'])
+            for name in names:
+                self.stdout.write(self.style.MIGRATE_HEADING(name))
+                run['suites'][name] = results = SUITES[name](options['repeat'])
+                for result in results:
+                    line = (
+                        f"  {result['name']:<40} min {result['min_ms']:>9.3f} ms"
+                        f"  median {result['median_ms']:>9.3f} ms  max {result['max_ms']:>9.3f} ms"
+                    )
+                    for key, value in result.items():
+                        if key not in ('name', 'min_ms', 'median_ms', 'max_ms'):
+                            line += f'  {key} {value}'
+                    self.stdout.write(line)
+            transaction.set_rollback(True)
+
+        if options['json']:
+            Path(options['json']).write_text(json.dumps(run, indent=2))
+        if baseline is not None:
+            self.compare(baseline, run, options['threshold'], options['min_delta_ms'])
+
+    def compare(self, baseline, run, threshold, min_delta_ms):
+        self.stdout.write(self.style.MIGRATE_HEADING(f'compared with {baseline["meta"].get("commit") or "baseline"}'))
+        rows = compare_results(baseline, run, threshold, min_delta_ms)
+        for suite, name, before, after, regressed in rows:
+            change = (after['median_ms'] / before['median_ms'] - 1) * 100 if before['median_ms'] else 0.0
+            line = (
+                f"  {suite + ' ' + name:<48} {before['median_ms']:>9.3f} -> {after['median_ms']:>9.3f} ms"
+                f"  {change:>+7.1f}%"
+            )
+            if 'queries' in after:
+                line += f"  queries {before.get('queries', '?')} -> {after['queries']}"
+            self.stdout.write(self.style.ERROR(line + '  REGRESSED') if regressed else line)
+        regressions = sum(1 for row in rows if row[-1])
+        if regressions:
+            raise CommandError(f'{regressions} benchmark(s) regressed.')
+        self.stdout.write(self.style.SUCCESS(f'No regressions in {len(rows)} comparable benchmark(s).'))
@@ -0,0 +1,88 @@
+from django.contrib.auth.models import AnonymousUser
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import RequestFactory, override_settings
+from django.urls import resolve, reverse
+
+from movies.models import Award, Movie, Person
+
+DUMMY_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}}
+
+
+def hot_urls():
+    yield reverse('movie_list')
+    yield reverse('movie_list') + '?sort_by=release_year'
+    yield reverse('movie_list') + '?sort_by=rating'
+    yield reverse('movie_list') + '?q=night'
+    yield reverse('person_list')
+    yield reverse('genre_list')
+    yield reverse('award_list')
+    yield reverse('review_list')
+    yield reverse('autocomplete', kwargs={'source': 'person'}) + '?role=actor'
+    yield reverse('autocomplete', kwargs={'source': 'person'}) + '?role=director'
+    for model, url_name in ((Movie, 'movie_detail'), (Person, 'person_detail'), (Award, 'award_detail')):
+        pk = model.objects.order_by('pk').values_list('pk', flat=True).first()
+        if pk is not None:
+            yield reverse(url_name, kwargs={'pk': pk})
+
+
+class QueryRecorder:
+    def __init__(self):
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        self.queries.append((sql, params))
+        return execute(sql, params, many, context)
+
+
+class Command(BaseCommand):
+    help = (
+        'Renders every list and detail view (and the second page of each list) with the detail cache '
+        'disabled, and prints the database plan of each query they run, so index coverage can be checked.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('urls', nargs='*', help='Explain only these paths instead of the built-in set.')
+        parser.add_argument('--analyze', action='store_true', help='Run EXPLAIN ANALYZE (PostgreSQL only).')
+
+    def handle(self, *args, **options):
+        if options['analyze'] and connection.vendor != 'postgresql':
+            raise CommandError('--analyze is only supported on PostgreSQL.')
+        explain_options = {'analyze': True} if options['analyze'] else {}
+        prefix = connection.ops.explain_query_prefix(**explain_options)
+
+        seen = set()
+        with override_settings(CACHES=DUMMY_CACHES):
+            pending = list(options['urls'] or hot_urls())
+            while pending:
+                url = pending.pop(0)
+                queries, next_url = self.record(url)
+                self.stdout.write(self.style.MIGRATE_HEADING(url))
+                for sql, params in queries:
+                    if sql in seen:
+                        continue
+                    seen.add(sql)
+                    self.stdout.write(self.style.SQL_KEYWORD(f'  {sql}'))
+                    for line in self.explain(prefix, sql, params):
+                        self.stdout.write(f'    {line}')
+                if next_url and not options['urls']:
+                    pending.insert(0, url.split('?')[0] + next_url)
+
+    def record(self, url):
+        request = RequestFactory().get(url)
+        request.user = AnonymousUser()
+        match = resolve(request.path_info)
+        recorder = QueryRecorder()
+        with connection.execute_wrapper(recorder):
+            response = match.func(request, *match.args, **match.kwargs)
+            if hasattr(response, 'render'):
+                response.render()
+        page = (getattr(response, 'context_data', None) or {}).get('page_obj')
+        next_url = getattr(page, 'next_url', None) if '&cursor=' not in url and '?cursor=' not in url else None
+        return recorder.queries, next_url
+
+    def explain(self, prefix, sql, params):
+        with connection.cursor() as cursor:
+            cursor.execute(f'{prefix} {sql}', params)
+            rows = cursor.fetchall()
+        return [' | '.join(str(value) for value in row) for row in rows]
@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from movies.generator import SCALES, CatalogGenerator
+
+
+class Command(BaseCommand):
+    help = (
+        'Bulk-inserts a synthetic catalog with realistic skew: Zipf-distributed reviews per movie and per user, '
+        'heavy-tailed cast sizes and prolific directors and actors. Sizes come from --scale and can be '
+        'overridden one by one. Rows are added to the existing data.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scale', choices=list(SCALES), default='1k')
+        parser.add_argument('--movies', type=int)
+        parser.add_argument('--persons', type=int)
+        parser.add_argument('--reviews', type=int)
+        parser.add_argument('--users', type=int, help='Reviewing users (default: one per 20 reviews).')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        sizes = {name: options[name] if options[name] is not None else size
+                 for name, size in SCALES[options['scale']].items()}
+        if any(size < 0 for size in sizes.values()) or options['batch_size'] < 1:
+            raise CommandError('Sizes must not be negative and --batch-size must be positive.')
+        if options['users'] is not None and options['users'] < 1 and sizes['reviews']:
+            raise CommandError('Reviews need at least one user.')
+
+        generator = CatalogGenerator(seed=options['seed'], batch_size=options['batch_size'])
+        for stats in generator.generate(users=options['users'], **sizes):
+            self.stdout.write(
+                f'{stats.entity:<14} {stats.rows:>10} rows  {stats.seconds:>8.2f} s  {stats.rate:>10.0f} rows/s'
+            )
+        self.stdout.write(self.style.SUCCESS('Catalog generated.'))
@@ -0,0 +1,33 @@
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+from movies.catalog import ENTITIES, CatalogImporter
+
+
+class Command(BaseCommand):
+    help = (
+        'Streams catalog files (JSONL or CSV) into the database in batches. PATH is either a directory '
+        'holding files named after the entities (genres.jsonl, persons.csv, ...) or a single file '
+        'together with --entity. Rows are upserted by id, so re-running an import is safe.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--entity', choices=list(ENTITIES))
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        path = Path(options['path'])
+        if not path.exists():
+            raise CommandError(f'{path} does not exist.')
+        if path.is_file() and not options['entity']:
+            raise CommandError('--entity is required when importing a single file.')
+
+        importer = CatalogImporter(batch_size=options['batch_size'])
+        for stats in importer.import_path(path, options['entity']):
+            self.stdout.write(
+                f'{stats.entity:<14} {stats.rows:>10} rows  {stats.skipped:>8} skipped  '
+                f'{stats.seconds:>8.2f} s  {stats.rate:>10.0f} rows/s'
+            )
+        self.stdout.write(self.style.SUCCESS('Import finished.'))
@@ -0,0 +1,67 @@
+import contextlib
+
+from django.core.management.base import BaseCommand, CommandError
+
+from movies.loadtest import run_load, target_paths, uvicorn_server
+
+# (label, server, url-name prefix): the sync views on a WSGI server, the same views on ASGI, and the async views on ASGI.
+SCENARIOS = (
+    ('sync views on WSGI', 'wsgi', ''),
+    ('sync views on ASGI', 'asgi', ''),
+    ('async views on ASGI', 'asgi', 'async_'),
+)
+
+
+class Command(BaseCommand):
+    help = (
+        'Load-tests the read-heavy list, detail and API pages over HTTP and reports requests/sec and '
+        'p50/p95/p99 latency for the sync views on WSGI, the sync views on ASGI and the async views on ASGI. '
+        'Point it at running servers with --asgi-url/--wsgi-url, or pass --serve to start uvicorn for both.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--asgi-url', help='Base URL of a server running Django_Movies_Collection_App.asgi.')
+        parser.add_argument('--wsgi-url', help='Base URL of a server running Django_Movies_Collection_App.wsgi.')
+        parser.add_argument('--serve', action='store_true',
+                            help='Start uvicorn for the ASGI and WSGI applications on --port and --port + 1.')
+        parser.add_argument('--port', type=int, default=8100)
+        parser.add_argument('--workers', type=int, default=1, help='uvicorn worker processes per server.')
+        parser.add_argument('--concurrency', type=int, default=16)
+        parser.add_argument('--requests', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        if options['concurrency'] < 1 or options['requests'] < 1:
+            raise CommandError('--concurrency and --requests must be positive.')
+        if not options['serve'] and not (options['asgi_url'] or options['wsgi_url']):
+            raise CommandError('Pass --serve, or --asgi-url and/or --wsgi-url.')
+        if options['serve']:
+            try:
+                import uvicorn  # noqa: F401
+            except ImportError:
+                raise CommandError('--serve needs uvicorn installed.')
+
+        with contextlib.ExitStack() as stack:
+            urls = {'asgi': options['asgi_url'], 'wsgi': options['wsgi_url']}
+            if options['serve']:
+                for offset, (server, app, interface) in enumerate((
+                    ('asgi', 'Django_Movies_Collection_App.asgi:application', 'asgi3'),
+                    ('wsgi', 'Django_Movies_Collection_App.wsgi:application', 'wsgi'),
+                )):
+                    urls[server] = stack.enter_context(
+                        uvicorn_server(app, options['port'] + offset, interface, options['workers'])
+                    )
+
+            for label, server, prefix in SCENARIOS:
+                if not urls[server]:
+                    continue
+                paths = target_paths(prefix)
+                # One untimed pass so every scenario starts with warm connections and caches.
+                run_load(urls[server], paths, concurrency=1, total=len(paths))
+                result = run_load(urls[server], paths, options['concurrency'], options['requests'])
+                line = (
+                    f"{label:<22} {result['rps']:>8.1f} req/s  p50 {result['p50_ms']:>8.2f} ms"
+                    f"  p95 {result['p95_ms']:>8.2f} ms  p99 {result['p99_ms']:>8.2f} ms"
+                )
+                if result['errors']:
+                    line += f"  {self.style.ERROR(str(result['errors']) + ' errors')}"
+                self.stdout.write(line)
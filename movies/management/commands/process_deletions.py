@@ -0,0 +1,33 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from movies.deletion import delete_pending, get_batch_size
+
+
+class Command(BaseCommand):
+    help = (
+        'Removes the genres, persons and movies whose deletion was requested, with everything they cascade to, '
+        'in batches of short transactions, printing progress after each batch. Web workers do this in a '
+        'background thread; run it from cron with MOVIES_DELETE_IN_BACKGROUND off, or to finish deletions a '
+        'stopped worker left part way.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=None,
+                            help='Rows deleted per transaction (default: MOVIES_DELETE_BATCH_SIZE).')
+
+    def handle(self, *args, **options):
+        batch_size = get_batch_size() if options['batch_size'] is None else options['batch_size']
+        if batch_size < 1:
+            raise CommandError('--batch-size must be positive.')
+        start = time.perf_counter()
+        finished, rows = set(), {}
+        for deletion in delete_pending(batch_size):
+            rows[deletion.pk] = deletion.rows_deleted
+            if deletion.finished_at is not None:
+                finished.add(deletion.pk)
+            self.stdout.write(f'{str(deletion)[:40]:<40} {deletion.rows_deleted:>10} rows  {deletion.stage or "done"}')
+        self.stdout.write(self.style.SUCCESS(
+            f'Deleted {len(finished)} objects and {sum(rows.values())} rows in {time.perf_counter() - start:.2f} s'
+        ))
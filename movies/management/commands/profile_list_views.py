@@ -0,0 +1,99 @@
+import statistics
+import time
+
+from django.contrib.auth.models import AnonymousUser
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import RequestFactory, override_settings
+from django.urls import resolve, reverse
+
+DUMMY_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}}
+# A private cache, so the cold run really starts empty and the site's own caches are left alone.
+PROFILE_CACHES = {'default': {
+    'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    'LOCATION': 'profile',
+    'OPTIONS': {'MAX_ENTRIES': 100000},
+}}
+
+
+def list_urls():
+    yield reverse('movie_list')
+    yield reverse('movie_list') + '?sort_by=release_year'
+    yield reverse('movie_list') + '?sort_by=rating'
+    yield reverse('movie_list') + '?q=night'
+    yield reverse('review_list')
+    yield reverse('person_list')
+    yield reverse('genre_list')
+    yield reverse('award_list')
+
+
+class QueryTimer:
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.seconds += time.perf_counter() - start
+            self.count += 1
+
+
+class Command(BaseCommand):
+    help = (
+        'Profiles the list views and splits each request into SQL time, view (Python) time and template '
+        'render time: uncached, with a cold row fragment cache and with a warm one. SQL time covers statement '
+        'execution; fetching rows and building model instances counts as view time.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('urls', nargs='*', help='Profile only these paths instead of the built-in set.')
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--per-page', type=int, help='Rows per page (defaults to each view\'s paginate_by).')
+
+    def handle(self, *args, **options):
+        if options['repeat'] < 1 or (options['per_page'] is not None and options['per_page'] < 1):
+            raise CommandError('--repeat and --per-page must be positive.')
+
+        for url in options['urls'] or list_urls():
+            self.stdout.write(self.style.MIGRATE_HEADING(url))
+            with override_settings(CACHES=DUMMY_CACHES):
+                self.report('uncached', [self.profile(url, options['per_page']) for _ in range(options['repeat'])])
+            with override_settings(CACHES=PROFILE_CACHES):
+                self.report('cold', [self.profile(url, options['per_page'])])
+                self.report('warm', [self.profile(url, options['per_page']) for _ in range(options['repeat'])])
+
+    def profile(self, url, per_page):
+        request = RequestFactory().get(url)
+        request.user = AnonymousUser()
+        match = resolve(request.path_info)
+        view_class = match.func.view_class
+        view = view_class.as_view(paginate_by=per_page) if per_page else match.func
+        timings = {}
+        for phase in ('view', 'render'):
+            timer = QueryTimer()
+            start = time.perf_counter()
+            with connection.execute_wrapper(timer):
+                if phase == 'view':
+                    response = view(request, *match.args, **match.kwargs)
+                elif hasattr(response, 'render'):
+                    response.render()
+            elapsed = time.perf_counter() - start
+            timings[phase] = (elapsed - timer.seconds) * 1000
+            timings[f'{phase}_sql'] = timer.seconds * 1000
+            timings[f'{phase}_queries'] = timer.count
+        return timings
+
+    def report(self, label, runs):
+        def median(key):
+            return statistics.median(run[key] for run in runs)
+
+        sql = median('view_sql') + median('render_sql')
+        total = sql + median('view') + median('render')
+        self.stdout.write(
+            f'  {label:<9} queries {runs[0]["view_queries"] + runs[0]["render_queries"]:>3}'
+            f'  sql {sql:>8.2f} ms  view {median("view"):>8.2f} ms  render {median("render"):>8.2f} ms'
+            f'  total {total:>8.2f} ms'
+        )
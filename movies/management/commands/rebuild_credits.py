@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+
+from movies.filmography import rebuild_credits
+from movies.models import Person
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the denormalised filmography Credit table from director links and cast rows, in batches.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        last_pk = 0
+        done = 0
+        while True:
+            person_ids = list(
+                Person.objects.filter(pk__gt=last_pk).order_by('pk').values_list('pk', flat=True)[:batch_size]
+            )
+            if not person_ids:
+                break
+            rebuild_credits(person_ids)
+            last_pk = person_ids[-1]
+            done += len(person_ids)
+            self.stdout.write(f'Rebuilt credits for {done} persons')
+        self.stdout.write(self.style.SUCCESS(f'Done: {done} persons'))
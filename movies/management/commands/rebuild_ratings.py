@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+
+from movies.models import Movie
+from movies.ratings import rebuild_ratings
+
+
+class Command(BaseCommand):
+    help = 'Recomputes the stored rating aggregates of every movie from its reviews, in batches.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        last_pk = 0
+        done = 0
+        while True:
+            movie_ids = list(
+                Movie.objects.filter(pk__gt=last_pk).order_by('pk').values_list('pk', flat=True)[:batch_size]
+            )
+            if not movie_ids:
+                break
+            rebuild_ratings(movie_ids)
+            last_pk = movie_ids[-1]
+            done += len(movie_ids)
+            self.stdout.write(f'Rebuilt ratings for {done} movies')
+        self.stdout.write(self.style.SUCCESS(f'Done: {done} movies'))
@@ -0,0 +1,26 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from movies.leaderboards import refresh_scores
+
+
+class Command(BaseCommand):
+    help = (
+        'Rewrites the precomputed leaderboard scores of movies whose reviews changed since the last run, or of '
+        'every movie with --full. Run it every few minutes, and --full once after installing and then daily so '
+        'all scores use the current catalog mean rating.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', help='Rescore every movie instead of only stale ones.')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Movies rescored per transaction.')
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be positive.')
+        start = time.perf_counter()
+        refreshed = refresh_scores(options['full'], options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Refreshed leaderboard scores of {refreshed} movies in {time.perf_counter() - start:.2f} s'
+        ))
@@ -0,0 +1,27 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from movies.recommendations import refresh_neighbors
+
+
+class Command(BaseCommand):
+    help = (
+        'Recomputes the "viewers also liked" neighbours of movies whose ratings changed since the last run, '
+        'or of every movie with --full. Run --full once after installing, then periodically without it.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', help='Recompute every movie instead of only stale ones.')
+        parser.add_argument('--max-cells', type=int, default=25_000_000,
+                            help='Upper bound on the entries of one block of the similarity product.')
+        parser.add_argument('--chunk-size', type=int, default=100_000, help='Reviews read per database round trip.')
+
+    def handle(self, *args, **options):
+        if options['max_cells'] < 1 or options['chunk_size'] < 1:
+            raise CommandError('--max-cells and --chunk-size must be positive.')
+        start = time.perf_counter()
+        refreshed = refresh_neighbors(options['full'], options['max_cells'], options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Refreshed neighbours of {refreshed} movies in {time.perf_counter() - start:.2f} s'
+        ))
@@ -0,0 +1,38 @@
+import time
+from collections import Counter
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from movies.sharding import get_review_shards, reshard
+
+
+class Command(BaseCommand):
+    help = (
+        'Moves reviews onto the shard their movie hashes to under MOVIES_REVIEW_SHARDS, creating the review table '
+        'on shards that lack it, and raises the shared review id counter above every stored id. Run it after '
+        'adding shards, and with --from for each alias being retired. Reviews written while it runs land on '
+        'their new shard, but reads of movies not yet moved miss their older reviews, so run it in a quiet hour.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--from', dest='sources', nargs='*', default=[],
+                            help='Aliases no longer in MOVIES_REVIEW_SHARDS to empty as well.')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Reviews read per round trip.')
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be positive.')
+        unknown = [alias for alias in options['sources'] if alias not in connections.settings]
+        if unknown:
+            raise CommandError(f'Unknown database aliases: {", ".join(unknown)}.')
+        start = time.perf_counter()
+        read, moved = Counter(), Counter()
+        for alias, rows, rows_moved in reshard(options['sources'], options['batch_size']):
+            read[alias] += rows
+            moved[alias] += rows_moved
+            self.stdout.write(f'{alias:<14} {read[alias]:>10} read  {moved[alias]:>10} moved')
+        self.stdout.write(self.style.SUCCESS(
+            f'Moved {sum(moved.values())} reviews onto {len(get_review_shards())} shards after reading '
+            f'{sum(read.values())} rows in {time.perf_counter() - start:.2f} s'
+        ))
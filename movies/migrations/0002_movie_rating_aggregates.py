@@ -0,0 +1,53 @@
+# Generated by Django 5.0.6 on 2026-10-16 23:53
+
+import movies.models
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def backfill_rating_aggregates(apps, schema_editor):
+    Movie = apps.get_model('movies', 'Movie')
+    Review = apps.get_model('movies', 'Review')
+    histograms = {}
+    for row in Review.objects.values('movie_id', 'rating').annotate(n=Count('pk')).order_by():
+        histograms.setdefault(row['movie_id'], [0] * 10)[row['rating'] - 1] = row['n']
+    movies = []
+    for movie in Movie.objects.filter(pk__in=histograms).only('pk'):
+        movie.rating_histogram = histograms[movie.pk]
+        movie.rating_count = sum(movie.rating_histogram)
+        movie.rating_sum = sum(rating * count for rating, count in enumerate(movie.rating_histogram, start=1))
+        movie.rating_avg = movie.rating_sum / movie.rating_count
+        movies.append(movie)
+    Movie.objects.bulk_update(movies, ['rating_count', 'rating_sum', 'rating_avg', 'rating_histogram'],
+                              batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movies', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='movie',
+            name='rating_avg',
+            field=models.FloatField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='movie',
+            name='rating_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='movie',
+            name='rating_histogram',
+            field=models.JSONField(default=movies.models.empty_rating_histogram, editable=False),
+        ),
+        migrations.AddField(
+            model_name='movie',
+            name='rating_sum',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(backfill_rating_aggregates, migrations.RunPython.noop),
+    ]
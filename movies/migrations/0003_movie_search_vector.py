@@ -0,0 +1,58 @@
+# Generated by Django 5.0.6 on 2026-10-16 23:55
+
+import django.contrib.postgres.search
+from django.db import migrations
+
+SEARCH_VECTOR_SQL = """
+    setweight(to_tsvector('simple', coalesce(NEW.title, '')), 'A') ||
+    setweight(to_tsvector('simple', coalesce(NEW.description, '')), 'B')
+"""
+
+CREATE_SEARCH_TRIGGER = f"""
+CREATE OR REPLACE FUNCTION movies_movie_search_vector_update() RETURNS trigger AS $$
+BEGIN
+    NEW.search_vector := {SEARCH_VECTOR_SQL};
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER movies_movie_search_vector_trigger
+    BEFORE INSERT OR UPDATE OF title, description ON movies_movie
+    FOR EACH ROW EXECUTE FUNCTION movies_movie_search_vector_update();
+
+UPDATE movies_movie SET title = title;
+
+CREATE INDEX movies_movie_search_vector_gin ON movies_movie USING gin (search_vector);
+"""
+
+DROP_SEARCH_TRIGGER = """
+DROP INDEX IF EXISTS movies_movie_search_vector_gin;
+DROP TRIGGER IF EXISTS movies_movie_search_vector_trigger ON movies_movie;
+DROP FUNCTION IF EXISTS movies_movie_search_vector_update();
+"""
+
+
+def create_search_trigger(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(CREATE_SEARCH_TRIGGER)
+
+
+def drop_search_trigger(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(DROP_SEARCH_TRIGGER)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movies', '0002_movie_rating_aggregates'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='movie',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.RunPython(create_search_trigger, drop_search_trigger),
+    ]
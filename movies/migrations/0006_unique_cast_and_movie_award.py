@@ -0,0 +1,34 @@
+# Generated by Django 5.0.6 on 2026-10-17 00:18
+
+from django.db import migrations, models
+from django.db.models import Count, Min
+
+
+def remove_duplicates(apps, schema_editor):
+    # Keep the oldest row of every duplicate group so the unique constraints can be created.
+    for model_name, fields in (('Cast', ['movie', 'person', 'role_name']), ('MovieAward', ['movie', 'award', 'category'])):
+        model = apps.get_model('movies', model_name)
+        groups = model.objects.values(*fields).annotate(keep=Min('pk'), n=Count('pk')).filter(n__gt=1).order_by()
+        for group in list(groups):
+            keep = group.pop('keep')
+            del group['n']
+            model.objects.filter(**group).exclude(pk=keep).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movies', '0005_hot_query_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicates, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='cast',
+            constraint=models.UniqueConstraint(fields=('movie', 'person', 'role_name'), name='unique_cast_role'),
+        ),
+        migrations.AddConstraint(
+            model_name='movieaward',
+            constraint=models.UniqueConstraint(fields=('movie', 'award', 'category'), name='unique_movie_award'),
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 5.0.6 on 2026-10-17 00:36
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movies', '0006_unique_cast_and_movie_award'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MovieNeighbor',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('similarity', models.FloatField()),
+                ('rank', models.PositiveSmallIntegerField()),
+            ],
+        ),
+        migrations.AddField(
+            model_name='movie',
+            name='neighbors_stale',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='movie',
+            index=models.Index(condition=models.Q(('neighbors_stale', True)), fields=['id'], name='movie_neighbors_stale_idx'),
+        ),
+        migrations.AddField(
+            model_name='movieneighbor',
+            name='movie',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='neighbors', to='movies.movie'),
+        ),
+        migrations.AddField(
+            model_name='movieneighbor',
+            name='neighbor',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='movies.movie'),
+        ),
+        migrations.AddConstraint(
+            model_name='movieneighbor',
+            constraint=models.UniqueConstraint(fields=('movie', 'rank'), name='unique_movie_neighbor_rank'),
+        ),
+    ]
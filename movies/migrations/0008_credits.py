@@ -0,0 +1,34 @@
+# Generated by Django 5.0.6 on 2026-10-17 00:39
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movies', '0007_movie_neighbors'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Credit',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('director', 'Director'), ('actor', 'Actor')], max_length=10)),
+                ('role_name', models.CharField(blank=True, max_length=255)),
+                ('title', models.CharField(max_length=255)),
+                ('release_year', models.PositiveIntegerField()),
+                ('cast', models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='movies.cast')),
+                ('movie', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='movies.movie')),
+                ('person', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='credits', to='movies.person')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['person', '-release_year', 'title'], name='credit_person_year_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='credit',
+            constraint=models.UniqueConstraint(condition=models.Q(('kind', 'director')), fields=('person', 'movie'), name='unique_director_credit'),
+        ),
+    ]
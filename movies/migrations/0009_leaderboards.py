@@ -0,0 +1,48 @@
+# Generated by Django 5.0.6 on 2026-10-17 00:59
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movies', '0008_credits'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MovieScore',
+            fields=[
+                ('movie', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='score', serialize=False, to='movies.movie')),
+                ('bayesian_rating', models.FloatField()),
+                ('trending_score', models.FloatField(null=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='movie',
+            name='scores_stale',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='movie',
+            index=models.Index(condition=models.Q(('scores_stale', True)), fields=['id'], name='movie_scores_stale_idx'),
+        ),
+        migrations.AddField(
+            model_name='moviescore',
+            name='genre',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='movies.genre'),
+        ),
+        migrations.AddIndex(
+            model_name='moviescore',
+            index=models.Index(fields=['-bayesian_rating', 'movie'], name='score_top_rated_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='moviescore',
+            index=models.Index(fields=['genre', '-bayesian_rating', 'movie'], name='score_genre_top_rated_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='moviescore',
+            index=models.Index(condition=models.Q(('trending_score__isnull', False)), fields=['-trending_score', 'movie'], name='score_trending_idx'),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.0.6 on 2026-10-17 01:02
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def backfill_movie_counts(apps, schema_editor):
+    Genre = apps.get_model('movies', 'Genre')
+    Movie = apps.get_model('movies', 'Movie')
+    counts = dict(Movie.objects.values_list('genre_id').annotate(n=Count('pk')).order_by())
+    genres = list(Genre.objects.filter(pk__in=counts).only('pk'))
+    for genre in genres:
+        genre.movie_count = counts[genre.pk]
+    Genre.objects.bulk_update(genres, ['movie_count'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movies', '0009_leaderboards'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='genre',
+            name='movie_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(backfill_movie_counts, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.0.6 on 2026-10-17 01:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movies', '0011_review_shards'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='movie',
+            name='view_count',
+            field=models.PositiveBigIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='person',
+            name='view_count',
+            field=models.PositiveBigIntegerField(default=0, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='movie',
+            index=models.Index(fields=['-view_count', 'id'], name='movie_views_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='person',
+            index=models.Index(fields=['-view_count', 'id'], name='person_views_idx'),
+        ),
+    ]
@@ -0,0 +1,58 @@
+# Generated by Django 5.0.6 on 2026-10-17 01:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movies', '0012_view_counts'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Deletion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('model_name', models.CharField(max_length=20)),
+                ('object_id', models.PositiveBigIntegerField()),
+                ('label', models.CharField(max_length=255)),
+                ('requested_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('rows_deleted', models.PositiveBigIntegerField(default=0)),
+                ('stage', models.CharField(blank=True, max_length=100)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='genre',
+            name='pending_delete',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+        migrations.AddField(
+            model_name='movie',
+            name='pending_delete',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+        migrations.AddField(
+            model_name='person',
+            name='pending_delete',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='genre',
+            index=models.Index(condition=models.Q(('pending_delete', True)), fields=['id'], name='genre_pending_delete_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='movie',
+            index=models.Index(condition=models.Q(('pending_delete', True)), fields=['id'], name='movie_pending_delete_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='person',
+            index=models.Index(condition=models.Q(('pending_delete', True)), fields=['id'], name='person_pending_delete_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='deletion',
+            index=models.Index(condition=models.Q(('finished_at__isnull', True)), fields=['id'], name='deletion_pending_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.0.6 on 2026-10-17 02:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movies', '0013_pending_deletes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='deletion',
+            name='claimed_by',
+            field=models.CharField(blank=True, max_length=64),
+        ),
+    ]
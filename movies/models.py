@@ -1,15 +1,75 @@
-from django.db import models
+from django.db import DEFAULT_DB_ALIAS, models, transaction
 from django.contrib.auth.models import User
+from django.contrib.postgres.search import SearchVectorField
 
+from movies.sharding import ShardedQuerySet, allocate_ids, atomic_on, is_sharded, move_rows, shard_for
 
-class Genre(models.Model):
+
+class LiveManager(models.Manager):
+    # Leaves out rows whose delete view has run but which movies.deletion has not removed yet. Related object
+    # access and the delete cascade go through _base_manager, which still sees them.
+    def get_queryset(self):
+        return super().get_queryset().filter(pending_delete=False)
+
+
+class MaintainedColumns(models.Model):
+    # The columns named in maintained_fields are kept current elsewhere with relative or locked UPDATEs. Saving an
+    # existing instance leaves them alone, so a form saving a copy loaded before a concurrent write cannot write back
+    # the values it was loaded with. Pass update_fields to write them from an instance.
+    maintained_fields = ()
+
+    class Meta:
+        abstract = True
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding and not args and not kwargs.get('force_insert') and 'update_fields' not in kwargs:
+            deferred = self.get_deferred_fields()
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.maintained_fields and field.attname not in deferred
+            ]
+        super().save(*args, **kwargs)
+
+
+class Deletable(MaintainedColumns):
+    # Set by movies.deletion.request_deletion; the row is hidden from then on and removed by a background job.
+    pending_delete = models.BooleanField(default=False, editable=False)
+
+    objects = LiveManager()
+    maintained_fields = ('pending_delete',)
+
+    class Meta:
+        abstract = True
+
+
+class Genre(Deletable):
     name = models.CharField(max_length=255)
+    # Kept current by movies.signals and MovieQuerySet with relative UPDATEs; see movies.counts.
+    movie_count = models.PositiveIntegerField(default=0, editable=False)
+
+    maintained_fields = ('pending_delete', 'movie_count')
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['name', 'id'], name='genre_name_idx'),
+            models.Index(fields=['id'], name='genre_pending_delete_idx', condition=models.Q(pending_delete=True)),
+        ]
 
     def __str__(self):
         return self.name
 
 
-class Person(models.Model):
+class ViewCounted(MaintainedColumns):
+    # Added to by movies.popularity with relative UPDATEs.
+    view_count = models.PositiveBigIntegerField(default=0, editable=False)
+
+    maintained_fields = ('view_count',)
+
+    class Meta:
+        abstract = True
+
+
+class Person(ViewCounted, Deletable):
     ACTOR = 'actor'
     DIRECTOR = 'director'
     BOTH = 'both'
@@ -25,11 +85,62 @@ class Person(models.Model):
     death_date = models.DateField(null=True, blank=True)
     role = models.CharField(max_length=10, choices=ROLE_CHOICES, default=ACTOR)
 
+    maintained_fields = ('view_count', 'pending_delete')
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['last_name', 'id'], name='person_last_name_idx'),
+            models.Index(fields=['role', 'last_name'], name='person_role_last_name_idx'),
+            # Actor and director pickers filter on role__in and sort by name.
+            models.Index(fields=['last_name', 'first_name', 'id'], name='person_actor_name_idx',
+                         condition=models.Q(role__in=['actor', 'both'])),
+            models.Index(fields=['last_name', 'first_name', 'id'], name='person_director_name_idx',
+                         condition=models.Q(role__in=['director', 'both'])),
+            models.Index(fields=['-view_count', 'id'], name='person_views_idx'),
+            models.Index(fields=['id'], name='person_pending_delete_idx', condition=models.Q(pending_delete=True)),
+        ]
+
     def __str__(self):
         return f"{self.first_name} {self.last_name}"
 
 
-class Movie(models.Model):
+def empty_rating_histogram():
+    return [0] * 10
+
+
+# Movie fields the movie list facets are computed from (ratings are passed on by movies.ratings).
+FACET_FIELDS = {'genre', 'genre_id', 'release_year', 'duration_minutes'}
+
+
+class MovieQuerySet(models.QuerySet):
+    def bulk_create(self, objs, *args, **kwargs):
+        from movies.counts import apply_movie_count_changes
+        from movies.facets import index_bulk_changes
+
+        with transaction.atomic(using=self.db):
+            created = super().bulk_create(objs, *args, **kwargs)
+            apply_movie_count_changes((movie.genre_id, 1) for movie in created)
+            index_bulk_changes()
+        return created
+
+    def update(self, **kwargs):
+        from movies.counts import rebuild_movie_counts
+        from movies.facets import index_bulk_changes
+
+        if FACET_FIELDS & kwargs.keys():
+            index_bulk_changes()
+        if 'genre' not in kwargs and 'genre_id' not in kwargs:
+            return super().update(**kwargs)
+        with transaction.atomic(using=self.db):
+            genre_ids = set(self.values_list('genre_id', flat=True))
+            rows = super().update(**kwargs)
+            new_genre = kwargs.get('genre', kwargs.get('genre_id'))
+            genre_ids.add(getattr(new_genre, 'pk', new_genre))
+            rebuild_movie_counts(genre_ids)
+        return rows
+
+
+class Movie(ViewCounted, Deletable):
     title = models.CharField(max_length=255)
     description = models.TextField()
     release_year = models.PositiveIntegerField()
@@ -37,23 +148,124 @@ class Movie(models.Model):
     genre = models.ForeignKey(Genre, on_delete=models.CASCADE)
     directors = models.ManyToManyField(Person, related_name='directed_movies',
                                        limit_choices_to={'role__in': ['director', 'both']})
+    rating_count = models.PositiveIntegerField(default=0, editable=False)
+    rating_sum = models.PositiveIntegerField(default=0, editable=False)
+    rating_avg = models.FloatField(default=0, editable=False)
+    rating_histogram = models.JSONField(default=empty_rating_histogram, editable=False)
+    search_vector = SearchVectorField(null=True, editable=False)
+    # Set when the movie's ratings change; refresh_recommendations recomputes its neighbours and clears it.
+    neighbors_stale = models.BooleanField(default=False, editable=False)
+    # Set alongside neighbors_stale; refresh_leaderboards rewrites the movie's MovieScore and clears it.
+    scores_stale = models.BooleanField(default=False, editable=False)
+
+    objects = LiveManager.from_queryset(MovieQuerySet)()
+    # The rating columns are written by movies.ratings under a row lock.
+    maintained_fields = ('view_count', 'pending_delete', 'rating_count', 'rating_sum', 'rating_avg', 'rating_histogram',
+                         'neighbors_stale', 'scores_stale')
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['title', 'id'], name='movie_title_idx'),
+            models.Index(fields=['release_year', 'id'], name='movie_release_year_idx'),
+            models.Index(fields=['-rating_avg', '-rating_count', 'id'], name='movie_rating_idx'),
+            models.Index(fields=['id'], name='movie_neighbors_stale_idx', condition=models.Q(neighbors_stale=True)),
+            models.Index(fields=['id'], name='movie_scores_stale_idx', condition=models.Q(scores_stale=True)),
+            models.Index(fields=['-view_count', 'id'], name='movie_views_idx'),
+            models.Index(fields=['id'], name='movie_pending_delete_idx', condition=models.Q(pending_delete=True)),
+        ]
 
     def __str__(self):
         return f"{self.title} ({self.release_year})"
 
 
+# One of a movie's top-k most similar movies by review co-ratings, shown as "viewers also liked".
+class MovieNeighbor(models.Model):
+    movie = models.ForeignKey(Movie, on_delete=models.CASCADE, related_name='neighbors')
+    neighbor = models.ForeignKey(Movie, on_delete=models.CASCADE, related_name='+')
+    similarity = models.FloatField()
+    rank = models.PositiveSmallIntegerField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['movie', 'rank'], name='unique_movie_neighbor_rank'),
+        ]
+
+    def __str__(self):
+        return f"{self.neighbor} for {self.movie} ({self.similarity:.3f})"
+
+
+# Precomputed leaderboard scores of a reviewed movie, so a leaderboard page is one index range read.
+# See movies.leaderboards for how trending_score is defined.
+class MovieScore(models.Model):
+    movie = models.OneToOneField(Movie, on_delete=models.CASCADE, primary_key=True, related_name='score')
+    genre = models.ForeignKey(Genre, on_delete=models.CASCADE, related_name='+')
+    bayesian_rating = models.FloatField()
+    trending_score = models.FloatField(null=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['-bayesian_rating', 'movie'], name='score_top_rated_idx'),
+            models.Index(fields=['genre', '-bayesian_rating', 'movie'], name='score_genre_top_rated_idx'),
+            models.Index(fields=['-trending_score', 'movie'], name='score_trending_idx',
+                         condition=models.Q(trending_score__isnull=False)),
+        ]
+
+    def __str__(self):
+        return f"{self.movie} ({self.bayesian_rating:.2f})"
+
+
 class Cast(models.Model):
     movie = models.ForeignKey(Movie, on_delete=models.CASCADE)
     person = models.ForeignKey(Person, on_delete=models.CASCADE, limit_choices_to={'role__in': ['actor', 'both']})
     role_name = models.CharField(max_length=255)
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['movie', 'person', 'role_name'], name='unique_cast_role'),
+        ]
+
     def __str__(self):
         return f"{self.person} as {self.role_name} in {self.movie}"
 
 
+# Denormalised filmography row: one per directing credit and one per cast row, kept in sync by movies.signals.
+class Credit(models.Model):
+    DIRECTOR = 'director'
+    ACTOR = 'actor'
+    KIND_CHOICES = [
+        (DIRECTOR, 'Director'),
+        (ACTOR, 'Actor'),
+    ]
+
+    person = models.ForeignKey(Person, on_delete=models.CASCADE, related_name='credits')
+    movie = models.ForeignKey(Movie, on_delete=models.CASCADE, related_name='+')
+    cast = models.OneToOneField(Cast, null=True, blank=True, on_delete=models.CASCADE, related_name='+')
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    role_name = models.CharField(max_length=255, blank=True)
+    title = models.CharField(max_length=255)
+    release_year = models.PositiveIntegerField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['person', '-release_year', 'title'], name='credit_person_year_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['person', 'movie'], condition=models.Q(kind='director'),
+                                    name='unique_director_credit'),
+        ]
+
+    def __str__(self):
+        return f"{self.person} ({self.kind}) in {self.title}"
+
+
 class Award(models.Model):
     name = models.CharField(max_length=255)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['name', 'id'], name='award_name_idx'),
+        ]
+
     def __str__(self):
         return self.name
 
@@ -63,16 +275,117 @@ class MovieAward(models.Model):
     award = models.ForeignKey(Award, on_delete=models.CASCADE)
     category = models.CharField(max_length=255)
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['movie', 'award', 'category'], name='unique_movie_award'),
+        ]
+
     def __str__(self):
         return f"{self.movie} - {self.award} ({self.category})"
 
 
+class ReviewQuerySet(ShardedQuerySet):
+    def live(self):
+        """
+        Leaves out reviews of movies waiting to be deleted. Shards cannot join
+        the movie table, so when reviews are sharded the pending movies' pks
+        are read first (a partial index covers them) and excluded on every shard.
+        """
+        if not is_sharded():
+            return self.filter(movie__pending_delete=False)
+        pending = list(Movie._base_manager.filter(pending_delete=True).values_list('pk', flat=True))
+        return self.exclude(movie_id__in=pending) if pending else self
+
+    def bulk_create(self, objs, *args, **kwargs):
+        from movies.ratings import apply_rating_changes
+
+        with transaction.atomic(using=self.db):
+            created = super().bulk_create(objs, *args, **kwargs)
+            apply_rating_changes((review.movie_id, review.rating, 1) for review in created)
+        return created
+
+    def update(self, **kwargs):
+        from movies.ratings import rebuild_ratings
+
+        if 'rating' not in kwargs and 'movie' not in kwargs and 'movie_id' not in kwargs:
+            return super().update(**kwargs)
+        with transaction.atomic(using=self.db):
+            movie_ids = set(self.values_list('movie_id', flat=True))
+            rows = super().update(**kwargs)
+            new_movie = kwargs.get('movie', kwargs.get('movie_id'))
+            if new_movie is not None:
+                movie_ids.add(getattr(new_movie, 'pk', new_movie))
+            rebuild_ratings(movie_ids)
+        return rows
+
+
 class Review(models.Model):
-    user = models.ForeignKey(User, on_delete=models.CASCADE)
-    movie = models.ForeignKey(Movie, on_delete=models.CASCADE)
+    # Reviews may live on another database than their user and movie (see movies.sharding), so the
+    # foreign keys are not enforced by the database; the cascades are run by Django and movies.signals.
+    user = models.ForeignKey(User, on_delete=models.CASCADE, db_constraint=False)
+    movie = models.ForeignKey(Movie, on_delete=models.CASCADE, db_constraint=False)
     rating = models.PositiveSmallIntegerField(choices=[(i, str(i)) for i in range(1, 11)])
     text = models.TextField()
     created_at = models.DateTimeField(auto_now_add=True)
 
+    objects = ReviewQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['movie', 'created_at'], name='review_movie_created_idx'),
+            models.Index(fields=['created_at', 'id'], name='review_created_idx'),
+        ]
+
     def __str__(self):
         return f'Review of {self.movie} by {self.user}'
+
+    def save(self, *args, **kwargs):
+        # The rating aggregates on Movie are updated from post_save and must commit together with the review.
+        if not is_sharded():
+            with transaction.atomic(using=kwargs.get('using')):
+                super().save(*args, **kwargs)
+            return
+        using = kwargs['using'] = kwargs.get('using') or shard_for(self.movie_id)
+        source = self._state.db
+        moving = not self._state.adding and source not in (None, using)
+        with atomic_on(*([source] if moving else []), using, DEFAULT_DB_ALIAS):
+            if self.pk is None:
+                self.pk = allocate_ids(1)[0]
+                if not args:
+                    kwargs.setdefault('force_insert', True)
+            elif moving:
+                # A new movie on another shard: the stored row moves there first, then is updated in place.
+                move_rows(list(Review._base_manager.using(source).filter(pk=self.pk)), source, using)
+            super().save(*args, **kwargs)
+
+
+class ShardSequence(models.Model):
+    # Id counters shared by every shard of a sharded table; see movies.sharding.allocate_ids.
+    name = models.CharField(max_length=64, primary_key=True)
+    last_value = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return f'{self.name}: {self.last_value}'
+
+
+# A Genre, Person or Movie hidden by its delete view and queued for movies.deletion to remove in batches.
+class Deletion(models.Model):
+    model_name = models.CharField(max_length=20)
+    object_id = models.PositiveBigIntegerField()
+    label = models.CharField(max_length=255)
+    requested_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    # Progress: rows removed so far and the table last worked on.
+    rows_deleted = models.PositiveBigIntegerField(default=0)
+    stage = models.CharField(max_length=100, blank=True)
+    # The run working on it; its claim lapses once updated_at is MOVIES_DELETE_CLAIM_SECONDS old.
+    claimed_by = models.CharField(max_length=64, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['id'], name='deletion_pending_idx', condition=models.Q(finished_at__isnull=True)),
+        ]
+
+    def __str__(self):
+        return f"{self.model_name} {self.label}"
@@ -0,0 +1,187 @@
+import base64
+import binascii
+import datetime
+import json
+
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+from django.http import Http404
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+class CursorEncoder(DjangoJSONEncoder):
+    def default(self, o):
+        # DjangoJSONEncoder drops microseconds, which would make the seek skip rows.
+        if isinstance(o, (datetime.datetime, datetime.time)):
+            return o.isoformat()
+        return super().default(o)
+
+
+def encode_cursor(values, backwards=False):
+    payload = json.dumps({'v': values, 'b': backwards}, cls=CursorEncoder, separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()).decode())
+        return payload['v'], bool(payload['b'])
+    except (binascii.Error, UnicodeDecodeError, ValueError, KeyError, TypeError):
+        raise InvalidCursor(token)
+
+
+class KeysetPage:
+    def __init__(self, object_list, has_next, has_previous, next_cursor, previous_cursor):
+        self.object_list = object_list
+        self._has_next = has_next
+        self._has_previous = has_previous
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+        self.next_url = None
+        self.previous_url = None
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_next(self):
+        return self._has_next
+
+    def has_previous(self):
+        return self._has_previous
+
+    def has_other_pages(self):
+        return self._has_next or self._has_previous
+
+
+class KeysetPaginator:
+    """
+    Paginates by remembering the sort key of the last row instead of an OFFSET,
+    so every page is a bounded index range read. The ordering must not contain
+    nullable columns; 'pk' is appended as a tie-breaker when missing.
+    """
+
+    def __init__(self, queryset, ordering, per_page):
+        self.queryset = queryset
+        self.per_page = per_page
+        ordering = list(ordering)
+        if not any(field.lstrip('-') in ('pk', 'id') for field in ordering):
+            descending = ordering[-1].startswith('-') if ordering else False
+            ordering.append('-pk' if descending else 'pk')
+        self.ordering = ordering
+        self.fields = [(field.lstrip('-'), field.startswith('-')) for field in ordering]
+
+    def position(self, obj):
+        return [getattr(obj, name) for name, _ in self.fields]
+
+    def cursor_for(self, obj, backwards=False):
+        return encode_cursor(self.position(obj), backwards)
+
+    def _to_python(self, name, value):
+        model = self.queryset.model
+        try:
+            field = model._meta.pk if name == 'pk' else model._meta.get_field(name)
+        except FieldDoesNotExist:
+            return value
+        try:
+            return field.to_python(value)
+        except ValidationError:
+            raise InvalidCursor(value)
+
+    def _seek(self, position, backwards):
+        if len(position) != len(self.fields):
+            raise InvalidCursor(position)
+        values = [self._to_python(name, value) for (name, _), value in zip(self.fields, position)]
+        seek = Q()
+        equal = Q()
+        for (name, descending), value in zip(self.fields, values):
+            lookup = 'lt' if descending != backwards else 'gt'
+            seek |= equal & Q(**{f'{name}__{lookup}': value})
+            equal &= Q(**{name: value})
+        first_name, first_descending = self.fields[0]
+        bound = 'lte' if first_descending != backwards else 'gte'
+        return Q(**{f'{first_name}__{bound}': values[0]}) & seek
+
+    def page_queryset(self, position=None, backwards=False):
+        ordering = self.ordering
+        if backwards:
+            ordering = [field[1:] if field.startswith('-') else f'-{field}' for field in ordering]
+        queryset = self.queryset.order_by(*ordering)
+        if position is not None:
+            queryset = queryset.filter(self._seek(position, backwards))
+        return queryset[:self.per_page + 1]
+
+    def _trim(self, rows, backwards):
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if backwards:
+            rows.reverse()
+        return rows, has_more
+
+    def fetch(self, position=None, backwards=False):
+        return self._trim(list(self.page_queryset(position, backwards)), backwards)
+
+    async def afetch(self, position=None, backwards=False):
+        return self._trim([obj async for obj in self.page_queryset(position, backwards)], backwards)
+
+    def page(self, cursor=None):
+        position, backwards = decode_cursor(cursor) if cursor else (None, False)
+        rows, has_more = self.fetch(position, backwards)
+        return self.build_page(rows, has_more, position is not None, backwards)
+
+    async def apage(self, cursor=None):
+        position, backwards = decode_cursor(cursor) if cursor else (None, False)
+        rows, has_more = await self.afetch(position, backwards)
+        return self.build_page(rows, has_more, position is not None, backwards)
+
+    def build_page(self, rows, has_more, from_cursor, backwards):
+        if backwards:
+            has_next, has_previous = from_cursor, has_more
+        else:
+            has_next, has_previous = has_more, from_cursor
+        next_cursor = self.cursor_for(rows[-1]) if rows and has_next else None
+        previous_cursor = self.cursor_for(rows[0], backwards=True) if rows and has_previous else None
+        return KeysetPage(rows, has_next, has_previous, next_cursor, previous_cursor)
+
+
+class KeysetPaginationMixin:
+    paginate_by = 25
+    keyset_ordering = ('pk',)
+    cursor_kwarg = 'cursor'
+    paginator_class = KeysetPaginator
+
+    def get_keyset_ordering(self):
+        return self.keyset_ordering
+
+    def get_keyset_paginator(self, queryset, page_size):
+        return self.paginator_class(queryset, self.get_keyset_ordering(), page_size)
+
+    def get_page_url(self, cursor):
+        query = self.request.GET.copy()
+        query[self.cursor_kwarg] = cursor
+        return f'?{query.urlencode()}'
+
+    def paginate_queryset(self, queryset, page_size):
+        paginator = self.get_keyset_paginator(queryset, page_size)
+        try:
+            page = paginator.page(self.request.GET.get(self.cursor_kwarg))
+        except InvalidCursor:
+            raise Http404('Invalid page cursor.')
+        return self.paginated(paginator, page)
+
+    def paginated(self, paginator, page):
+        if page.next_cursor:
+            page.next_url = self.get_page_url(page.next_cursor)
+        if page.previous_cursor:
+            page.previous_url = self.get_page_url(page.previous_cursor)
+        return paginator, page, page.object_list, page.has_other_pages()
@@ -0,0 +1,257 @@
+import bisect
+import cProfile
+import io
+import pstats
+import threading
+import time
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.db import connection
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+from django.http import HttpResponse
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 200, 500)
+SIZE_BUCKETS = (1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+# name -> (help text, bucket upper bounds)
+METRICS = {
+    'latency_seconds': ('Time spent in the view, its template and the middleware below it.', LATENCY_BUCKETS),
+    'db_seconds': ('Time spent executing SQL statements.', LATENCY_BUCKETS),
+    'render_seconds': ('Time spent rendering the response template.', LATENCY_BUCKETS),
+    'queries': ('SQL statements executed.', QUERY_BUCKETS),
+    'response_bytes': ('Size of the response body (not recorded for streaming responses).', SIZE_BUCKETS),
+}
+
+
+class Histogram:
+    __slots__ = ('bounds', 'counts', 'count', 'sum')
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def copy(self):
+        histogram = Histogram(self.bounds)
+        histogram.counts, histogram.count, histogram.sum = list(self.counts), self.count, self.sum
+        return histogram
+
+    def cumulative(self):
+        running, counts = 0, []
+        for count in self.counts:
+            running += count
+            counts.append(running)
+        return counts
+
+    @property
+    def mean(self):
+        return self.sum / self.count if self.count else 0.0
+
+    def quantile(self, q):
+        # Interpolates within the bucket holding the q-th observation, like Prometheus' histogram_quantile().
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        lower, below = 0.0, 0
+        for bound, cumulative in zip(self.bounds, self.cumulative()):
+            if cumulative >= rank:
+                inside = cumulative - below
+                return lower + (bound - lower) * ((rank - below) / inside if inside else 1)
+            lower, below = bound, cumulative
+        return self.bounds[-1]
+
+
+class PerfRecorder:
+    """
+    In-process histograms of request metrics per URL name. Each worker process
+    keeps its own, so a scraper has to collect every worker.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.routes = {}
+        self.statuses = {}
+
+    def record(self, route, status, sample):
+        with self.lock:
+            histograms = self.routes.get(route)
+            if histograms is None:
+                histograms = self.routes[route] = {name: Histogram(bounds) for name, (_, bounds) in METRICS.items()}
+            for name, value in sample.items():
+                if value is not None:
+                    histograms[name].observe(value)
+            key = (route, status)
+            self.statuses[key] = self.statuses.get(key, 0) + 1
+
+    def snapshot(self):
+        with self.lock:
+            routes = {
+                route: {name: histogram.copy() for name, histogram in histograms.items()}
+                for route, histograms in self.routes.items()
+            }
+            return routes, dict(self.statuses)
+
+    def reset(self):
+        with self.lock:
+            self.routes.clear()
+            self.statuses.clear()
+
+    def prometheus(self, prefix='movies_request_'):
+        routes, statuses = self.snapshot()
+        lines = [f'# HELP {prefix}total Requests handled, by URL name and status code.',
+                 f'# TYPE {prefix}total counter']
+        for (route, status), count in sorted(statuses.items()):
+            lines.append(f'{prefix}total{{route="{escape_label(route)}",status="{status}"}} {count}')
+        for name, (help_text, bounds) in METRICS.items():
+            metric = f'{prefix}{name}'
+            lines += [f'# HELP {metric} {help_text}', f'# TYPE {metric} histogram']
+            for route in sorted(routes):
+                histogram, label = routes[route][name], f'route="{escape_label(route)}"'
+                for bound, count in zip(bounds + (float('inf'),), histogram.cumulative()):
+                    le = '+Inf' if bound == float('inf') else repr(float(bound))
+                    lines.append(f'{metric}_bucket{{{label},le="{le}"}} {count}')
+                lines.append(f'{metric}_sum{{{label}}} {histogram.sum!r}')
+                lines.append(f'{metric}_count{{{label}}} {histogram.count}')
+        return '\n'.join(lines) + '\n'
+
+
+def escape_label(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+recorder = PerfRecorder()
+
+
+class RequestStats:
+    __slots__ = ('queries', 'db_seconds', 'render_started', 'render_seconds')
+
+    def __init__(self):
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.render_started = None
+        self.render_seconds = None
+
+    def rendered(self, response):
+        self.render_seconds = time.perf_counter() - self.render_started
+
+
+# The stats of the request being handled. Context variables follow the request into sync_to_async threads,
+# whose database connections are their own, so every connection carries time_query() and reports here.
+current_stats = ContextVar('movies_perf_stats', default=None)
+
+
+def time_query(execute, sql, params, many, context):
+    stats = current_stats.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.db_seconds += time.perf_counter() - start
+        stats.queries += 1
+
+
+def install_query_timer(connection):
+    if time_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(time_query)
+
+
+@receiver(connection_created)
+def add_query_timer(sender, connection, **kwargs):
+    install_query_timer(connection)
+
+
+class PerfMiddleware:
+    """
+    Records query count, SQL time, template render time, latency and response
+    size of every request into `recorder`, keyed by URL name. A staff user
+    adding ?_profile=1 gets a cProfile report of the request instead of the
+    response.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if self.wants_profile(request):
+            profiler = cProfile.Profile()
+            profiler.enable()
+            try:
+                self.get_response(request)
+            finally:
+                profiler.disable()
+            return self.profile_response(profiler)
+        stats, start, token = self.begin(request)
+        install_query_timer(connection)
+        try:
+            response = self.get_response(request)
+        finally:
+            current_stats.reset(token)
+        self.finish(request, response, stats, start)
+        return response
+
+    async def __acall__(self, request):
+        if self.wants_profile(request):
+            profiler = cProfile.Profile()
+            profiler.enable()
+            try:
+                await self.get_response(request)
+            finally:
+                profiler.disable()
+            return self.profile_response(profiler)
+        stats, start, token = self.begin(request)
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_stats.reset(token)
+        self.finish(request, response, stats, start)
+        return response
+
+    def wants_profile(self, request):
+        user = getattr(request, 'user', None)
+        return request.GET.get('_profile') == '1' and user is not None and user.is_staff
+
+    def begin(self, request):
+        stats = RequestStats()
+        request._perf_stats = stats
+        return stats, time.perf_counter(), current_stats.set(stats)
+
+    def process_template_response(self, request, response):
+        stats = getattr(request, '_perf_stats', None)
+        if stats is not None:
+            stats.render_started = time.perf_counter()
+            response.add_post_render_callback(stats.rendered)
+        return response
+
+    def finish(self, request, response, stats, start):
+        match = getattr(request, 'resolver_match', None)
+        route = match.view_name if match else '<unresolved>'
+        recorder.record(route, response.status_code, {
+            'latency_seconds': time.perf_counter() - start,
+            'db_seconds': stats.db_seconds,
+            'render_seconds': stats.render_seconds,
+            'queries': stats.queries,
+            'response_bytes': None if getattr(response, 'streaming', False) else len(response.content),
+        })
+
+    def profile_response(self, profiler, limit=60):
+        out = io.StringIO()
+        pstats.Stats(profiler, stream=out).sort_stats('cumulative').print_stats(limit)
+        return HttpResponse(out.getvalue(), content_type='text/plain; charset=utf-8')
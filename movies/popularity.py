@@ -0,0 +1,159 @@
+import atexit
+import logging
+import threading
+import time
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.db import DatabaseError, connections
+from django.db.models import F
+
+logger = logging.getLogger(__name__)
+
+
+def get_flush_seconds():
+    return getattr(settings, 'MOVIES_VIEW_FLUSH_SECONDS', 10)
+
+
+def get_buffer_size():
+    return getattr(settings, 'MOVIES_VIEW_BUFFER_SIZE', 1000)
+
+
+def write_views(pending):
+    """
+    Adds {(model, pk): views} to the stored view counts with one UPDATE ...
+    SET view_count = view_count + n per model and distinct n, so a flush costs
+    a handful of statements however many objects it covers. Each statement
+    commits on its own and only adds, so flushes of several workers interleave
+    without losing each other's views or waiting on each other's transactions.
+    """
+    groups = defaultdict(lambda: defaultdict(list))
+    for (model, pk), views in pending.items():
+        groups[model][views].append(pk)
+    for model, by_views in groups.items():
+        for views, pks in sorted(by_views.items()):
+            model._base_manager.filter(pk__in=sorted(pks)).update(view_count=F('view_count') + views)
+
+
+class ViewCounter:
+    """
+    Per-process buffer of detail page views. record() only bumps a count in
+    memory; the counts are written by write_views() from a background thread
+    once buffer_size objects are pending, or by a timer flush_seconds after
+    the last flush, so no request waits on the write and a worker that goes
+    idle still writes what it holds. A crash loses at most the views of one
+    buffer; a failed flush keeps its counts for the next one.
+    """
+
+    def __init__(self, flush_seconds=10, buffer_size=1000):
+        self.flush_seconds = flush_seconds
+        self.buffer_size = buffer_size
+        self.lock = threading.Lock()
+        self.pending = Counter()
+        self.flushed_at = time.monotonic()
+        self.flushing = False
+        self.timer = None
+
+    def record(self, model, pk):
+        with self.lock:
+            self.pending[model, pk] += 1
+            due = len(self.pending) >= self.buffer_size or time.monotonic() - self.flushed_at >= self.flush_seconds
+            if not due or self.flushing:
+                self.schedule()
+                return
+            self.flushing = True
+        threading.Thread(target=self.flush_in_background, daemon=True).start()
+
+    def schedule(self):
+        # Called with the lock held. At most one timer is armed, and only while views are pending.
+        if self.timer is None and self.pending:
+            delay = max(0.0, self.flushed_at + self.flush_seconds - time.monotonic())
+            self.timer = threading.Timer(min(delay, threading.TIMEOUT_MAX), self.flush_when_due)
+            self.timer.daemon = True
+            self.timer.start()
+
+    def flush_when_due(self):
+        with self.lock:
+            self.timer = None
+            # A running flush reschedules whatever it leaves pending when it ends.
+            if not self.pending or self.flushing:
+                return
+            self.flushing = True
+        self.flush_in_background()
+
+    def stop(self):
+        """Cancels the timed flush, leaving the pending counts as they are."""
+        with self.lock:
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+
+    def pending_views(self):
+        with self.lock:
+            return sum(self.pending.values())
+
+    def flush(self):
+        """Writes the pending counts now; returns the number of views written."""
+        with self.lock:
+            pending, self.pending = self.pending, Counter()
+            self.flushed_at = time.monotonic()
+        try:
+            write_views(pending)
+        except DatabaseError:
+            with self.lock:
+                self.pending.update(pending)
+            raise
+        return sum(pending.values())
+
+    def flush_in_background(self):
+        try:
+            self.flush()
+        except DatabaseError:
+            logger.exception('Writing view counts failed; keeping them for the next flush.')
+        finally:
+            with self.lock:
+                self.flushing = False
+                self.schedule()
+            connections.close_all()
+
+
+_counter = None
+_counter_lock = threading.Lock()
+
+
+def get_view_counter():
+    global _counter
+    if _counter is None:
+        with _counter_lock:
+            if _counter is None:
+                _counter = ViewCounter(get_flush_seconds(), get_buffer_size())
+    return _counter
+
+
+def reset_view_counter():
+    global _counter
+    if _counter is not None:
+        _counter.stop()
+    _counter = None
+
+
+@atexit.register
+def flush_at_exit():
+    # A worker that is shut down cleanly writes what it has buffered.
+    if _counter is not None and _counter.pending:
+        try:
+            _counter.flush()
+        except DatabaseError:
+            logger.exception('Writing view counts at exit failed.')
+
+
+def record_view(obj):
+    get_view_counter().record(type(obj), obj.pk)
+
+
+class CountViewsMixin:
+    """Counts a view of the object of a detail page each time the page is rendered, cached or not."""
+
+    def render_to_response(self, context, **response_kwargs):
+        record_view(self.object)
+        return super().render_to_response(context, **response_kwargs)
@@ -0,0 +1,62 @@
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import Count
+
+from movies.cache import detail_cache
+from movies.facets import index_ratings
+from movies.models import Movie, Review, empty_rating_histogram
+
+RATING_FIELDS = ['rating_count', 'rating_sum', 'rating_avg', 'rating_histogram', 'neighbors_stale', 'scores_stale']
+
+
+def _set_histogram(movie, histogram):
+    # Any change to a movie's ratings changes its co-rating similarities and leaderboard scores as well.
+    changed = histogram != movie.rating_histogram
+    movie.neighbors_stale = movie.neighbors_stale or changed
+    movie.scores_stale = movie.scores_stale or changed
+    movie.rating_histogram = histogram
+    movie.rating_count = sum(histogram)
+    movie.rating_sum = sum(rating * count for rating, count in enumerate(histogram, start=1))
+    movie.rating_avg = movie.rating_sum / movie.rating_count if movie.rating_count else 0
+
+
+def apply_rating_changes(changes):
+    """
+    Applies (movie_id, rating, delta) triples to the stored aggregates. Movie
+    rows are locked in pk order so concurrent writers cannot lose increments.
+    """
+    histograms = defaultdict(empty_rating_histogram)
+    for movie_id, rating, delta in changes:
+        histograms[movie_id][rating - 1] += delta
+    histograms = {movie_id: histogram for movie_id, histogram in histograms.items() if any(histogram)}
+    if not histograms:
+        return
+
+    with transaction.atomic():
+        movies = list(
+            Movie.objects.select_for_update().filter(pk__in=histograms).only(*RATING_FIELDS).order_by('pk')
+        )
+        for movie in movies:
+            deltas = histograms[movie.pk]
+            _set_histogram(movie, [max(stored + delta, 0) for stored, delta in zip(movie.rating_histogram, deltas)])
+        Movie.objects.bulk_update(movies, RATING_FIELDS)
+        detail_cache.invalidate('movie', histograms)
+        index_ratings(movies)
+
+
+def rebuild_ratings(movie_ids):
+    movie_ids = list(movie_ids)
+    if not movie_ids:
+        return
+    with transaction.atomic():
+        movies = list(Movie.objects.select_for_update().filter(pk__in=movie_ids).only(*RATING_FIELDS).order_by('pk'))
+        histograms = defaultdict(empty_rating_histogram)
+        counts = Review.objects.filter(movie_id__in=movie_ids).values('movie_id', 'rating').annotate(n=Count('pk'))
+        for row in counts.order_by():
+            histograms[row['movie_id']][row['rating'] - 1] = row['n']
+        for movie in movies:
+            _set_histogram(movie, histograms[movie.pk])
+        Movie.objects.bulk_update(movies, RATING_FIELDS)
+        detail_cache.invalidate('movie', movie_ids)
+        index_ratings(movies)
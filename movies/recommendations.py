@@ -0,0 +1,217 @@
+from itertools import islice
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from scipy import sparse
+
+from movies.cache import detail_cache
+from movies.models import Movie, MovieNeighbor, Review
+
+SIMILARITIES = ('cosine', 'adjusted_cosine')
+
+
+def get_similarity():
+    similarity = getattr(settings, 'MOVIES_RECOMMENDATION_SIMILARITY', 'adjusted_cosine')
+    if similarity not in SIMILARITIES:
+        raise ValueError(f'MOVIES_RECOMMENDATION_SIMILARITY must be one of {", ".join(SIMILARITIES)}.')
+    return similarity
+
+
+def get_neighbor_count():
+    return getattr(settings, 'MOVIES_RECOMMENDATION_NEIGHBORS', 10)
+
+
+class RatingMatrix:
+    """
+    Sparse movie × user matrix of review ratings with L2-normalised rows, so the
+    dot product of two rows is the cosine similarity of the two movies. For
+    adjusted cosine every rating is first centred on its user's mean rating.
+    """
+
+    def __init__(self, movie_ids, matrix):
+        self.movie_ids = movie_ids
+        self.matrix = matrix
+        self.transposed = matrix.T.tocsr()
+
+    @classmethod
+    def from_reviews(cls, similarity='adjusted_cosine', chunk_size=100_000):
+        rows = Review.objects.order_by().values_list('movie_id', 'user_id', 'rating').iterator(chunk_size=chunk_size)
+        chunks = []
+        while batch := list(islice(rows, chunk_size)):
+            chunks.append(np.array(batch, dtype=np.int64))
+        reviews = np.concatenate(chunks) if chunks else np.empty((0, 3), dtype=np.int64)
+        del chunks
+
+        movie_ids, movie_index = np.unique(reviews[:, 0], return_inverse=True)
+        user_ids, user_index = np.unique(reviews[:, 1], return_inverse=True)
+        ratings = reviews[:, 2].astype(np.float64)
+        del reviews
+        if similarity == 'adjusted_cosine':
+            counts = np.bincount(user_index, minlength=len(user_ids))
+            ratings -= (np.bincount(user_index, weights=ratings, minlength=len(user_ids)) / counts)[user_index]
+
+        shape = (len(movie_ids), len(user_ids))
+        matrix = sparse.csr_matrix((ratings, (movie_index, user_index)), shape=shape)
+        # Nothing stops a user from reviewing a movie twice; average those ratings instead of summing them.
+        repeats = sparse.csr_matrix((np.ones_like(ratings), (movie_index, user_index)), shape=shape)
+        matrix.data /= repeats.data
+        matrix.eliminate_zeros()
+        norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+        scale = np.divide(1.0, norms, out=np.zeros_like(norms), where=norms > 0)
+        return cls(movie_ids, (sparse.diags(scale) @ matrix).astype(np.float32).tocsr())
+
+    def rows_of(self, movie_ids):
+        positions = np.searchsorted(self.movie_ids, movie_ids)
+        positions = np.minimum(positions, max(len(self.movie_ids) - 1, 0))
+        found = (self.movie_ids[positions] == movie_ids) if len(self.movie_ids) else np.zeros(len(movie_ids), bool)
+        return positions[found], np.asarray(movie_ids)[~found]
+
+    def blocks(self, rows, max_cells):
+        """Splits rows so that no block's similarity product exceeds max_cells entries."""
+        size = max(1, max_cells // max(1, len(self.movie_ids)))
+        for start in range(0, len(rows), size):
+            yield rows[start:start + size]
+
+    def similarities(self, rows):
+        """Sparse len(rows) × movies matrix of similarities between the given rows and every movie."""
+        return (self.matrix[rows] @ self.transposed).tocsr()
+
+    def top_k(self, product, rows, k):
+        """Yields (movie_id, [(neighbor_id, similarity), ...]) for each row of a similarities() product."""
+        for offset, row in enumerate(rows):
+            start, end = product.indptr[offset], product.indptr[offset + 1]
+            columns, scores = product.indices[start:end], product.data[start:end]
+            keep = (columns != row) & (scores > 0)
+            columns, scores = columns[keep], scores[keep]
+            if len(scores) > k:
+                best = np.argpartition(-scores, k - 1)[:k]
+                columns, scores = columns[best], scores[best]
+            ids = self.movie_ids[columns]
+            order = np.lexsort((ids, -scores))
+            yield int(self.movie_ids[row]), list(zip(ids[order].tolist(), scores[order].tolist()))
+
+
+def ranked(candidates, k):
+    return sorted(candidates, key=lambda item: (-item[1], item[0]))[:k]
+
+
+def load_neighbors(movie_ids, chunk_size=1000):
+    movie_ids = list(movie_ids)
+    neighbors = {movie_id: [] for movie_id in movie_ids}
+    for start in range(0, len(movie_ids), chunk_size):
+        rows = MovieNeighbor.objects.filter(movie_id__in=movie_ids[start:start + chunk_size]).order_by('movie_id', 'rank')
+        for movie_id, neighbor_id, similarity in rows.values_list('movie_id', 'neighbor_id', 'similarity'):
+            neighbors[movie_id].append((neighbor_id, similarity))
+    return neighbors
+
+
+def store_neighbors(neighbors):
+    """Replaces the stored neighbour lists of the movies in `neighbors` (movie_id -> ranked list)."""
+    if not neighbors:
+        return
+    referenced = set(neighbors).union(*(
+        (neighbor_id for neighbor_id, _ in ranking) for ranking in neighbors.values()
+    ))
+    # Movies deleted since the matrix was read must not be written back.
+    existing = set(Movie.objects.filter(pk__in=referenced).values_list('pk', flat=True))
+    with transaction.atomic():
+        MovieNeighbor.objects.filter(movie_id__in=list(neighbors)).delete()
+        MovieNeighbor.objects.bulk_create([
+            MovieNeighbor(movie_id=movie_id, neighbor_id=neighbor_id, similarity=similarity, rank=rank)
+            for movie_id, ranking in neighbors.items() if movie_id in existing
+            for rank, (neighbor_id, similarity) in enumerate(
+                [(neighbor_id, similarity) for neighbor_id, similarity in ranking if neighbor_id in existing], start=1
+            )
+        ], batch_size=1000)
+        detail_cache.invalidate('movie', neighbors)
+
+
+def fold_in(changed_ids, scores, k, recomputed=frozenset()):
+    """
+    Updates the lists of movies whose ratings did not change. Their similarity
+    to a movie outside `changed_ids` is unchanged, so the new top-k is the
+    stored list with the changed movies re-scored from `scores` (movie_id ->
+    {changed_id: similarity}). That is exact unless an entry dropped out of a
+    full list without a replacement scoring at least the old k-th score: then
+    an unstored movie might belong in it, and the movie is marked stale.
+    """
+    changed_ids = set(changed_ids)
+    holders = MovieNeighbor.objects.filter(neighbor_id__in=list(changed_ids)).values_list('movie_id', flat=True)
+    affected = (set(scores) | set(holders)) - changed_ids - recomputed
+    stored = load_neighbors(affected)
+    updated, stale = {}, []
+    for movie_id in affected:
+        old = stored[movie_id]
+        new = ranked(
+            [(neighbor_id, similarity) for neighbor_id, similarity in old if neighbor_id not in changed_ids]
+            + list(scores.get(movie_id, {}).items()), k,
+        )
+        if new == old:
+            continue
+        updated[movie_id] = new
+        if len(old) >= k and (len(new) < k or new[-1][1] < old[-1][1]):
+            stale.append(movie_id)
+    store_neighbors(updated)
+    Movie.objects.filter(pk__in=stale).update(neighbors_stale=True)
+
+
+def column_scores(matrix, product, block):
+    """Inverts a similarities() product into movie_id -> {block movie_id: similarity}, positive scores only."""
+    block_ids = matrix.movie_ids[block]
+    columns = product.T.tocsr()
+    scores = {}
+    for column in np.flatnonzero(np.diff(columns.indptr)):
+        start, end = columns.indptr[column], columns.indptr[column + 1]
+        scores[int(matrix.movie_ids[column])] = {
+            int(block_ids[offset]): float(score)
+            for offset, score in zip(columns.indices[start:end], columns.data[start:end]) if score > 0
+        }
+    return scores
+
+
+# Fold-in inverts each block product into Python dicts, so incremental blocks are kept smaller.
+FOLD_IN_CELLS = 1_000_000
+# Past this share of stale movies a full recomputation is cheaper than folding every change in.
+FULL_REFRESH_RATIO = 0.25
+
+
+def refresh_neighbors(full=False, max_cells=25_000_000, chunk_size=100_000):
+    """
+    Recomputes "viewers also liked" neighbours: every movie with full=True,
+    otherwise only movies whose ratings changed (neighbors_stale), folding
+    their new scores into the other movies' lists. The similarity product is
+    computed in row blocks of at most max_cells entries to bound memory.
+    Returns the number of movies whose own list was recomputed.
+    """
+    similarity, k = get_similarity(), get_neighbor_count()
+    stale_ids = set(Movie.objects.filter(neighbors_stale=True).values_list('pk', flat=True))
+    if not full and not stale_ids:
+        return 0
+    # Cleared up front so ratings that change while this runs mark their movies stale again.
+    Movie.objects.filter(pk__in=stale_ids).update(neighbors_stale=False)
+    try:
+        matrix = RatingMatrix.from_reviews(similarity, chunk_size)
+        full = full or len(stale_ids) > FULL_REFRESH_RATIO * len(matrix.movie_ids)
+        if full:
+            rows = np.arange(len(matrix.movie_ids))
+            listed = set(MovieNeighbor.objects.values_list('movie_id', flat=True).distinct())
+            missing = sorted(listed - set(matrix.movie_ids.tolist()))
+        else:
+            rows, missing = matrix.rows_of(np.array(sorted(stale_ids), dtype=np.int64))
+            missing = missing.tolist()
+            max_cells = min(max_cells, FOLD_IN_CELLS)
+
+        # Movies without any reviews left have no neighbours and appear in nobody's list.
+        store_neighbors({movie_id: [] for movie_id in missing})
+        if not full:
+            fold_in(missing, {}, k, stale_ids)
+        for block in matrix.blocks(rows, max_cells):
+            product = matrix.similarities(block)
+            store_neighbors(dict(matrix.top_k(product, block, k)))
+            if not full:
+                fold_in(matrix.movie_ids[block].tolist(), column_scores(matrix, product, block), k, stale_ids)
+    except BaseException:
+        Movie.objects.filter(pk__in=stale_ids).update(neighbors_stale=True)
+        raise
+    return len(rows) + len(missing)
@@ -0,0 +1,314 @@
+import logging
+import random
+import threading
+import time
+from contextvars import ContextVar
+
+from asgiref.sync import async_to_sync, iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, InterfaceError, OperationalError, connections
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+logger = logging.getLogger(__name__)
+
+PIN_COOKIE = 'movies_primary_until'
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+# Seconds a PostgreSQL standby is behind: 0 when it has replayed everything it received (an idle primary
+# leaves pg_last_xact_replay_timestamp() old however current the standby is), NULL when it is not a standby.
+LAG_SQL = (
+    'SELECT CASE WHEN NOT pg_is_in_recovery() THEN NULL '
+    'WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 '
+    'ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) END'
+)
+
+
+def get_pin_seconds():
+    return getattr(settings, 'MOVIES_READ_YOUR_WRITES_SECONDS', 10)
+
+
+class Route:
+    __slots__ = ('alias', 'replica', 'wrote')
+
+    def __init__(self, alias):
+        self.alias = alias
+        # The replica chosen for the request, kept after a failure moves its reads to the primary.
+        self.replica = alias
+        self.wrote = False
+
+    def reads_replica(self):
+        return self.alias != DEFAULT_DB_ALIAS and not self.wrote
+
+
+# The database the current request reads from, set by ReplicaMiddleware. Context variables follow the request
+# into sync_to_async threads; outside a request (management commands, tests) everything uses the primary.
+current_route = ContextVar('movies_db_route', default=None)
+
+
+def replica_may_predate(timestamp):
+    """
+    Whether the current request reads from a replica that may not have
+    replayed a write made at `timestamp` (epoch seconds) yet. Data read then
+    must not be cached under a stamp that write created: readers on the
+    primary, including the writer, would be served it. A replica's lag is only
+    known to be within MOVIES_REPLICA_MAX_LAG_SECONDS, and only as of its last
+    probe; without that setting it is unbounded.
+    """
+    route = current_route.get()
+    if route is None or not route.reads_replica():
+        return False
+    pool = get_replica_pool()
+    if pool.max_lag_seconds is None:
+        return True
+    # Stamps are dated to the whole second.
+    return time.time() - timestamp <= pool.max_lag_seconds + pool.check_seconds + 1
+
+
+class ReplicaPool:
+    """
+    The replica aliases of MOVIES_DATABASE_REPLICAS ({alias: weight}) and
+    their health, per process. A replica is probed with a query when first
+    picked and then at most every MOVIES_REPLICA_CHECK_SECONDS; one that
+    fails the probe, lags more than MOVIES_REPLICA_MAX_LAG_SECONDS or raises
+    a connection error mid-request is skipped for MOVIES_REPLICA_RETRY_SECONDS.
+    With no healthy replica left, reads go to the primary.
+    """
+
+    strategies = ('weighted', 'least_loaded')
+
+    def __init__(self, replicas, strategy='weighted', check_seconds=5, retry_seconds=30, max_lag_seconds=None):
+        for alias in replicas:
+            if alias == DEFAULT_DB_ALIAS or alias not in connections.settings:
+                raise ImproperlyConfigured(f'Replica {alias!r} is not a secondary alias in DATABASES.')
+        if strategy not in self.strategies:
+            raise ImproperlyConfigured(f'MOVIES_REPLICA_SELECTION must be one of {", ".join(self.strategies)}.')
+        self.replicas = dict(replicas)
+        self.strategy = strategy
+        self.check_seconds = check_seconds
+        self.retry_seconds = retry_seconds
+        self.max_lag_seconds = max_lag_seconds
+        self.lock = threading.Lock()
+        self.down_until = {}
+        self.checked_at = {}
+        self.in_flight = dict.fromkeys(self.replicas, 0)
+
+    def __contains__(self, alias):
+        return alias in self.replicas
+
+    def available(self):
+        now = time.monotonic()
+        with self.lock:
+            return [alias for alias in self.replicas if self.down_until.get(alias, 0) <= now]
+
+    def pick(self, candidates):
+        if self.strategy == 'least_loaded':
+            # Requests in flight per unit of weight; ties are broken at random so idle replicas share the load.
+            with self.lock:
+                load = {alias: self.in_flight[alias] / self.replicas[alias] for alias in candidates}
+            return min(candidates, key=lambda alias: (load[alias], random.random()))
+        return random.choices(candidates, weights=[self.replicas[alias] for alias in candidates])[0]
+
+    def choose(self):
+        candidates = self.available()
+        while candidates:
+            alias = self.pick(candidates)
+            if self.check(alias):
+                return alias
+            candidates.remove(alias)
+        return DEFAULT_DB_ALIAS
+
+    def check(self, alias):
+        if time.monotonic() - self.checked_at.get(alias, float('-inf')) < self.check_seconds:
+            return True
+        try:
+            lag = replication_lag(connections[alias])
+        except DatabaseError as error:
+            self.mark_down(alias, f'probe failed: {error}')
+            return False
+        if self.max_lag_seconds is not None and lag is not None and lag > self.max_lag_seconds:
+            self.mark_down(alias, f'{lag:.1f}s behind the primary')
+            return False
+        self.checked_at[alias] = time.monotonic()
+        return True
+
+    def mark_down(self, alias, reason):
+        logger.warning('Database replica %s is unavailable (%s); retrying in %ss.', alias, reason, self.retry_seconds)
+        with self.lock:
+            self.down_until[alias] = time.monotonic() + self.retry_seconds
+            self.checked_at.pop(alias, None)
+
+    def acquire(self, alias):
+        if alias in self.replicas:
+            with self.lock:
+                self.in_flight[alias] += 1
+
+    def release(self, alias):
+        if alias in self.replicas:
+            with self.lock:
+                self.in_flight[alias] -= 1
+
+    def status(self):
+        now = time.monotonic()
+        with self.lock:
+            return {
+                alias: {'weight': weight, 'in_flight': self.in_flight[alias],
+                        'down_for': max(0.0, self.down_until.get(alias, 0) - now)}
+                for alias, weight in self.replicas.items()
+            }
+
+
+def replication_lag(connection):
+    with connection.cursor() as cursor:
+        if connection.vendor != 'postgresql':
+            cursor.execute('SELECT 1')
+            return None
+        cursor.execute(LAG_SQL)
+        lag = cursor.fetchone()[0]
+    return None if lag is None else float(lag)
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_replica_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ReplicaPool(
+                    getattr(settings, 'MOVIES_DATABASE_REPLICAS', {}),
+                    strategy=getattr(settings, 'MOVIES_REPLICA_SELECTION', 'weighted'),
+                    check_seconds=getattr(settings, 'MOVIES_REPLICA_CHECK_SECONDS', 5),
+                    retry_seconds=getattr(settings, 'MOVIES_REPLICA_RETRY_SECONDS', 30),
+                    max_lag_seconds=getattr(settings, 'MOVIES_REPLICA_MAX_LAG_SECONDS', None),
+                )
+    return _pool
+
+
+def reset_replica_pool():
+    global _pool
+    _pool = None
+
+
+class ReplicaRouter:
+    """
+    Sends the reads of requests routed by ReplicaMiddleware to their replica
+    and everything else to the primary. Reads after the request has written,
+    or inside a transaction on the primary, stay there so they see the writes.
+    """
+
+    def db_for_read(self, model, **hints):
+        route = current_route.get()
+        if route is None or not route.reads_replica():
+            return DEFAULT_DB_ALIAS
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        return route.alias
+
+    def db_for_write(self, model, **hints):
+        route = current_route.get()
+        if route is not None:
+            route.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the primary's rows, so objects read from any of them can be related.
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas receive schema changes through replication.
+        return db not in get_replica_pool()
+
+
+def watch_replica(execute, sql, params, many, context):
+    try:
+        return execute(sql, params, many, context)
+    except (OperationalError, InterfaceError) as error:
+        get_replica_pool().mark_down(context['connection'].alias, f'query failed: {error}')
+        raise
+
+
+@receiver(connection_created)
+def add_replica_watch(sender, connection, **kwargs):
+    if connection.alias in get_replica_pool() and watch_replica not in connection.execute_wrappers:
+        connection.execute_wrappers.append(watch_replica)
+
+
+class ReplicaMiddleware:
+    """
+    Routes the reads of GET, HEAD and OPTIONS requests to one replica, chosen
+    per request by the pool. A request that writes sets a cookie keeping the
+    client's reads on the primary for MOVIES_READ_YOUR_WRITES_SECONDS, so the
+    user sees their own writes whatever the replication lag. A view whose
+    replica fails with a connection error is run again against the primary.
+    Goes above the session middleware, so session writes count too.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        route, token = self.begin(request)
+        try:
+            response = self.get_response(request)
+        finally:
+            self.end(route, token)
+        return self.finish(route, response)
+
+    async def __acall__(self, request):
+        route, token = self.begin(request)
+        try:
+            response = await self.get_response(request)
+        finally:
+            self.end(route, token)
+        return self.finish(route, response)
+
+    def begin(self, request):
+        pool = get_replica_pool()
+        alias = DEFAULT_DB_ALIAS
+        if pool.replicas and request.method in SAFE_METHODS and not self.pinned(request):
+            alias = pool.choose()
+            pool.acquire(alias)
+        route = Route(alias)
+        return route, current_route.set(route)
+
+    def pinned(self, request):
+        try:
+            return float(request.COOKIES.get(PIN_COOKIE, 0)) > time.time()
+        except ValueError:
+            return False
+
+    def end(self, route, token):
+        current_route.reset(token)
+        get_replica_pool().release(route.replica)
+
+    def process_exception(self, request, exception):
+        # watch_replica has already taken the replica out of rotation. Requests reaching here are safe, so
+        # running the view again is harmless, and nothing has been written unless route.wrote is set.
+        route = current_route.get()
+        if route is None or not route.reads_replica() or not isinstance(exception, (OperationalError, InterfaceError)):
+            return None
+        logger.warning('Retrying %s %s on the primary after replica %s failed.', request.method, request.path,
+                       route.alias)
+        route.alias = DEFAULT_DB_ALIAS
+        if iscoroutinefunction(self):
+            # Exception middleware runs in a worker thread under the async handler.
+            return async_to_sync(self.get_response)(request)
+        return self.get_response(request)
+
+    def finish(self, route, response):
+        if route.wrote and get_replica_pool().replicas:
+            seconds = get_pin_seconds()
+            response.set_cookie(PIN_COOKIE, f'{time.time() + seconds:.3f}', max_age=seconds, httponly=True,
+                                samesite='Lax')
+        return response
@@ -0,0 +1,230 @@
+import bisect
+import heapq
+import math
+import re
+import threading
+from collections import defaultdict
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.db import connection, transaction
+from django.db.models import F
+from django.utils.module_loading import import_string
+
+from movies.models import Movie
+from movies.pagination import InvalidCursor, KeysetPaginator
+
+SEARCH_CONFIG = 'simple'
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+TITLE_WEIGHT = 3.0
+DESCRIPTION_WEIGHT = 1.0
+
+
+def tokenize(text):
+    return [token.casefold() for token in TOKEN_RE.findall(text or '')]
+
+
+class PostgresSearchBackend:
+    """
+    Matches against Movie.search_vector, a tsvector column kept up to date by a
+    database trigger (title weighted A, description B) and covered by a GIN index.
+    """
+
+    def search(self, queryset, query):
+        search_query = SearchQuery(query, config=SEARCH_CONFIG, search_type='websearch')
+        return queryset.filter(search_vector=search_query).annotate(
+            search_rank=SearchRank(F('search_vector'), search_query),
+        )
+
+    def get_paginator(self, queryset, query, per_page):
+        return KeysetPaginator(self.search(queryset, query), ('-search_rank', 'pk'), per_page)
+
+    def match_ids(self, query, limit):
+        """
+        Pks of up to `limit` movies matching `query`, unranked, and whether they
+        are all the matches. One index scan however broad the query.
+        """
+        search_query = SearchQuery(query, config=SEARCH_CONFIG, search_type='websearch')
+        ids = list(Movie.objects.filter(search_vector=search_query).values_list('pk', flat=True)[:limit + 1])
+        return ids[:limit], len(ids) <= limit
+
+
+class RankedPaginator(KeysetPaginator):
+    """
+    Keyset pagination over scores computed outside the database. Only the rows
+    of the requested page are loaded; the ranking itself never touches SQL.
+    """
+
+    def __init__(self, queryset, scores, per_page):
+        super().__init__(queryset, ('-search_rank', 'pk'), per_page)
+        self.scores = scores
+        self._keys = None
+
+    def keys(self):
+        if self._keys is None:
+            allowed = self.queryset.filter(pk__in=self.scores).values_list('pk', flat=True)
+            self._keys = sorted((-self.scores[pk], pk) for pk in allowed)
+        return self._keys
+
+    def fetch(self, position=None, backwards=False):
+        keys = self.keys()
+        if position is None:
+            start, stop = 0, self.per_page + 1
+        else:
+            if len(position) != 2:
+                raise InvalidCursor(position)
+            key = (-float(position[0]), self._to_python('pk', position[1]))
+            if backwards:
+                stop = bisect.bisect_left(keys, key)
+                start = max(stop - self.per_page - 1, 0)
+            else:
+                start = bisect.bisect_right(keys, key)
+                stop = start + self.per_page + 1
+        window = keys[start:stop]
+        has_more = len(window) > self.per_page
+        if has_more:
+            window = window[1:] if backwards else window[:-1]
+        objects = self.queryset.in_bulk([pk for _, pk in window])
+        rows = []
+        for score, pk in window:
+            obj = objects.get(pk)
+            if obj is not None:
+                obj.search_rank = -score
+                rows.append(obj)
+        return rows, has_more
+
+    async def afetch(self, position=None, backwards=False):
+        return await sync_to_async(self.fetch)(position, backwards)
+
+
+class InMemorySearchBackend:
+    """
+    Pure Python inverted index over title and description, for SQLite and tests.
+    The index is built lazily on first use and kept current by Movie signals, so
+    it only sees writes made by this process.
+    """
+
+    def __init__(self, max_results=None):
+        self.max_results = max_results or getattr(settings, 'MOVIES_SEARCH_MAX_RESULTS', 1000)
+        self.lock = threading.RLock()
+        self.postings = None
+        self.documents = {}
+
+    def build(self):
+        postings = defaultdict(dict)
+        documents = {}
+        rows = Movie.objects.values_list('pk', 'title', 'description').iterator(chunk_size=2000)
+        for pk, title, description in rows:
+            documents[pk] = self._add(postings, pk, title, description)
+        with self.lock:
+            self.postings, self.documents = postings, documents
+
+    def _add(self, postings, pk, title, description):
+        weights = defaultdict(float)
+        for token in tokenize(title):
+            weights[token] += TITLE_WEIGHT
+        for token in tokenize(description):
+            weights[token] += DESCRIPTION_WEIGHT
+        for token, weight in weights.items():
+            postings[token][pk] = weight
+        return list(weights)
+
+    def _remove(self, pk):
+        for token in self.documents.pop(pk, ()):
+            documents = self.postings.get(token)
+            if documents is not None:
+                documents.pop(pk, None)
+                if not documents:
+                    del self.postings[token]
+
+    def update(self, pk, title, description):
+        with self.lock:
+            if self.postings is None:
+                return
+            self._remove(pk)
+            self.documents[pk] = self._add(self.postings, pk, title, description)
+
+    def remove(self, pk):
+        with self.lock:
+            if self.postings is not None:
+                self._remove(pk)
+
+    def postings_for(self, query):
+        # The postings of every query term, shortest first, or [] when some term matches nothing.
+        if self.postings is None:
+            self.build()
+        matches = [self.postings.get(term, {}) for term in set(tokenize(query))]
+        if not matches or not all(matches):
+            return []
+        return sorted(matches, key=len)
+
+    def rank(self, query):
+        with self.lock:
+            matches = self.postings_for(query)
+            if not matches:
+                return {}
+            total = len(self.documents)
+            scores = {}
+            for pk in matches[0]:
+                score = 0.0
+                for documents in matches:
+                    weight = documents.get(pk)
+                    if weight is None:
+                        break
+                    score += (1 + math.log(weight)) * math.log(1 + total / len(documents))
+                else:
+                    scores[pk] = score
+        return dict(heapq.nsmallest(self.max_results, scores.items(), key=lambda item: (-item[1], item[0])))
+
+    def search(self, queryset, query):
+        # Unranked, so every match: like the PostgreSQL backend, only relevance ranking is capped.
+        return queryset.filter(pk__in=self.match_ids(query, None)[0])
+
+    def get_paginator(self, queryset, query, per_page):
+        return RankedPaginator(queryset, self.rank(query), per_page)
+
+    def match_ids(self, query, limit):
+        # Every match, unlike rank(): intersecting postings in memory costs no query, so nothing needs capping.
+        with self.lock:
+            matches = self.postings_for(query)
+            if not matches:
+                return [], True
+            return [pk for pk in matches[0] if all(pk in documents for documents in matches[1:])], True
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_search_backend():
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                path = getattr(settings, 'MOVIES_SEARCH_BACKEND', None)
+                if path:
+                    _backend = import_string(path)()
+                elif connection.vendor == 'postgresql':
+                    _backend = PostgresSearchBackend()
+                else:
+                    _backend = InMemorySearchBackend()
+    return _backend
+
+
+def reset_search_backend():
+    global _backend
+    _backend = None
+
+
+def index_movie(movie):
+    backend = _backend
+    if isinstance(backend, InMemorySearchBackend):
+        pk, title, description = movie.pk, movie.title, movie.description
+        transaction.on_commit(lambda: backend.update(pk, title, description))
+
+
+def unindex_movie(pk):
+    backend = _backend
+    if isinstance(backend, InMemorySearchBackend):
+        transaction.on_commit(lambda: backend.remove(pk))
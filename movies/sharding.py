@@ -0,0 +1,442 @@
+import heapq
+import itertools
+from collections import Counter, defaultdict
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import DEFAULT_DB_ALIAS, IntegrityError, NotSupportedError, connections, transaction
+from django.db.models import F, Max, QuerySet
+from django.db.models.constants import LOOKUP_SEP, OnConflict
+from django.db.models.query import (FlatValuesListIterable, ModelIterable, ValuesIterable, ValuesListIterable,
+                                     prefetch_related_objects)
+
+SHARDED_MODEL = 'movies.review'
+# Queryset hint naming the shards a query is confined to, set by filtering on the shard key.
+SHARD_HINT = 'shards'
+SEQUENCE_NAME = 'review'
+
+_shards = None
+
+
+def get_review_shards():
+    global _shards
+    if _shards is None:
+        shards = tuple(getattr(settings, 'MOVIES_REVIEW_SHARDS', None) or (DEFAULT_DB_ALIAS,))
+        for alias in shards:
+            if alias not in connections.settings:
+                raise ImproperlyConfigured(f'Review shard {alias!r} is not an alias in DATABASES.')
+        if len(set(shards)) != len(shards):
+            raise ImproperlyConfigured('MOVIES_REVIEW_SHARDS lists an alias twice.')
+        _shards = shards
+    return _shards
+
+
+def reset_review_shards():
+    global _shards
+    _shards = None
+
+
+def is_sharded():
+    return get_review_shards() != (DEFAULT_DB_ALIAS,)
+
+
+def jump_hash(key, buckets):
+    # Lamping and Veach's jump consistent hash: growing from n to n + 1 buckets moves only 1 / (n + 1) of the keys.
+    bucket, jump = -1, 0
+    while jump < buckets:
+        bucket = jump
+        key = (key * 2862933555777941757 + 1) & 0xFFFFFFFFFFFFFFFF
+        jump = int((bucket + 1) * (1 << 31) / ((key >> 33) + 1))
+    return bucket
+
+
+def shard_for(movie_id, shards=None):
+    shards = shards or get_review_shards()
+    return shards[jump_hash(int(movie_id), len(shards))]
+
+
+@contextmanager
+def atomic_on(*aliases):
+    """
+    One transaction per database. They commit one after another in reverse
+    order, so list the database whose commit matters least first; there is no
+    two-phase commit between them.
+    """
+    with ExitStack() as stack:
+        for alias in dict.fromkeys(aliases):
+            stack.enter_context(transaction.atomic(using=alias))
+        yield
+
+
+def allocate_ids(count):
+    """
+    Reserves `count` consecutive review ids. Every shard has its own table and
+    sequence, so sharded reviews take their ids from one counter row on the
+    default database instead; the first allocation starts above every stored id.
+    """
+    from movies.models import ShardSequence
+
+    with transaction.atomic(using=DEFAULT_DB_ALIAS):
+        sequence = ShardSequence.objects.filter(name=SEQUENCE_NAME)
+        if not sequence.update(last_value=F('last_value') + count):
+            try:
+                with transaction.atomic(using=DEFAULT_DB_ALIAS):
+                    ShardSequence.objects.create(name=SEQUENCE_NAME, last_value=max_review_id() + count)
+            except IntegrityError:
+                # Another process created the row first.
+                sequence.update(last_value=F('last_value') + count)
+        last = sequence.values_list('last_value', flat=True).get()
+    return range(last - count + 1, last + 1)
+
+
+def max_review_id(aliases=None):
+    from movies.models import Review
+
+    return max(
+        (Review._base_manager.using(alias).aggregate(last=Max('pk'))['last'] or 0
+         for alias in aliases or get_review_shards()),
+        default=0,
+    )
+
+
+def sync_sequence(aliases=None):
+    """Raises the review id counter above every id stored on the given shards."""
+    from movies.models import ShardSequence
+
+    last = max_review_id(aliases)
+    with transaction.atomic(using=DEFAULT_DB_ALIAS):
+        sequence, created = ShardSequence.objects.select_for_update().get_or_create(
+            name=SEQUENCE_NAME, defaults={'last_value': last},
+        )
+        if not created and sequence.last_value < last:
+            sequence.last_value = last
+            sequence.save(update_fields=['last_value'])
+
+
+def create_shard_tables(aliases=None):
+    """
+    Creates the review table on shards that lack it. Shards other than the
+    default database hold nothing else and are not migrated, so the table is
+    made from the current model; returns the aliases it was created on.
+    """
+    from movies.models import Review
+
+    created = []
+    for alias in aliases or get_review_shards():
+        connection = connections[alias]
+        if Review._meta.db_table in connection.introspection.table_names():
+            continue
+        with connection.schema_editor() as editor:
+            editor.create_model(Review)
+        created.append(alias)
+    return created
+
+
+def copy_rows(reviews, target):
+    """Writes reviews to `target` exactly as stored, id and creation time included, replacing rows with their ids."""
+    if not reviews:
+        return
+    model = type(reviews[0])
+    fields = model._meta.local_concrete_fields
+    updated = [field for field in fields if not field.primary_key]
+    size = connections[target].ops.bulk_batch_size(fields, reviews) or len(reviews)
+    queryset = model._base_manager.using(target)
+    for start in range(0, len(reviews), size):
+        # raw=True keeps created_at, which auto_now_add would otherwise reset.
+        queryset._insert(reviews[start:start + size], fields=fields, raw=True, using=target,
+                         on_conflict=OnConflict.UPDATE, update_fields=updated, unique_fields=[model._meta.pk])
+
+
+def move_rows(reviews, source, target):
+    if not reviews:
+        return
+    with atomic_on(source, target):
+        copy_rows(reviews, target)
+        moved = type(reviews[0])._base_manager.using(source).filter(pk__in=[review.pk for review in reviews])
+        moved._raw_delete(source)
+
+
+def place(reviews, alias, shards=None):
+    """Moves those of `reviews`, as read from `alias`, that belong on another shard there; returns how many moved."""
+    shards = shards or get_review_shards()
+    moving = defaultdict(list)
+    for review in reviews:
+        target = shard_for(review.movie_id, shards)
+        if target != alias:
+            moving[target].append(review)
+    for target, group in moving.items():
+        move_rows(group, alias, target)
+    return sum(len(group) for group in moving.values())
+
+
+def reshard(sources=(), batch_size=1000):
+    """
+    Moves every review that is not on the shard its movie hashes to there, in
+    batches of batch_size rows, reading the current shards and any retired
+    `sources`. Rows are copied before they are deleted, so an interrupted run
+    can simply be repeated. Yields (alias, rows read, rows moved) per batch.
+    """
+    from movies.models import Review
+
+    shards = get_review_shards()
+    create_shard_tables(shards)
+    for alias in dict.fromkeys((*shards, *sources)):
+        rows = Review._base_manager.using(alias).order_by('pk')
+        last_pk = 0
+        while batch := list(rows.filter(pk__gt=last_pk)[:batch_size]):
+            last_pk = batch[-1].pk
+            yield alias, len(batch), place(batch, alias, shards)
+    sync_sequence(shards)
+
+
+def delete_reviews_of(field, pk, exclude):
+    """
+    Deletes the reviews of a deleted movie or user (`field` is 'movie' or
+    'user') from the shards its cascade did not reach, and takes a deleted
+    user's ratings out of the movies they reviewed.
+    """
+    from movies.models import Review
+    from movies.ratings import apply_rating_changes
+
+    aliases = [shard_for(pk)] if field == 'movie' else get_review_shards()
+    changes = []
+    for alias in aliases:
+        if alias == exclude:
+            continue
+        reviews = Review._base_manager.using(alias).filter(**{field: pk})
+        if field == 'user':
+            changes += [(movie_id, rating, -1) for movie_id, rating in reviews.values_list('movie_id', 'rating')]
+        reviews._raw_delete(alias)
+    apply_rating_changes(changes)
+
+
+class ShardedQuerySet(QuerySet):
+    """
+    Rows spread over the MOVIES_REVIEW_SHARDS databases by a hash of
+    `shard_key`. Filtering on the shard key confines a query to the shards
+    holding those values; any other query runs on every shard and the ordered
+    per-shard results are k-way merged, with slices applied to the merge.
+    Shards other than the default database hold only this table, so
+    select_related() relations are prefetched from the default one instead.
+    """
+
+    shard_key = 'movie'
+
+    def filter(self, *args, **kwargs):
+        clone = super().filter(*args, **kwargs)
+        shards = self._shards_of(kwargs)
+        if shards is not None:
+            current = clone._hints.get(SHARD_HINT)
+            # _hints is shared between clones, so it is replaced rather than updated.
+            clone._hints = {**clone._hints, SHARD_HINT: shards if current is None else current & shards}
+        return clone
+
+    def _shards_of(self, lookups):
+        if not is_sharded():
+            return None
+        key = self.shard_key
+        values = None
+        for lookup, value in lookups.items():
+            if lookup in (key, f'{key}_id', f'{key}__pk', f'{key}__id'):
+                values = [value]
+            elif lookup in (f'{key}__in', f'{key}_id__in', f'{key}__pk__in', f'{key}__id__in'):
+                if isinstance(value, QuerySet):
+                    continue
+                values = list(value)
+            else:
+                continue
+            return frozenset(shard_for(getattr(value, 'pk', value)) for value in values)
+        return None
+
+    def shard_aliases(self):
+        if self._db is not None:
+            return [self._db]
+        chosen = self._hints.get(SHARD_HINT)
+        return [alias for alias in get_review_shards() if chosen is None or alias in chosen]
+
+    def _per_shard(self):
+        """Clones of the query pinned to each shard it reads, or None when one database answers it as it is."""
+        if self._db is not None or not is_sharded():
+            return None
+        aliases = self.shard_aliases()
+        if len(aliases) == 1 and (aliases[0] == DEFAULT_DB_ALIAS or not self.query.select_related):
+            return None
+        clones = []
+        for alias in aliases:
+            clone = self.using(alias)
+            clone.query.select_related = False
+            clone._prefetch_related_lookups = ()
+            clones.append(clone)
+        return clones
+
+    def _related_paths(self):
+        def paths(relations, prefix=''):
+            for name, nested in relations.items():
+                yield from paths(nested, f'{prefix}{name}{LOOKUP_SEP}') if nested else [f'{prefix}{name}']
+
+        if isinstance(self.query.select_related, dict):
+            return list(paths(self.query.select_related))
+        return []
+
+    def _merge_key(self):
+        ordering = self.query.order_by or (self.model._meta.ordering if self.query.default_ordering else ())
+        if not ordering:
+            return None, False
+        names, directions = [], set()
+        for field in ordering:
+            if not isinstance(field, str) or LOOKUP_SEP in field or field == '?':
+                raise NotSupportedError(f'Cannot merge shards ordered by {field!r}.')
+            directions.add(field.startswith('-'))
+            name = field.lstrip('-')
+            names.append(self.model._meta.pk.attname if name == 'pk' else self.model._meta.get_field(name).attname)
+        if len(directions) > 1:
+            raise NotSupportedError('Shards can only be merged when every ordering field sorts the same way.')
+        if issubclass(self._iterable_class, ModelIterable):
+            return (lambda obj: tuple(getattr(obj, name) for name in names)), directions.pop()
+        if issubclass(self._iterable_class, ValuesIterable):
+            return (lambda row: tuple(row[name] for name in names)), directions.pop()
+        if issubclass(self._iterable_class, (ValuesListIterable, FlatValuesListIterable)):
+            if self.query.annotation_select:
+                raise NotSupportedError('Shards cannot be merged on rows with annotations.')
+            selected = [self.model._meta.get_field(name).attname if name != 'pk' else self.model._meta.pk.attname
+                        for name in self.query.values_select]
+            if any(name not in selected for name in names):
+                raise NotSupportedError('Shards can only be merged on selected columns.')
+            if len(selected) == 1:
+                return (lambda value: (value,)), directions.pop()
+            positions = [selected.index(name) for name in names]
+            return (lambda row: tuple(row[position] for position in positions)), directions.pop()
+        raise NotSupportedError('Cannot merge these rows across shards.')
+
+    def _merge(self, clones, rows):
+        low, high = self.query.low_mark, self.query.high_mark
+        for clone in clones:
+            # Any shard may hold all of the first `high` rows.
+            clone.query.clear_limits()
+            clone.query.set_limits(high=high)
+        key, descending = self._merge_key()
+        streams = [rows(clone) for clone in clones]
+        merged = heapq.merge(*streams, key=key, reverse=descending) if key else itertools.chain(*streams)
+        return itertools.islice(merged, low, None if high is None else high)
+
+    def _fetch_all(self):
+        if self._result_cache is None:
+            clones = self._per_shard()
+            if clones is not None:
+                self._result_cache = list(self._merge(clones, list))
+                if issubclass(self._iterable_class, ModelIterable):
+                    prefetch_related_objects(self._result_cache, *self._related_paths())
+        super()._fetch_all()
+
+    def iterator(self, chunk_size=None):
+        clones = self._per_shard()
+        if clones is None:
+            return super().iterator(chunk_size)
+        return self._merge(clones, lambda clone: clone.iterator(chunk_size))
+
+    def count(self):
+        clones = self._per_shard()
+        if clones is None:
+            return super().count()
+        if self._result_cache is not None or self.query.is_sliced:
+            return len(self)
+        return sum(clone.count() for clone in clones)
+
+    def exists(self):
+        clones = self._per_shard()
+        if clones is None or self._result_cache is not None:
+            return super().exists()
+        return any(clone.exists() for clone in clones)
+
+    def aggregate(self, *args, **kwargs):
+        clones = self._per_shard()
+        if clones is None:
+            return super().aggregate(*args, **kwargs)
+        if len(clones) != 1:
+            raise NotSupportedError('Aggregates over several shards are not supported; aggregate per shard.')
+        return clones[0].aggregate(*args, **kwargs)
+
+    def _pinned(self):
+        if self._db is not None or not is_sharded():
+            return [self]
+        return [self.using(alias) for alias in self.shard_aliases()]
+
+    def create(self, **kwargs):
+        if self._db is not None or not is_sharded():
+            return super().create(**kwargs)
+        # The model's save() picks the shard; self.db would name the default database.
+        obj = self.model(**kwargs)
+        obj.save(force_insert=True)
+        return obj
+
+    def bulk_create(self, objs, *args, **kwargs):
+        if self._db is not None or not is_sharded():
+            return super().bulk_create(objs, *args, **kwargs)
+        objs = list(objs)
+        missing = [obj for obj in objs if obj.pk is None]
+        for obj, pk in zip(missing, allocate_ids(len(missing)) if missing else ()):
+            obj.pk = pk
+        groups = defaultdict(list)
+        for obj in objs:
+            groups[shard_for(getattr(obj, f'{self.shard_key}_id'))].append(obj)
+        with atomic_on(*groups):
+            for alias, group in groups.items():
+                super(ShardedQuerySet, self.using(alias)).bulk_create(group, *args, **kwargs)
+        return objs
+
+    def update(self, **kwargs):
+        moved_to = kwargs.get(self.shard_key, kwargs.get(f'{self.shard_key}_id'))
+        querysets = self._pinned()
+        if moved_to is not None and is_sharded():
+            target = shard_for(getattr(moved_to, 'pk', moved_to))
+            if any(queryset.db != target and queryset.exists() for queryset in querysets):
+                raise NotSupportedError('update() cannot move rows to another shard; save them one by one.')
+        with atomic_on(*(queryset.db for queryset in querysets)):
+            return sum(super(ShardedQuerySet, queryset).update(**kwargs) for queryset in querysets)
+
+    update.alters_data = True
+
+    def delete(self):
+        deleted, per_model = 0, Counter()
+        for queryset in self._pinned():
+            rows, models = super(ShardedQuerySet, queryset).delete()
+            deleted += rows
+            per_model.update(models)
+        return deleted, dict(per_model)
+
+    delete.alters_data = True
+    delete.queryset_only = True
+
+
+class ShardRouter:
+    """
+    Sends reads and writes of reviews to the shard their movie hashes to,
+    as named by the instance or the queryset's shard hint. Queries it cannot
+    place, and everything else, fall through to the next router.
+    """
+
+    def _shard(self, model, hints):
+        if model._meta.label_lower != SHARDED_MODEL or not is_sharded():
+            return None
+        instance = hints.get('instance')
+        if isinstance(instance, model) and instance.movie_id is not None:
+            alias = shard_for(instance.movie_id)
+        elif len(hints.get(SHARD_HINT) or ()) == 1:
+            (alias,) = hints[SHARD_HINT]
+        else:
+            return None
+        # Reviews on the default database can still be read from its replicas.
+        return None if alias == DEFAULT_DB_ALIAS else alias
+
+    def db_for_read(self, model, **hints):
+        return self._shard(model, hints)
+
+    def db_for_write(self, model, **hints):
+        return self._shard(model, hints)
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Other shards hold only the review table, made by create_shard_tables().
+        if db != DEFAULT_DB_ALIAS and db in get_review_shards():
+            return False
+        return None
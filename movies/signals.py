@@ -0,0 +1,378 @@
+from functools import partial
+
+from django.contrib.auth.models import User
+from django.core.signals import setting_changed
+from django.db import transaction
+from django.db.models import Count, QuerySet
+from django.db.models.signals import m2m_changed, post_delete, post_init, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from movies import facets, popularity, routing, search, sharding
+from movies.autocomplete import SOURCES
+from movies.cache import detail_cache
+from movies.counts import apply_movie_count_changes
+from movies.dashboard import invalidate_sections
+from movies.deletion import deletion_requested
+from movies.filmography import (add_directing_credits, credits_table_enabled, remove_directing_credits,
+                                sync_cast_credit, update_movie_credits)
+from movies.leaderboards import update_movie_genre
+from movies.models import Award, Cast, Genre, Movie, MovieAward, MovieNeighbor, Person, Review
+from movies.ratings import apply_rating_changes
+
+
+@receiver(post_init, sender=Review)
+def remember_review_rating(sender, instance, **kwargs):
+    instance._saved_rating = (instance.__dict__.get('movie_id'), instance.__dict__.get('rating'))
+
+
+def stored_values(instance, attnames):
+    # The stored values of fields an instance was loaded without, read before a save or delete changes them.
+    row = type(instance)._base_manager.using(instance._state.db).filter(pk=instance.pk).values(*attnames).first()
+    return row or {}
+
+
+@receiver(pre_save, sender=Review)
+@receiver(pre_delete, sender=Review)
+def load_review_rating(sender, instance, raw=False, **kwargs):
+    # A review loaded with movie_id or rating deferred never saw its stored values; without them the old rating
+    # could not be taken back out of the movie's aggregates.
+    if raw or instance._state.adding or None not in instance._saved_rating:
+        return
+    stored = stored_values(instance, ['movie_id', 'rating'])
+    if stored:
+        instance._saved_rating = (stored['movie_id'], stored['rating'])
+
+
+@receiver(post_save, sender=Review)
+def update_movie_ratings_on_save(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    old_movie_id, old_rating = (None, None) if created else instance._saved_rating
+    new_state = (instance.movie_id, instance.rating)
+    if (old_movie_id, old_rating) != new_state:
+        changes = [(instance.movie_id, instance.rating, 1)]
+        if old_movie_id is not None and old_rating is not None:
+            changes.append((old_movie_id, old_rating, -1))
+        apply_rating_changes(changes)
+    instance._saved_rating = new_state
+
+
+def _deletes_movies(origin):
+    model = origin.model if isinstance(origin, QuerySet) else type(origin)
+    return model in (Movie, Genre)
+
+
+@receiver(post_delete, sender=Review)
+def update_movie_ratings_on_delete(sender, instance, origin=None, **kwargs):
+    # Reviews reached through a Movie or Genre cascade belong to movies that are being deleted too.
+    if origin is not None and _deletes_movies(origin):
+        return
+    movie_id, rating = instance._saved_rating
+    if movie_id is not None and rating is not None:
+        apply_rating_changes([(movie_id, rating, -1)])
+
+
+@receiver(post_init, sender=Movie)
+def remember_movie_genre(sender, instance, **kwargs):
+    instance._saved_genre_id = instance.__dict__.get('genre_id')
+
+
+@receiver(post_save, sender=Movie)
+def update_genre_movie_counts_on_save(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    old_genre_id = None if created else instance._saved_genre_id
+    if old_genre_id != instance.genre_id:
+        apply_movie_count_changes([(instance.genre_id, 1)] + ([(old_genre_id, -1)] if old_genre_id else []))
+    instance._saved_genre_id = instance.genre_id
+
+
+@receiver(post_delete, sender=Movie)
+def update_genre_movie_counts_on_delete(sender, instance, **kwargs):
+    # A movie pending deletion stopped being counted when it was hidden.
+    if not instance.pending_delete:
+        apply_movie_count_changes([(instance.genre_id, -1)])
+
+
+@receiver(post_save, sender=Movie)
+def update_search_index(sender, instance, raw=False, **kwargs):
+    if not raw:
+        search.index_movie(instance)
+
+
+@receiver(post_delete, sender=Movie)
+def remove_from_search_index(sender, instance, **kwargs):
+    search.unindex_movie(instance.pk)
+
+
+@receiver(post_save, sender=Movie)
+def update_facet_index(sender, instance, raw=False, **kwargs):
+    if not raw:
+        facets.index_movie(instance)
+
+
+@receiver(post_delete, sender=Movie)
+def remove_from_facet_index(sender, instance, **kwargs):
+    facets.unindex_movie(instance.pk)
+
+
+@receiver(m2m_changed, sender=Movie.directors.through)
+def update_facet_directors(sender, instance, action, reverse, pk_set, **kwargs):
+    if not reverse and action in ('post_add', 'post_remove', 'post_clear'):
+        facets.index_directors([instance.pk])
+    elif reverse and action in ('post_add', 'post_remove'):
+        facets.index_directors(pk_set)
+    elif reverse and action == 'pre_clear':
+        facets.index_directors(instance.directed_movies.values_list('pk', flat=True))
+
+
+@receiver(post_save, sender=Genre)
+@receiver(post_save, sender=Award)
+def update_facet_labels(sender, instance, raw=False, **kwargs):
+    if not raw:
+        facets.index_label(sender._meta.model_name, instance.pk, instance.name)
+
+
+@receiver(setting_changed)
+def reset_search_backend(setting, **kwargs):
+    if setting.startswith('MOVIES_SEARCH_'):
+        search.reset_search_backend()
+
+
+@receiver(setting_changed)
+def reset_replica_pool(setting, **kwargs):
+    if setting.startswith('MOVIES_REPLICA_') or setting == 'MOVIES_DATABASE_REPLICAS':
+        routing.reset_replica_pool()
+
+
+@receiver(setting_changed)
+def reset_view_counter(setting, **kwargs):
+    if setting.startswith('MOVIES_VIEW_'):
+        popularity.reset_view_counter()
+
+
+@receiver(setting_changed)
+def reset_review_shards(setting, **kwargs):
+    if setting in ('MOVIES_REVIEW_SHARDS', 'DATABASES'):
+        sharding.reset_review_shards()
+
+
+@receiver(pre_delete, sender=Movie)
+@receiver(pre_delete, sender=User)
+def delete_sharded_reviews(sender, instance, using, **kwargs):
+    # The cascade only reaches reviews on the database the delete runs on; the other shards follow once it commits.
+    # Objects pending deletion have had their reviews removed from every shard by movies.deletion already.
+    if sharding.is_sharded() and not getattr(instance, 'pending_delete', False):
+        field = 'movie' if sender is Movie else 'user'
+        transaction.on_commit(partial(sharding.delete_reviews_of, field, instance.pk, using), using=using)
+
+
+@receiver(post_save, sender=Genre)
+@receiver(post_save, sender=Person)
+@receiver(post_save, sender=Movie)
+def update_autocomplete_index(sender, instance, raw=False, **kwargs):
+    if not raw:
+        SOURCES[sender._meta.model_name].update(instance)
+
+
+@receiver(post_delete, sender=Genre)
+@receiver(post_delete, sender=Person)
+@receiver(post_delete, sender=Movie)
+def remove_from_autocomplete_index(sender, instance, **kwargs):
+    SOURCES[sender._meta.model_name].remove(instance.pk)
+
+
+# Foreign keys of rows shown on detail pages, mapped to the detail page they appear on.
+DETAIL_REFERENCES = {
+    Cast: {'movie_id': 'movie', 'person_id': 'person'},
+    MovieAward: {'movie_id': 'movie', 'award_id': 'award'},
+    Review: {'movie_id': 'movie'},
+}
+
+
+def invalidate_movie_details(pks):
+    pks = list(pks)
+    detail_cache.invalidate('movie', pks)
+    # Pages listing these movies under "viewers also liked".
+    detail_cache.invalidate('movie', set(MovieNeighbor.objects.filter(neighbor__in=pks).values_list('movie_id', flat=True)))
+    # Two indexed lookups: an OR across both joins cannot use either index and scans every cast row.
+    directors = Movie.directors.through.objects.filter(movie_id__in=pks).values_list('person_id', flat=True)
+    actors = Cast.objects.filter(movie_id__in=pks).values_list('person_id', flat=True)
+    detail_cache.invalidate('person', {*directors, *actors})
+    detail_cache.invalidate('award', set(MovieAward.objects.filter(movie__in=pks).values_list('award_id', flat=True)))
+
+
+@receiver(post_init, sender=Cast)
+@receiver(post_init, sender=MovieAward)
+@receiver(post_init, sender=Review)
+def remember_detail_references(sender, instance, **kwargs):
+    instance._saved_references = {attname: instance.__dict__.get(attname) for attname in DETAIL_REFERENCES[sender]}
+
+
+@receiver(pre_save, sender=Cast)
+@receiver(pre_save, sender=MovieAward)
+@receiver(pre_save, sender=Review)
+@receiver(pre_delete, sender=Cast)
+@receiver(pre_delete, sender=MovieAward)
+@receiver(pre_delete, sender=Review)
+def load_detail_references(sender, instance, raw=False, **kwargs):
+    # References loaded deferred are read now: once the row has changed or gone, the old pages could not be found.
+    missing = [attname for attname, value in instance._saved_references.items() if value is None]
+    if not raw and not instance._state.adding and missing:
+        instance._saved_references.update(stored_values(instance, missing))
+
+
+def current_reference(instance, attname):
+    # A reference still deferred after the write was never assigned, so it still holds the stored value.
+    return instance.__dict__.get(attname, instance._saved_references[attname])
+
+
+@receiver(post_save, sender=MovieAward)
+@receiver(post_delete, sender=MovieAward)
+def update_facet_awards(sender, instance, raw=False, **kwargs):
+    # Connected before invalidate_referenced_details, which moves _saved_references on to the new movie.
+    if not raw:
+        facets.index_awards({current_reference(instance, 'movie_id'), instance._saved_references['movie_id']} - {None})
+
+
+@receiver(post_save, sender=Cast)
+@receiver(post_save, sender=MovieAward)
+@receiver(post_save, sender=Review)
+@receiver(post_delete, sender=Cast)
+@receiver(post_delete, sender=MovieAward)
+@receiver(post_delete, sender=Review)
+def invalidate_referenced_details(sender, instance, **kwargs):
+    # A row moved to another movie or person leaves the old page stale too.
+    for attname, model_name in DETAIL_REFERENCES[sender].items():
+        detail_cache.invalidate(model_name, {current_reference(instance, attname), instance._saved_references[attname]})
+    remember_detail_references(sender, instance)
+
+
+@receiver(post_save, sender=Review)
+@receiver(post_delete, sender=Review)
+@receiver(post_save, sender=User)
+def invalidate_row_versions(sender, instance, **kwargs):
+    # Review rows cached by the rowcache template tag are keyed by these stamps (movie stamps are replaced above).
+    detail_cache.invalidate(sender._meta.model_name, [instance.pk])
+
+
+def invalidate_person_details(pks):
+    pks = list(pks)
+    detail_cache.invalidate('person', pks)
+    directed = Movie.directors.through.objects.filter(person_id__in=pks).values_list('movie_id', flat=True)
+    acted = Cast.objects.filter(person_id__in=pks).values_list('movie_id', flat=True)
+    detail_cache.invalidate('movie', {*directed, *acted})
+
+
+@receiver(post_save, sender=Movie)
+@receiver(pre_delete, sender=Movie)
+def invalidate_movie_detail(sender, instance, **kwargs):
+    # pre_delete: director links disappear in the cascade without sending m2m_changed. Pages of objects pending
+    # deletion were retired when they were hidden, while their links still existed.
+    if not instance.pending_delete:
+        invalidate_movie_details([instance.pk])
+
+
+@receiver(post_save, sender=Person)
+@receiver(pre_delete, sender=Person)
+def invalidate_person_detail(sender, instance, **kwargs):
+    if not instance.pending_delete:
+        invalidate_person_details([instance.pk])
+
+
+@receiver(post_save, sender=Award)
+def invalidate_award_detail(sender, instance, **kwargs):
+    detail_cache.invalidate('award', [instance.pk])
+    detail_cache.invalidate('movie', set(MovieAward.objects.filter(award=instance).values_list('movie_id', flat=True)))
+
+
+@receiver(post_save, sender=Genre)
+def invalidate_genre_movies(sender, instance, **kwargs):
+    invalidate_movie_details(Movie.objects.filter(genre=instance).values_list('pk', flat=True))
+
+
+@receiver(m2m_changed, sender=Movie.directors.through)
+def invalidate_director_details(sender, instance, action, reverse, pk_set, **kwargs):
+    if action == 'pre_clear':
+        related = instance.directed_movies if reverse else instance.directors
+        pk_set = set(related.values_list('pk', flat=True))
+    elif action not in ('post_add', 'post_remove'):
+        return
+    own, other = ('person', 'movie') if reverse else ('movie', 'person')
+    detail_cache.invalidate(own, [instance.pk])
+    detail_cache.invalidate(other, pk_set)
+
+
+@receiver(post_save, sender=Movie)
+@receiver(post_save, sender=Genre)
+@receiver(post_save, sender=Review)
+@receiver(post_save, sender=MovieAward)
+@receiver(post_save, sender=Award)
+@receiver(post_delete, sender=Movie)
+@receiver(post_delete, sender=Genre)
+@receiver(post_delete, sender=Review)
+@receiver(post_delete, sender=MovieAward)
+@receiver(post_delete, sender=Award)
+def invalidate_home_sections(sender, **kwargs):
+    invalidate_sections(sender)
+
+
+@receiver(post_save, sender=Cast)
+def update_cast_credit(sender, instance, raw=False, **kwargs):
+    # Deleting a cast row deletes its credit through the one-to-one cascade.
+    if credits_table_enabled() and not raw:
+        sync_cast_credit(instance)
+
+
+@receiver(post_save, sender=Movie)
+def update_credit_titles(sender, instance, created, raw=False, **kwargs):
+    if credits_table_enabled() and not raw and not created:
+        update_movie_credits(instance)
+
+
+@receiver(post_save, sender=Movie)
+def update_score_genre(sender, instance, created, raw=False, **kwargs):
+    if not raw and not created:
+        update_movie_genre(instance)
+
+
+@receiver(m2m_changed, sender=Movie.directors.through)
+def update_directing_credits(sender, instance, action, reverse, pk_set, **kwargs):
+    if not credits_table_enabled():
+        return
+    own = 'person_ids' if reverse else 'movie_ids'
+    if action == 'post_add':
+        add_directing_credits((pk, instance.pk) if reverse else (instance.pk, pk) for pk in pk_set)
+    elif action == 'post_remove':
+        other = 'movie_ids' if reverse else 'person_ids'
+        remove_directing_credits(**{own: [instance.pk], other: pk_set})
+    elif action == 'post_clear':
+        remove_directing_credits(**{own: [instance.pk]})
+
+
+@receiver(deletion_requested, sender=Movie)
+def hide_movies(sender, pks, **kwargs):
+    # What deleting the movies would do through their post_delete receivers, done when they are hidden instead.
+    for pk in pks:
+        search.unindex_movie(pk)
+        facets.unindex_movie(pk)
+        SOURCES['movie'].remove(pk)
+    genres = Movie._base_manager.filter(pk__in=pks).values_list('genre_id').annotate(n=Count('pk')).order_by()
+    apply_movie_count_changes((genre_id, -n) for genre_id, n in genres)
+    invalidate_movie_details(pks)
+    invalidate_sections(Movie)
+
+
+@receiver(deletion_requested, sender=Person)
+def hide_persons(sender, pks, **kwargs):
+    for pk in pks:
+        SOURCES['person'].remove(pk)
+    facets.index_directors(Movie.directors.through.objects.filter(person_id__in=pks).values_list('movie_id', flat=True))
+    invalidate_person_details(pks)
+
+
+@receiver(deletion_requested, sender=Genre)
+def hide_genres(sender, pks, **kwargs):
+    for pk in pks:
+        SOURCES['genre'].remove(pk)
+    invalidate_sections(Genre)
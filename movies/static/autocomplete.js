@@ -0,0 +1,63 @@
+document.addEventListener('DOMContentLoaded', function () {
+    document.querySelectorAll('select[data-autocomplete-url]').forEach(function (select) {
+        var input = document.createElement('input');
+        input.type = 'search';
+        input.className = 'form-control mb-1';
+        input.placeholder = 'Type to search...';
+        select.parentNode.insertBefore(input, select);
+
+        var more = document.createElement('button');
+        more.type = 'button';
+        more.className = 'btn btn-sm btn-link';
+        more.textContent = 'More results';
+        more.hidden = true;
+        select.parentNode.insertBefore(more, select.nextSibling);
+
+        var nextCursor = null;
+
+        function load(cursor) {
+            var url = new URL(select.dataset.autocompleteUrl, window.location.origin);
+            url.searchParams.set('q', input.value);
+            if (cursor) {
+                url.searchParams.set('cursor', cursor);
+            }
+            fetch(url).then(function (response) {
+                return response.json();
+            }).then(function (data) {
+                if (!cursor) {
+                    Array.from(select.options).forEach(function (option) {
+                        if (!option.selected && option.value !== '') {
+                            option.remove();
+                        }
+                    });
+                }
+                var present = new Set(Array.from(select.options).map(function (option) {
+                    return option.value;
+                }));
+                data.results.forEach(function (result) {
+                    if (!present.has(String(result.id))) {
+                        select.add(new Option(result.text, result.id));
+                    }
+                });
+                nextCursor = data.next;
+                more.hidden = !nextCursor;
+            });
+        }
+
+        var timer = null;
+        input.addEventListener('input', function () {
+            clearTimeout(timer);
+            timer = setTimeout(function () {
+                load(null);
+            }, 200);
+        });
+        input.addEventListener('focus', function () {
+            if (nextCursor === null && select.options.length <= 1) {
+                load(null);
+            }
+        }, {once: true});
+        more.addEventListener('click', function () {
+            load(nextCursor);
+        });
+    });
+});
@@ -0,0 +1,69 @@
+import hashlib
+
+from django import template
+from django.template.base import Node
+
+from movies.cache import row_cache
+
+register = template.Library()
+
+
+class RowCacheNode(Node):
+    def __init__(self, nodelist, fragment, row, rows, relations):
+        self.nodelist = nodelist
+        self.fragment = fragment
+        self.row = row
+        self.rows = rows
+        self.relations = relations
+        # Keys cover the fragment's source, so editing the template retires rows rendered from the old markup.
+        source = ''.join(node.token.contents for node in nodelist.get_nodes_by_type(Node) if hasattr(node, 'token'))
+        self.digest = hashlib.md5(source.encode()).hexdigest()[:12]
+
+    def render(self, context):
+        row = self.row.resolve(context)
+        # The keys and cached HTML of the whole list are fetched when its first row renders.
+        page = context.render_context.get(self)
+        if page is None or row.pk not in page:
+            rows = list(self.rows.resolve(context)) if self.rows else []
+            if row.pk not in {other.pk for other in rows}:
+                rows = [row]
+            fragment = f'{self.fragment.resolve(context)}:{self.digest}'
+            keys = row_cache.keys(fragment, rows, [relation.resolve(context) for relation in self.relations])
+            found = row_cache.get_many([key for key in keys.values() if key is not None])
+            page = {pk: (key, found.get(key)) for pk, key in keys.items()}
+            context.render_context[self] = page
+        key, html = page[row.pk]
+        if html is None:
+            html = self.nodelist.render(context)
+            if key is not None:
+                row_cache.set(key, html)
+        return html
+
+
+@register.tag
+def rowcache(parser, token):
+    """
+    Caches the rendered HTML of one table row:
+
+        {% rowcache 'review_row' review in reviews with 'movie' 'user' %} ... {% endrowcache %}
+
+    The row is re-rendered after the row object, or an object it shows through
+    one of the foreign keys named after `with`, is saved. `in` names the whole
+    list so that all its rows are looked up in one cache round trip.
+    """
+    bits = token.split_contents()
+    if len(bits) < 3:
+        raise template.TemplateSyntaxError(f"'{bits[0]}' takes a fragment name and a row object.")
+    fragment, row, rows, relations = parser.compile_filter(bits[1]), parser.compile_filter(bits[2]), None, []
+    rest = bits[3:]
+    if rest[:1] == ['in']:
+        if len(rest) < 2:
+            raise template.TemplateSyntaxError(f"'{bits[0]}' expects a list after 'in'.")
+        rows, rest = parser.compile_filter(rest[1]), rest[2:]
+    if rest[:1] == ['with']:
+        relations, rest = [parser.compile_filter(bit) for bit in rest[1:]], []
+    if rest:
+        raise template.TemplateSyntaxError(f"'{bits[0]}' got unexpected arguments: {' '.join(rest)}")
+    nodelist = parser.parse(('endrowcache',))
+    parser.delete_first_token()
+    return RowCacheNode(nodelist, fragment, row, rows, relations)
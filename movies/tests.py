@@ -1,6 +1,47 @@
+import json
+import os
+import random
+import re
+import time
+from datetime import timedelta
+from io import StringIO
+from types import SimpleNamespace
+
+from asgiref.sync import async_to_sync
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import CommandError, call_command
+from django.db import (
+    DatabaseError, IntegrityError, NotSupportedError, OperationalError, connection, connections, transaction,
+)
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import timezone
 import pytest
-from movies.models import Person, Movie
+from movies import aio
+from movies.benchmarks import export_suite, peak_rss_kib
+from movies.cache import GENERATION_KEY, detail_cache
+from movies.catalog import CatalogImporter
+from movies.dashboard import recent_reviews
+from movies.deletion import delete_pending, request_deletion
+from movies.facets import get_facet_index
+from movies.filmography import filmography
+from movies.forms import MovieForm
+from movies.leaderboards import refresh_scores
+from movies.perf import recorder
+from movies.popularity import ViewCounter, get_view_counter
+from movies.ratings import rebuild_ratings
+from movies.recommendations import load_neighbors, refresh_neighbors
+from movies.routing import PIN_COOKIE, ReplicaPool, get_replica_pool, watch_replica
+from movies.models import (Person, Movie, Review, Cast, MovieAward, Genre, Award, Credit, Deletion, MovieNeighbor,
+                           MovieScore)
+from movies.search import InMemorySearchBackend, get_search_backend
+from movies.sharding import shard_for
+from movies.views import (MovieDetailView, AwardDetailView, PersonDetailView, MovieListView, ReviewListView,
+                          PersonListView, GenreListView, AwardListView, TopRatedView, GenreTopRatedView, TrendingView,
+                          HomeView, MostViewedView)
 
 
 @pytest.mark.django_db
@@ -399,3 +440,1574 @@ def test_movie_award_delete_view_logged_in(client, user, movie_award):
     response = client.get(url)
     assert response.status_code == 200
     assert 'movies/movieaward_confirm_delete.html' in [t.name for t in response.templates]
+
+
+@pytest.mark.django_db
+def test_movie_list_view_keyset_pagination(client, genre):
+    for year in range(1990, 2020):
+        Movie.objects.create(title=f'Movie {year}', description='Test', release_year=year,
+                             duration_minutes=100, genre=genre)
+    url = reverse('movie_list') + '?sort_by=release_year'
+    seen = []
+    while url:
+        response = client.get(url)
+        assert response.status_code == 200
+        seen.extend(movie.release_year for movie in response.context['movies'])
+        next_url = response.context['page_obj'].next_url
+        url = reverse('movie_list') + next_url if next_url else None
+    assert seen == list(range(1990, 2020))
+
+    response = client.get(reverse('movie_list') + response.context['page_obj'].previous_url)
+    assert [movie.release_year for movie in response.context['movies']] == list(range(1990, 2015))
+
+
+@pytest.mark.django_db
+def test_review_list_view_keyset_pagination(client, user, movie):
+    for i in range(30):
+        Review.objects.create(user=user, movie=movie, rating=5, text=f'Review {i}')
+    response = client.get(reverse('review_list'))
+    first_page = list(response.context['reviews'])
+    assert len(first_page) == 25
+    response = client.get(reverse('review_list') + response.context['page_obj'].next_url)
+    second_page = list(response.context['reviews'])
+    assert len(second_page) == 5
+    ordered = [review.pk for review in Review.objects.order_by('-created_at', '-pk')]
+    assert [review.pk for review in first_page + second_page] == ordered
+
+
+@pytest.mark.django_db
+def test_movie_list_view_invalid_cursor(client):
+    response = client.get(reverse('movie_list') + '?cursor=not-a-cursor')
+    assert response.status_code == 404
+
+
+@pytest.fixture
+def populated_movie(movie, award):
+    for i in range(20):
+        actor = Person.objects.create(first_name=f'Actor{i}', last_name='Cast', birth_date='1980-01-01', role='actor')
+        Cast.objects.create(movie=movie, person=actor, role_name=f'Role {i}')
+        MovieAward.objects.create(movie=movie, award=award, category=f'Category {i}')
+        reviewer = User.objects.create(username=f'reviewer{i}')
+        Review.objects.create(user=reviewer, movie=movie, rating=i % 10 + 1, text=f'Review {i}')
+    return movie
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('view_class, url_name, object_fixture', [
+    (MovieDetailView, 'movie_detail', 'populated_movie'),
+    (AwardDetailView, 'award_detail', 'award'),
+    (PersonDetailView, 'person_detail', 'person'),
+    (MovieListView, 'movie_list', None),
+    (ReviewListView, 'review_list', None),
+    (PersonListView, 'person_list', None),
+    (GenreListView, 'genre_list', None),
+    (AwardListView, 'award_list', None),
+    (HomeView, 'home', None),
+    (TopRatedView, 'top_rated', None),
+    (GenreTopRatedView, 'genre_top_rated', 'genre'),
+    (TrendingView, 'trending', None),
+    (MostViewedView, 'most_viewed_movies', None),
+])
+def test_view_query_budget(request, client, django_assert_max_num_queries, populated_movie,
+                           view_class, url_name, object_fixture):
+    if object_fixture:
+        url = reverse(url_name, kwargs={'pk': request.getfixturevalue(object_fixture).pk})
+    else:
+        url = reverse(url_name)
+    get_facet_index()
+    with django_assert_max_num_queries(view_class.query_budget):
+        response = client.get(url)
+    assert response.status_code == 200
+
+
+@pytest.mark.django_db
+def test_movie_detail_view_renders_related_objects(client, populated_movie):
+    response = client.get(reverse('movie_detail', kwargs={'pk': populated_movie.pk}))
+    content = response.content.decode()
+    assert 'Actor19 Cast' in content
+    assert 'Category 19' in content
+    assert 'reviewer19' in content
+
+
+@pytest.mark.django_db
+def test_movie_rating_aggregates_follow_review_writes(user, movie):
+    first = Review.objects.create(user=user, movie=movie, rating=8, text='Good')
+    Review.objects.create(user=user, movie=movie, rating=4, text='Meh')
+    movie.refresh_from_db()
+    assert (movie.rating_count, movie.rating_sum, movie.rating_avg) == (2, 12, 6)
+    assert movie.rating_histogram[7] == 1 and movie.rating_histogram[3] == 1
+
+    first.rating = 10
+    first.save()
+    movie.refresh_from_db()
+    assert (movie.rating_count, movie.rating_sum) == (2, 14)
+    assert movie.rating_histogram[7] == 0 and movie.rating_histogram[9] == 1
+
+    first.delete()
+    movie.refresh_from_db()
+    assert (movie.rating_count, movie.rating_sum, movie.rating_avg) == (1, 4, 4)
+
+
+@pytest.mark.django_db
+def test_movie_rating_aggregates_bulk_paths(user, movie, genre):
+    other = Movie.objects.create(title='Other', description='Test', release_year=2000, duration_minutes=90, genre=genre)
+    Review.objects.bulk_create([Review(user=user, movie=movie, rating=rating, text='Bulk') for rating in (2, 4, 6)])
+    movie.refresh_from_db()
+    assert (movie.rating_count, movie.rating_avg) == (3, 4)
+
+    Review.objects.filter(movie=movie, rating=2).update(movie=other)
+    movie.refresh_from_db()
+    other.refresh_from_db()
+    assert (movie.rating_count, movie.rating_avg) == (2, 5)
+    assert (other.rating_count, other.rating_avg) == (1, 2)
+
+    Movie.objects.filter(pk=movie.pk).update(rating_count=0, rating_sum=0, rating_avg=0)
+    call_command('rebuild_ratings', batch_size=1, stdout=StringIO())
+    movie.refresh_from_db()
+    assert (movie.rating_count, movie.rating_sum, movie.rating_avg) == (2, 10, 5)
+
+
+@pytest.mark.django_db
+def test_movie_rating_aggregates_survive_stale_saves_and_deferred_reviews(client, user, movie):
+    stale = Movie.objects.get(pk=movie.pk)
+    review = Review.objects.create(user=user, movie=movie, rating=6, text='Fine')
+    stale.title = 'Renamed'
+    stale.save()
+    client.force_login(user)
+    data = {'title': 'Renamed Again', 'description': 'Test', 'release_year': 2006, 'duration_minutes': 120,
+            'genre': movie.genre_id, 'directors': [movie.directors.get().pk]}
+    assert client.post(reverse('movie_edit', kwargs={'pk': movie.pk}), data).status_code == 302
+    movie.refresh_from_db()
+    assert (movie.title, movie.rating_count, movie.rating_sum, movie.neighbors_stale) == ('Renamed Again', 1, 6, True)
+
+    # Reviews read without their rating or movie still take their old rating back out and retire the movie's cached
+    # page when changed or deleted.
+    deferred = Review.objects.only('text').get(pk=review.pk)
+    deferred.rating = 9
+    deferred.save()
+    movie.refresh_from_db()
+    assert (movie.rating_count, movie.rating_sum) == (1, 9)
+    client.get(reverse('movie_detail', kwargs={'pk': movie.pk}))
+    Review.objects.defer('movie', 'rating').get(pk=review.pk).delete()
+    movie.refresh_from_db()
+    assert (movie.rating_count, movie.rating_sum) == (0, 0)
+    assert 'Fine' not in client.get(reverse('movie_detail', kwargs={'pk': movie.pk})).content.decode()
+
+
+@pytest.mark.django_db
+def test_review_create_view_updates_rating(client, user, movie):
+    client.force_login(user)
+    response = client.post(reverse('review_add'), {'movie': movie.pk, 'rating': 9, 'text': 'Loved it'})
+    assert response.status_code == 302
+    movie.refresh_from_db()
+    assert (movie.rating_count, movie.rating_avg) == (1, 9)
+
+
+@pytest.mark.django_db
+def test_movie_list_view_sorting_by_rating(client, user, genre):
+    movies = [Movie.objects.create(title=f'Movie {i}', description='Test', release_year=2000, duration_minutes=90,
+                                   genre=genre) for i in range(3)]
+    for movie, rating in zip(movies, (5, 9, 7)):
+        Review.objects.create(user=user, movie=movie, rating=rating, text='Test')
+    response = client.get(reverse('movie_list') + '?sort_by=rating')
+    assert [movie.rating_avg for movie in response.context['movies']] == [9, 7, 5]
+
+
+@pytest.mark.django_db
+def test_movie_list_view_search_ranks_title_over_description(client, genre):
+    Movie.objects.create(title='Quiet Harbor', description='A storm hits the coast', release_year=2001,
+                         duration_minutes=90, genre=genre)
+    Movie.objects.create(title='Storm Chasers', description='Scientists follow a storm', release_year=2002,
+                         duration_minutes=95, genre=genre)
+    Movie.objects.create(title='Desert Road', description='A long drive', release_year=2003,
+                         duration_minutes=100, genre=genre)
+    response = client.get(reverse('movie_list') + '?q=storm')
+    assert [movie.title for movie in response.context['movies']] == ['Storm Chasers', 'Quiet Harbor']
+
+    response = client.get(reverse('movie_list') + '?q=long+drive')
+    assert [movie.title for movie in response.context['movies']] == ['Desert Road']
+
+
+@pytest.mark.django_db
+def test_in_memory_search_index_follows_movie_writes(genre, django_capture_on_commit_callbacks):
+    backend = InMemorySearchBackend()
+    movie = Movie.objects.create(title='Northern Lights', description='Test', release_year=2001,
+                                 duration_minutes=90, genre=genre)
+    assert list(backend.rank('northern')) == [movie.pk]
+
+    with override_settings(MOVIES_SEARCH_BACKEND='movies.search.InMemorySearchBackend'):
+        get_search_backend().build()
+        with django_capture_on_commit_callbacks(execute=True):
+            movie.title = 'Southern Lights'
+            movie.save()
+        assert get_search_backend().rank('northern') == {}
+        assert list(get_search_backend().rank('southern')) == [movie.pk]
+        with django_capture_on_commit_callbacks(execute=True):
+            movie.delete()
+        assert get_search_backend().rank('southern') == {}
+
+
+@pytest.mark.django_db
+def test_movie_list_view_search_pagination(client, genre):
+    for i in range(30):
+        Movie.objects.create(title=f'Space {"space " * (i % 3)}{i}', description='Test', release_year=2000,
+                             duration_minutes=90, genre=genre)
+    url = reverse('movie_list') + '?q=space'
+    seen = []
+    while url:
+        response = client.get(url)
+        seen.extend(response.context['movies'])
+        next_url = response.context['page_obj'].next_url
+        url = reverse('movie_list') + next_url if next_url else None
+    assert len({movie.pk for movie in seen}) == 30
+    assert [movie.search_rank for movie in seen] == sorted((movie.search_rank for movie in seen), reverse=True)
+
+
+@pytest.mark.django_db
+def test_movie_list_view_search_sorted_by_title_lists_every_match(client, settings, genre):
+    settings.MOVIES_SEARCH_MAX_RESULTS = 3
+    for i in range(8):
+        Movie.objects.create(title=f'Heist {i}', description='Test', release_year=2000, duration_minutes=90,
+                             genre=genre)
+    # Relevance ranking stops at MOVIES_SEARCH_MAX_RESULTS; other orderings filter on every match.
+    response = client.get(reverse('movie_list') + '?q=heist')
+    assert len(response.context['movies']) == 3
+    response = client.get(reverse('movie_list') + '?q=heist&sort_by=title')
+    assert [movie.title for movie in response.context['movies']] == [f'Heist {i}' for i in range(8)]
+
+
+@pytest.mark.django_db
+def test_autocomplete_view_ranks_and_filters_persons(client):
+    Person.objects.create(first_name='Jonathan', last_name='Demme', birth_date='1944-02-22', role='director')
+    Person.objects.create(first_name='Jon', last_name='Favreau', birth_date='1966-10-19', role='both')
+    Person.objects.create(first_name='Joan', last_name='Allen', birth_date='1956-08-20', role='actor')
+    response = client.get(reverse('autocomplete', kwargs={'source': 'person'}) + '?q=jon')
+    assert response.status_code == 200
+    texts = [result['text'] for result in response.json()['results']]
+    assert texts[:2] == ['Jon Favreau', 'Jonathan Demme']
+
+    response = client.get(reverse('autocomplete', kwargs={'source': 'person'}) + '?q=jon&role=actor')
+    texts = [result['text'] for result in response.json()['results']]
+    assert texts[0] == 'Jon Favreau'
+    assert 'Jonathan Demme' not in texts
+
+
+@pytest.mark.django_db
+def test_autocomplete_view_unknown_source(client):
+    response = client.get(reverse('autocomplete', kwargs={'source': 'user'}) + '?q=admin')
+    assert response.status_code == 404
+
+
+@pytest.mark.django_db
+def test_autocomplete_index_follows_writes(client, movie, django_capture_on_commit_callbacks):
+    url = reverse('autocomplete', kwargs={'source': 'movie'})
+    assert client.get(url + '?q=test').json()['results'][0]['id'] == movie.pk
+    with django_capture_on_commit_callbacks(execute=True):
+        movie.title = 'Renamed Picture'
+        movie.save()
+    assert client.get(url + '?q=test').json()['results'] == []
+    assert client.get(url + '?q=renamed').json()['results'][0]['id'] == movie.pk
+
+
+@pytest.mark.django_db
+def test_cast_form_renders_only_selected_options(client, user, movie, person):
+    Person.objects.create(first_name='Unrelated', last_name='Actor', birth_date='1980-01-01', role='actor')
+    cast = Cast.objects.create(movie=movie, person=person, role_name='Hero')
+    client.force_login(user)
+    content = client.get(reverse('cast_edit', kwargs={'pk': cast.pk})).content.decode()
+    assert 'data-autocomplete-url' in content
+    assert 'Jack Smith' in content
+    assert 'Unrelated Actor' not in content
+
+
+@pytest.mark.django_db
+def test_autocomplete_selects_report_malformed_keys_as_form_errors(client, user, movie, person):
+    client.force_login(user)
+    response = client.post(reverse('review_add'), {'movie': 'abc', 'rating': 5, 'text': 'Great'})
+    assert response.status_code == 200
+    assert 'movie' in response.context['form'].errors
+    response = client.post(reverse('cast_add'), {'movie': '²', 'person': person.pk, 'role_name': 'Hero'})
+    assert response.status_code == 200
+    assert 'movie' in response.context['form'].errors
+    data = {'title': 'New', 'description': 'Test', 'release_year': 2020, 'duration_minutes': 100, 'genre': 'abc',
+            'directors': ['x', person.pk]}
+    response = client.post(reverse('movie_add'), data)
+    assert response.status_code == 200
+    assert {'genre', 'directors'} <= response.context['form'].errors.keys()
+
+
+@pytest.mark.django_db
+def test_autocomplete_view_browse_pagination(client):
+    for i in range(12):
+        Genre.objects.create(name=f'Genre {i:02d}')
+    url = reverse('autocomplete', kwargs={'source': 'genre'})
+    first = client.get(url + '?limit=10').json()
+    assert [result['text'] for result in first['results']] == [f'Genre {i:02d}' for i in range(10)]
+    second = client.get(url + f'?limit=10&cursor={first["next"]}').json()
+    assert [result['text'] for result in second['results']] == ['Genre 10', 'Genre 11']
+    assert second['next'] is None
+
+    assert client.get(url + '?cursor=garbage').status_code == 400
+
+
+@pytest.mark.django_db
+def test_movie_form_renders_without_loading_related_tables(client, user, django_assert_max_num_queries):
+    for i in range(30):
+        Genre.objects.create(name=f'Genre {i}')
+        Person.objects.create(first_name='Director', last_name=f'{i}', birth_date='1970-01-01', role='director')
+    client.force_login(user)
+    with django_assert_max_num_queries(2):
+        content = client.get(reverse('movie_add')).content.decode()
+    assert 'Genre 1' not in content
+    assert 'Director 1' not in content
+
+
+@pytest.mark.django_db
+def test_movie_form_validates_related_choices(genre, person):
+    actor = Person.objects.create(first_name='Only', last_name='Actor', birth_date='1980-01-01', role='actor')
+    data = {'title': 'New', 'description': 'Test', 'release_year': 2020, 'duration_minutes': 100,
+            'genre': genre.pk, 'directors': [person.pk]}
+    assert MovieForm(data=data).is_valid()
+
+    form = MovieForm(data={**data, 'directors': [actor.pk]})
+    assert not form.is_valid()
+    assert 'directors' in form.errors
+
+    form = MovieForm(data={**data, 'genre': genre.pk + 1000})
+    assert not form.is_valid()
+    assert 'genre' in form.errors
+
+
+def write_jsonl(path, rows):
+    path.write_text(''.join(json.dumps(row) + '\n' for row in rows))
+
+
+@pytest.mark.django_db
+def test_import_catalog_command_is_idempotent(tmp_path):
+    write_jsonl(tmp_path / 'genres.jsonl', [{'id': 1, 'name': 'Drama'}])
+    (tmp_path / 'persons.csv').write_text(
+        'id,first_name,last_name,birth_date,death_date,role\n'
+        '1,Ingmar,Bergman,1918-07-14,2007-07-30,director\n'
+        '2,Max,von Sydow,1929-04-10,,actor\n'
+    )
+    write_jsonl(tmp_path / 'awards.jsonl', [{'id': 1, 'name': 'Palme d\'Or'}])
+    write_jsonl(tmp_path / 'movies.jsonl', [
+        {'id': 1, 'title': 'The Seventh Seal', 'description': 'Chess with Death', 'release_year': 1957,
+         'duration_minutes': 96, 'genre': 1, 'directors': [1],
+         'cast': [{'id': 1, 'person': 2, 'role_name': 'Antonius Block'}]},
+        {'id': 2, 'title': 'Orphan', 'description': 'Unknown genre', 'release_year': 2000,
+         'duration_minutes': 90, 'genre': 99},
+    ])
+    write_jsonl(tmp_path / 'movie_awards.jsonl', [{'id': 1, 'movie': 1, 'award': 1, 'category': 'Special Prize'}])
+
+    out = StringIO()
+    call_command('import_catalog', str(tmp_path), batch_size=1, stdout=out)
+    call_command('import_catalog', str(tmp_path), stdout=StringIO())
+
+    assert 'rows/s' in out.getvalue()
+    movie = Movie.objects.get()
+    assert movie.title == 'The Seventh Seal'
+    assert movie.rating_count == 0
+    assert movie.rating_histogram == [0] * 10
+    assert list(movie.directors.values_list('last_name', flat=True)) == ['Bergman']
+    assert list(movie.cast_set.values_list('role_name', flat=True)) == ['Antonius Block']
+    assert movie.movieaward_set.get().category == 'Special Prize'
+    assert Person.objects.get(pk=2).death_date is None
+    assert Person.objects.count() == 2
+
+    write_jsonl(tmp_path / 'movies.jsonl', [
+        {'id': 1, 'title': 'Det sjunde inseglet', 'description': 'Chess with Death', 'release_year': 1957,
+         'duration_minutes': 96, 'genre': 1},
+    ])
+    call_command('import_catalog', str(tmp_path / 'movies.jsonl'), entity='movies', stdout=StringIO())
+    assert Movie.objects.get().title == 'Det sjunde inseglet'
+
+
+@pytest.mark.django_db
+def test_catalog_importer_keeps_only_referenced_ids(movie, person):
+    importer = CatalogImporter(batch_size=2)
+    stats = importer.import_rows('casts', [
+        {'id': 100 + i, 'movie': movie.pk, 'person': person.pk, 'role_name': f'Role {i}'} for i in range(5)
+    ])
+    assert stats.rows == 5 and Cast.objects.count() == 5
+    # Nothing references casts, so their ids are never looked up or remembered.
+    assert 'casts' not in importer.known
+    assert set(importer.known) == {'movies', 'persons'}
+    assert Cast in importer.touched_models
+
+
+def catalog_snapshot():
+    movie = Movie.objects.get()
+    return {
+        'movie': (movie.pk, movie.title, movie.genre.name, movie.rating_count, movie.rating_histogram),
+        'directors': list(movie.directors.values_list('pk', 'last_name')),
+        'cast': list(movie.cast_set.values_list('pk', 'person_id', 'role_name')),
+        'awards': list(movie.movieaward_set.values_list('pk', 'award__name', 'category')),
+        'reviews': list(movie.review_set.values_list('pk', 'user__username', 'rating', 'text', 'created_at')),
+        'persons': list(Person.objects.values_list('pk', 'first_name', 'birth_date', 'death_date', 'role')),
+    }
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('format', ['jsonl', 'csv'])
+def test_export_catalog_round_trips_through_import(tmp_path, movie, movie_award, review, format):
+    actor = Person.objects.create(first_name='Ann', last_name='Lee', birth_date='1980-01-01', role='actor')
+    Cast.objects.create(movie=movie, person=actor, role_name='Hero, "the" lead')
+    before = catalog_snapshot()
+
+    out = StringIO()
+    call_command('export_catalog', str(tmp_path), format=format, chunk_size=1, stdout=out)
+    assert 'Export finished.' in out.getvalue()
+
+    for model in (Genre, Person, Award, User):
+        model.objects.all().delete()
+    call_command('import_catalog', str(tmp_path), stdout=StringIO())
+
+    assert catalog_snapshot() == before
+    assert User.objects.get().username == 'testuser'
+
+
+@pytest.mark.django_db
+def test_catalog_export_view_streams_for_staff_only(client, user, movie):
+    url = reverse('catalog_export', kwargs={'entity': 'movies', 'format': 'jsonl'})
+    client.force_login(user)
+    assert client.get(url).status_code == 403
+
+    user.is_staff = True
+    user.save()
+    response = client.get(url)
+    assert response.streaming
+    assert response['Content-Type'] == 'application/x-ndjson'
+    rows = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+    assert [(row['title'], row['directors'], row['cast']) for row in rows] == [('Test Movie', [movie.directors.get().pk], [])]
+    assert client.get(reverse('catalog_export', kwargs={'entity': 'movies', 'format': 'xml'})).status_code == 404
+
+
+@pytest.mark.django_db
+def test_detail_cache_serves_hits_without_queries(client, django_assert_num_queries, admin_user, populated_movie):
+    url = reverse('movie_detail', kwargs={'pk': populated_movie.pk})
+    first = client.get(url).content
+    with django_assert_num_queries(0):
+        assert client.get(url).content == first
+
+    client.force_login(admin_user)
+    stats = client.get(reverse('detail_cache_stats')).json()
+    assert stats['movie'] == {'hits': 1, 'misses': 1}
+
+
+@pytest.mark.django_db
+def test_detail_cache_never_serves_stale_data(client, user, movie, person, movie_award, award):
+    def page(url_name, pk):
+        return client.get(reverse(url_name, kwargs={'pk': pk})).content.decode()
+
+    def movie_page():
+        return page('movie_detail', movie.pk)
+
+    for url_name, pk in (('movie_detail', movie.pk), ('person_detail', person.pk), ('award_detail', award.pk)):
+        page(url_name, pk)
+
+    movie.title = 'Renamed Movie'
+    movie.save()
+    assert 'Renamed Movie' in movie_page()
+    assert 'Renamed Movie' in page('person_detail', person.pk)
+    assert 'Renamed Movie' in page('award_detail', award.pk)
+
+    movie.genre.name = 'Thriller'
+    movie.genre.save()
+    assert 'Thriller' in movie_page()
+
+    actor = Person.objects.create(first_name='Ann', last_name='Lee', birth_date='1980-01-01', role='actor')
+    page('person_detail', actor.pk)
+    cast = Cast.objects.create(movie=movie, person=actor, role_name='Hero')
+    assert 'Hero' in movie_page()
+    assert 'Hero' in page('person_detail', actor.pk)
+    actor.last_name = 'Leigh'
+    actor.save()
+    assert 'Leigh' in movie_page()
+    cast.delete()
+    assert 'Hero' not in movie_page()
+
+    Review.objects.create(user=user, movie=movie, rating=3, text='Overrated')
+    assert 'Overrated' in movie_page()
+
+    award.name = 'Golden Globe'
+    award.save()
+    assert 'Golden Globe' in movie_page()
+    movie_award.delete()
+    assert 'Golden Globe' not in movie_page()
+
+    movie.directors.remove(person)
+    assert 'Smith' not in movie_page()
+    assert 'Renamed Movie' not in page('person_detail', person.pk)
+    person.directed_movies.add(movie)
+    assert 'Smith' in movie_page()
+    person.directed_movies.clear()
+    assert 'Smith' not in movie_page()
+
+
+@pytest.mark.django_db
+def test_cast_and_movie_award_rows_are_unique(movie, person, award, movie_award):
+    Cast.objects.create(movie=movie, person=person, role_name='Hero')
+    with pytest.raises(IntegrityError), transaction.atomic():
+        Cast.objects.create(movie=movie, person=person, role_name='Hero')
+    with pytest.raises(IntegrityError), transaction.atomic():
+        MovieAward.objects.create(movie=movie, award=award, category=movie_award.category)
+    Cast.objects.create(movie=movie, person=person, role_name='Villain')
+
+
+@pytest.mark.django_db
+def test_cast_and_movie_award_forms_report_duplicates(client, user, movie, person, award, movie_award, genre):
+    other = Movie.objects.create(title='Other', description='Test', release_year=2001, duration_minutes=90, genre=genre)
+    Cast.objects.create(movie=movie, person=person, role_name='Hero')
+    client.force_login(user)
+
+    data = {'award': award.pk, 'category': movie_award.category}
+    response = client.post(reverse('movie_award_add') + f'?movie={movie.pk}', data)
+    assert response.status_code == 200
+    assert response.context['form'].non_field_errors()
+    assert client.post(reverse('movie_award_add') + f'?movie={other.pk}', data).status_code == 302
+    assert client.post(reverse('movie_award_add') + '?movie=abc', data).status_code == 404
+
+    # The movie from the query is the one the row is validated and saved against, whatever is posted.
+    data = {'movie': other.pk, 'person': person.pk, 'role_name': 'Hero'}
+    response = client.post(reverse('cast_add') + f'?movie={movie.pk}', data)
+    assert response.status_code == 200
+    assert response.context['form'].non_field_errors()
+    assert client.post(reverse('cast_add') + f'?movie={other.pk}', {**data, 'movie': movie.pk}).status_code == 302
+    assert Cast.objects.filter(movie=other, person=person, role_name='Hero').exists()
+
+
+@pytest.mark.django_db
+def test_explain_hot_queries_prints_a_plan_per_query(populated_movie, review):
+    out = StringIO()
+    call_command('explain_hot_queries', stdout=out)
+    output = out.getvalue()
+    for url in ('/movies/?sort_by=rating', '/reviews', f'/movies/{populated_movie.pk}/', '/autocomplete/person/?role=actor'):
+        assert f'{url}\n' in output
+    assert '"movies_review"."movie_id" = %s ORDER BY "movies_review"."created_at" DESC' in output
+
+
+@pytest.mark.django_db
+def test_api_list_sparse_fields_includes_and_cursor(client, django_assert_max_num_queries, populated_movie):
+    genre = populated_movie.genre
+    for i in range(3):
+        Movie.objects.create(title=f'Sequel {i}', description='', release_year=2010 + i, duration_minutes=90, genre=genre)
+
+    with django_assert_max_num_queries(3):
+        response = client.get(reverse('api_list', kwargs={'resource': 'movies'}),
+                              {'fields': 'title,directors', 'include': 'genre', 'limit': 2})
+    payload = response.json()
+    assert payload['results'][0] == {'id': populated_movie.pk, 'title': 'Test Movie',
+                                     'directors': list(populated_movie.directors.values_list('pk', flat=True))}
+    assert payload['included'] == {'genres': [{'id': genre.pk, 'name': genre.name}]}
+
+    titles = [row['title'] for row in payload['results']]
+    while payload['next']:
+        payload = client.get(reverse('api_list', kwargs={'resource': 'movies'}),
+                             {'fields': 'title', 'limit': 2, 'cursor': payload['next']}).json()
+        titles += [row['title'] for row in payload['results']]
+    assert titles == ['Test Movie', 'Sequel 0', 'Sequel 1', 'Sequel 2']
+
+    cast = client.get(reverse('api_list', kwargs={'resource': 'casts'}), {'movie': populated_movie.pk, 'limit': 100})
+    assert len(cast.json()['results']) == 20
+    assert client.get(reverse('api_list', kwargs={'resource': 'movies'}), {'fields': 'secret'}).status_code == 400
+    assert client.get(reverse('api_list', kwargs={'resource': 'movies'}), {'include': 'secret'}).status_code == 400
+    assert client.get(reverse('api_list', kwargs={'resource': 'nothing'})).status_code == 404
+
+
+@pytest.mark.django_db
+def test_api_detail_revalidates_with_etag_and_last_modified(client, django_assert_num_queries, movie, user):
+    url = reverse('api_detail', kwargs={'resource': 'movies', 'pk': movie.pk})
+    response = client.get(url, {'include': 'reviews'})
+    etag, last_modified = response['ETag'], response['Last-Modified']
+    assert not etag.startswith('W/')
+
+    with django_assert_num_queries(0):
+        assert client.get(url, {'include': 'reviews'}, HTTP_IF_NONE_MATCH=etag).status_code == 304
+        assert client.get(url, {'include': 'reviews'}, HTTP_IF_MODIFIED_SINCE=last_modified).status_code == 304
+
+    Review.objects.create(user=user, movie=movie, rating=7, text='Fine')
+    response = client.get(url, {'include': 'reviews'}, HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == 200
+    assert response.json()['included']['reviews'][0]['text'] == 'Fine'
+    assert client.get(url, {'include': 'reviews'}, HTTP_IF_MODIFIED_SINCE=last_modified).status_code == 200
+
+    genres = reverse('api_list', kwargs={'resource': 'genres'})
+    etag = client.get(genres)['ETag']
+    assert client.get(genres, HTTP_IF_NONE_MATCH=etag).status_code == 304
+
+
+@pytest.mark.django_db
+def test_api_writes_validate_through_model_forms(client, user, genre, person, movie):
+    movies = reverse('api_list', kwargs={'resource': 'movies'})
+    data = {'title': 'New', 'description': 'D', 'release_year': 2001, 'duration_minutes': 100,
+            'genre': genre.pk, 'directors': [person.pk]}
+    assert client.post(movies, data, content_type='application/json').status_code == 401
+
+    client.force_login(user)
+    response = client.post(movies, data, content_type='application/json')
+    assert response.status_code == 201
+    created = response.json()['data']
+    assert created['directors'] == [person.pk]
+
+    url = reverse('api_detail', kwargs={'resource': 'movies', 'pk': created['id']})
+    response = client.patch(url, {'title': 'Renamed'}, content_type='application/json')
+    assert response.json()['data']['title'] == 'Renamed'
+    assert response.json()['data']['directors'] == [person.pk]
+    response = client.patch(url, {'genre': genre.pk + 100}, content_type='application/json')
+    assert response.status_code == 400
+    assert 'genre' in response.json()['errors']
+
+    review = client.post(reverse('api_list', kwargs={'resource': 'reviews'}),
+                         {'movie': movie.pk, 'rating': 9, 'text': 'Great'}, content_type='application/json')
+    assert review.json()['data']['user'] == user.pk
+    assert Movie.objects.get(pk=movie.pk).rating_count == 1
+
+    assert client.delete(url).status_code == 204
+    assert not Movie.objects.filter(pk=created['id']).exists()
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('url_name, kwargs, query', [
+    ('movie_list', {}, {}),
+    ('movie_list', {}, {'q': 'test'}),
+    ('movie_list', {}, {'sort_by': 'rating'}),
+    ('person_list', {}, {'role': 'actor'}),
+    ('genre_list', {}, {}),
+    ('award_list', {}, {}),
+    ('review_list', {}, {}),
+    ('movie_detail', {'pk': 'movie'}, {}),
+    ('person_detail', {'pk': 'person'}, {}),
+    ('award_detail', {'pk': 'award'}, {}),
+    ('api_list', {'resource': 'movies'}, {'include': 'genre,cast'}),
+    ('api_detail', {'resource': 'movies', 'pk': 'movie'}, {'include': 'reviews', 'fields': 'title'}),
+])
+def test_async_views_render_like_their_sync_counterparts(client, populated_movie, movie_award, review,
+                                                         url_name, kwargs, query):
+    objects = {'movie': populated_movie, 'person': populated_movie.directors.get(), 'award': movie_award.award}
+    kwargs = {name: objects[value].pk if value in objects else value for name, value in kwargs.items()}
+    sync_response = client.get(reverse(url_name, kwargs=kwargs), query)
+    caches['default'].clear()
+    async_response = client.get(reverse(f'async_{url_name}', kwargs=kwargs), query)
+    assert sync_response.status_code == async_response.status_code == 200
+    assert sync_response.content == async_response.content
+
+
+@pytest.mark.django_db
+def test_async_views_report_missing_objects_and_bad_cursors(client):
+    assert client.get(reverse('async_movie_detail', kwargs={'pk': 404})).status_code == 404
+    assert client.get(reverse('async_movie_list'), {'cursor': 'garbage'}).status_code == 404
+    assert client.get(reverse('async_api_list', kwargs={'resource': 'movies'}), {'fields': 'x'}).status_code == 400
+    assert client.get(reverse('async_api_detail', kwargs={'resource': 'genres', 'pk': 404})).status_code == 404
+
+
+@pytest.mark.django_db(transaction=True)
+def test_load_test_reports_latency_for_each_view_flavour(live_server, populated_movie, movie_award, review):
+    out = StringIO()
+    call_command('load_test', wsgi_url=live_server.url, asgi_url=live_server.url, concurrency=2, requests=30,
+                 stdout=out)
+    lines = out.getvalue().splitlines()
+    assert [line[:22].strip() for line in lines] == ['sync views on WSGI', 'sync views on ASGI', 'async views on ASGI']
+    assert all('req/s' in line and 'p99' in line and 'errors' not in line for line in lines)
+
+
+def neighbor_table():
+    return {
+        movie_id: [(neighbor_id, pytest.approx(similarity, abs=1e-5)) for neighbor_id, similarity in ranking]
+        for movie_id, ranking in load_neighbors(Movie.objects.values_list('pk', flat=True)).items()
+    }
+
+
+@pytest.mark.django_db
+def test_refresh_recommendations_shows_co_rated_movies(client, genre):
+    movies = [Movie.objects.create(title=f'Film {i}', description='', release_year=2000 + i, duration_minutes=90,
+                                   genre=genre) for i in range(4)]
+    users = [User.objects.create_user(username=f'viewer{i}') for i in range(4)]
+    # Viewers who rate film 0 highly rate film 1 highly too; film 2 is their opposite and film 3 is unrelated.
+    ratings = [(0, 0, 9), (0, 1, 8), (0, 2, 2), (1, 0, 8), (1, 1, 9), (1, 2, 3), (2, 0, 2), (2, 1, 3), (2, 2, 9),
+               (3, 3, 7)]
+    Review.objects.bulk_create(Review(user=users[u], movie=movies[m], rating=r, text='') for u, m, r in ratings)
+    assert set(Movie.objects.filter(neighbors_stale=True).values_list('pk', flat=True)) == {m.pk for m in movies}
+
+    out = StringIO()
+    call_command('refresh_recommendations', stdout=out)
+    assert 'Refreshed neighbours of 4 movies' in out.getvalue()
+    assert not Movie.objects.filter(neighbors_stale=True).exists()
+    neighbors = load_neighbors([m.pk for m in movies])
+    assert [neighbor_id for neighbor_id, _ in neighbors[movies[0].pk]] == [movies[1].pk]
+    assert neighbors[movies[3].pk] == []
+
+    content = client.get(reverse('movie_detail', kwargs={'pk': movies[0].pk})).content.decode()
+    assert 'Viewers Also Liked' in content and 'Film 1 (2001)' in content and 'Film 2 (2002)' not in content
+
+
+@pytest.mark.django_db
+@override_settings(MOVIES_RECOMMENDATION_SIMILARITY='cosine', MOVIES_RECOMMENDATION_NEIGHBORS=3)
+def test_incremental_recommendation_refresh_matches_full_rebuild(genre):
+    rng = random.Random(13)
+    movies = Movie.objects.bulk_create(
+        Movie(title=f'Film {i}', description='', release_year=2000, duration_minutes=90, genre=genre) for i in range(40)
+    )
+    users = User.objects.bulk_create(User(username=f'viewer{i}') for i in range(30))
+    Review.objects.bulk_create(
+        Review(user=user, movie=movie, rating=rng.randint(1, 10), text='')
+        for user in users for movie in rng.sample(movies, 6)
+    )
+    refresh_neighbors(full=True)
+
+    reviews = list(Review.objects.order_by('pk'))
+    reviews[0].rating = 11 - reviews[0].rating
+    reviews[0].save()
+    reviews[1].delete()
+    Review.objects.filter(movie=movies[5]).delete()
+    Review.objects.create(user=users[0], movie=movies[7], rating=10, text='')
+    while Movie.objects.filter(neighbors_stale=True).exists():
+        refresh_neighbors(max_cells=80)
+    incremental = neighbor_table()
+
+    refresh_neighbors(full=True)
+    assert incremental == neighbor_table()
+    assert neighbor_table()[movies[5].pk] == []
+
+
+def credits_of(person):
+    return [tuple(row) for row in filmography(person)]
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('table', [False, True])
+def test_person_filmography_is_year_sorted_in_constant_queries(client, django_assert_max_num_queries, genre, table):
+    with override_settings(MOVIES_CREDITS_TABLE=table):
+        person = Person.objects.create(first_name='Busy', last_name='Person', birth_date='1950-01-01', role='both')
+        movies = Movie.objects.bulk_create(
+            Movie(title=f'Credit {i:03}', description='', release_year=1960 + i % 40, duration_minutes=90, genre=genre)
+            for i in range(200)
+        )
+        person.directed_movies.add(*movies[::2])
+        for i, movie in enumerate(movies[1::2]):
+            Cast.objects.create(movie=movie, person=person, role_name=f'Role {i}')
+
+        with django_assert_max_num_queries(PersonDetailView.query_budget):
+            content = client.get(reverse('person_detail', kwargs={'pk': person.pk})).content.decode()
+    years = [int(year) for year in re.findall(r'<li>(\d{4}) &middot;', content)]
+    assert len(years) == 200 and years == sorted(years, reverse=True)
+    assert 'Directed:' in content and 'Acted as Role 0 in:' in content
+
+
+@pytest.mark.django_db
+@override_settings(MOVIES_CREDITS_TABLE=True)
+def test_credits_table_follows_cast_director_and_movie_changes(populated_movie):
+    director = populated_movie.directors.get()
+    actor = Cast.objects.filter(movie=populated_movie).first().person
+
+    def assert_in_sync():
+        for person in (director, actor):
+            with override_settings(MOVIES_CREDITS_TABLE=False):
+                expected = credits_of(person)
+            assert credits_of(person) == expected
+
+    # The fixtures were created before the table was switched on, so it starts out empty.
+    assert Credit.objects.count() == 0
+    call_command('rebuild_credits', stdout=StringIO())
+    assert_in_sync()
+    populated_movie.title = 'Renamed Movie'
+    populated_movie.release_year = 1999
+    populated_movie.save()
+    assert_in_sync()
+    cast = Cast.objects.filter(person=actor).first()
+    cast.role_name = 'Hero'
+    cast.save()
+    assert_in_sync()
+    cast.delete()
+    populated_movie.directors.remove(director)
+    assert_in_sync()
+    director.directed_movies.add(populated_movie)
+    assert_in_sync()
+    populated_movie.directors.clear()
+    assert_in_sync()
+    assert credits_of(director) == []
+
+
+@pytest.mark.django_db
+def test_list_rows_are_served_from_the_row_cache_until_saved(client, review):
+    movie, user = review.movie, review.user
+
+    def rows(url_name):
+        return client.get(reverse(url_name)).content.decode()
+
+    assert 'Test Movie' in rows('movie_list') and 'Great movie!' in rows('review_list')
+    # update() sends no signals, so the cached rows keep showing the old values...
+    Movie.objects.filter(pk=movie.pk).update(title='Quietly Renamed')
+    Review.objects.filter(pk=review.pk).update(text='Quietly edited')
+    assert 'Test Movie' in rows('movie_list') and 'Great movie!' in rows('review_list')
+
+    # ...while a save replaces the version stamp of the row and of the rows showing it.
+    movie.title = 'Renamed Movie'
+    movie.save()
+    assert 'Renamed Movie' in rows('movie_list') and 'Renamed Movie' in rows('review_list')
+    user.username = 'renamed_user'
+    user.save()
+    assert 'renamed_user' in rows('review_list')
+    review.refresh_from_db()
+    review.text = 'Edited review'
+    review.save()
+    assert 'Edited review' in rows('review_list')
+
+
+@pytest.mark.django_db
+def test_profile_list_views_splits_sql_view_and_render_time(movie, review):
+    out = StringIO()
+    call_command('profile_list_views', '--repeat', '1', stdout=out)
+    output = out.getvalue()
+    assert '/movies/?sort_by=rating\n' in output and '/reviews\n' in output
+    for label in ('uncached', 'cold', 'warm'):
+        assert re.search(rf'{label} +queries +\d+ +sql +[\d.]+ ms +view +[\d.]+ ms +render +[\d.]+ ms', output)
+
+
+@pytest.mark.django_db
+def test_perf_middleware_records_per_route_histograms(client, populated_movie):
+    recorder.reset()
+    url = reverse('movie_detail', kwargs={'pk': populated_movie.pk})
+    with CaptureQueriesContext(connection) as queries:
+        first = client.get(url)
+    first_queries = len(queries)
+    client.get(url)
+    client.get('/no-such-page/')
+
+    routes, statuses = recorder.snapshot()
+    histograms = routes['movie_detail']
+    assert histograms['latency_seconds'].count == histograms['render_seconds'].count == 2
+    assert histograms['queries'].sum == first_queries > 0
+    assert histograms['db_seconds'].sum > 0
+    assert histograms['response_bytes'].quantile(1.0) >= len(first.content) > 0
+    assert statuses == {('movie_detail', 200): 2, ('<unresolved>', 404): 1}
+
+
+@pytest.mark.django_db
+def test_perf_endpoints_are_restricted_and_expose_prometheus_text(client, movie):
+    recorder.reset()
+    client.get(reverse('movie_list'))
+    assert client.get(reverse('perf_dashboard')).status_code == 302
+    assert client.get(reverse('perf_metrics')).status_code == 403
+
+    with override_settings(MOVIES_METRICS_TOKEN='s3cret'):
+        assert client.get(reverse('perf_metrics'), HTTP_AUTHORIZATION='Bearer wrong').status_code == 403
+        metrics = client.get(reverse('perf_metrics'), HTTP_AUTHORIZATION='Bearer s3cret').content.decode()
+    assert '# TYPE movies_request_latency_seconds histogram' in metrics
+    assert 'movies_request_latency_seconds_bucket{route="movie_list",le="+Inf"} 1' in metrics
+    assert 'movies_request_total{route="movie_list",status="200"} 1' in metrics
+
+    User.objects.create_user(username='staff', password='password', is_staff=True)
+    client.login(username='staff', password='password')
+    dashboard = client.get(reverse('perf_dashboard')).content.decode()
+    assert '<td>movie_list</td>' in dashboard
+
+
+@pytest.mark.django_db
+def test_profile_query_parameter_is_staff_only(client, movie):
+    assert b'Ordered by: cumulative time' not in client.get(reverse('movie_list'), {'_profile': 1}).content
+    User.objects.create_user(username='staff', password='password', is_staff=True)
+    client.login(username='staff', password='password')
+    response = client.get(reverse('movie_list'), {'_profile': 1})
+    assert response['Content-Type'].startswith('text/plain')
+    assert b'Ordered by: cumulative time' in response.content
+
+
+@pytest.mark.django_db(transaction=True)
+def test_perf_middleware_records_async_views(async_client, movie):
+    recorder.reset()
+    response = async_to_sync(async_client.get)(reverse('async_movie_list'))
+    assert response.status_code == 200
+    routes, _ = recorder.snapshot()
+    assert routes['async_movie_list']['queries'].sum >= 1
+    assert routes['async_movie_list']['render_seconds'].count == 1
+
+
+@pytest.mark.django_db(transaction=True)
+def test_fetch_concurrently_overlaps_queries_only_on_persistent_connections(movie, monkeypatch):
+    fetched_apart = []
+
+    def fetch(queryset):
+        fetched_apart.append(queryset.model)
+        return list(queryset)
+
+    monkeypatch.setattr(aio, '_fetch_on_own_connection', fetch)
+    database = SimpleNamespace(vendor='postgresql', settings_dict={'CONN_MAX_AGE': 0}, in_atomic_block=False)
+    monkeypatch.setattr(aio, 'connection', database)
+    results = async_to_sync(aio.fetch_concurrently)({'movies': Movie.objects.all(), 'genres': Genre.objects.all()})
+    assert results == {'movies': [movie], 'genres': [movie.genre]}
+    assert fetched_apart == []
+
+    database.settings_dict['CONN_MAX_AGE'] = 60
+    results = async_to_sync(aio.fetch_concurrently)({'movies': Movie.objects.all(), 'genres': Genre.objects.all()})
+    assert results == {'movies': [movie], 'genres': [movie.genre]}
+    assert sorted(model.__name__ for model in fetched_apart) == ['Genre', 'Movie']
+
+
+@pytest.mark.django_db
+def test_generate_catalog_builds_skewed_catalog():
+    call_command('generate_catalog', movies=60, persons=80, reviews=1200, users=30, seed=7, stdout=StringIO())
+    assert Movie.objects.count() == 60
+    assert User.objects.count() == 30
+    assert Review.objects.count() == 1200
+    assert Movie.directors.through.objects.values('movie').distinct().count() == 60
+    assert Cast.objects.exists()
+    # Review.objects.bulk_create keeps the aggregates current.
+    counts = sorted(Movie.objects.values_list('rating_count', flat=True), reverse=True)
+    assert sum(counts) == 1200
+    assert counts[0] > 5 * counts[len(counts) // 2]
+
+
+@pytest.mark.django_db
+def test_benchmark_writes_json_and_fails_on_regressions(tmp_path, movie, review, person):
+    results = tmp_path / 'results.json'
+    call_command('benchmark', 'views', '--repeat', '1', '--json', str(results), stdout=StringIO())
+    run = json.loads(results.read_text())
+    assert run['meta']['catalog'] == {'movies': 1, 'persons': 1, 'reviews': 1}
+    names = [result['name'] for result in run['suites']['views']]
+    assert {'GET home', 'GET movie_detail most reviewed', 'GET search night', 'POST movie_delete'} <= set(names)
+    assert all('queries' in result for result in run['suites']['views'])
+    # The writes were rolled back.
+    assert Movie.objects.count() == 1 and Review.objects.count() == 1
+
+    out = StringIO()
+    call_command('benchmark', 'views', '--repeat', '1', '--compare', str(results), '--threshold', '1000', stdout=out)
+    assert 'No regressions' in out.getvalue()
+    for result in run['suites']['views']:
+        result['queries'] -= 1
+    results.write_text(json.dumps(run))
+    with pytest.raises(CommandError, match='regressed'):
+        call_command('benchmark', 'views', '--repeat', '1', '--compare', str(results), '--threshold', '1000',
+                     stdout=StringIO())
+
+
+@pytest.mark.django_db
+@pytest.mark.skipif(not os.path.exists('/proc/self/clear_refs'), reason='peak RSS is read from /proc')
+def test_export_benchmark_measures_peak_rss_in_a_child(movie):
+    # The child sees the test's uncommitted rows, and memory the driver or interpreter allocates counts.
+    assert peak_rss_kib(lambda: Movie.objects.get(pk=movie.pk) and b'x' * 32 * 2 ** 20) >= 32 * 1024
+    assert peak_rss_kib(lambda: Movie.objects.get(pk=0)) is None
+    results = export_suite(1, sizes=(10, 100))
+    assert Movie.objects.count() == 100
+    assert all(result['peak_rss_kib'] >= 0 for result in results)
+
+
+@pytest.mark.django_db
+def test_leaderboards_rank_by_bayesian_rating_and_decayed_activity(client, genre):
+    drama = Genre.objects.create(name='Drama')
+    users = [User.objects.create_user(username=f'critic{i}') for i in range(20)]
+    one_hit, steady, old_hit, fresh = [
+        Movie.objects.create(title=title, description='', release_year=2000, duration_minutes=90, genre=movie_genre)
+        for title, movie_genre in (('One Hit', genre), ('Steady', genre), ('Old Hit', drama), ('Fresh', drama))
+    ]
+    Review.objects.create(user=users[0], movie=one_hit, rating=10, text='')
+    Review.objects.bulk_create(Review(user=user, movie=steady, rating=9, text='') for user in users)
+    Review.objects.bulk_create(Review(user=user, movie=old_hit, rating=8, text='') for user in users)
+    Review.objects.bulk_create(Review(user=user, movie=fresh, rating=5, text='') for user in users[:2])
+    Review.objects.filter(movie=old_hit).update(created_at=timezone.now() - timedelta(days=30))
+    call_command('refresh_leaderboards', '--full', stdout=StringIO())
+
+    def ranked(url_name, *args):
+        return [score.movie.title for score in client.get(reverse(url_name, args=args)).context['scores']]
+
+    # A single 10 is pulled towards the catalog mean; twenty 9s barely move.
+    assert ranked('top_rated')[:2] == ['Steady', 'One Hit']
+    assert ranked('genre_top_rated', drama.pk) == ['Old Hit', 'Fresh']
+    # Twenty month-old reviews have decayed below two new ones and below the trending window.
+    assert ranked('trending') == ['Steady', 'Fresh', 'One Hit']
+
+    for user in users[1:6]:
+        Review.objects.create(user=user, movie=one_hit, rating=10, text='')
+    one_hit = Movie.objects.get(pk=one_hit.pk)
+    one_hit.genre = drama
+    one_hit.save()
+    assert list(Movie.objects.filter(scores_stale=True)) == [one_hit]
+    out = StringIO()
+    call_command('refresh_leaderboards', stdout=out)
+    assert 'of 1 movies' in out.getvalue()
+    assert ranked('top_rated')[0] == 'One Hit'
+    assert ranked('genre_top_rated', drama.pk)[0] == 'One Hit'
+
+    Review.objects.filter(movie=fresh).delete()
+    call_command('refresh_leaderboards', stdout=StringIO())
+    assert 'Fresh' not in ranked('top_rated')
+
+
+@pytest.mark.django_db
+def test_genre_movie_counts_follow_movie_writes(genre, movie):
+    drama = Genre.objects.create(name='Drama')
+    Movie.objects.bulk_create(Movie(title=f'Bulk {i}', description='', release_year=2000, duration_minutes=90,
+                                    genre=drama) for i in range(3))
+    genre.refresh_from_db()
+    drama.refresh_from_db()
+    assert (genre.movie_count, drama.movie_count) == (1, 3)
+
+    movie = Movie.objects.get(pk=movie.pk)
+    movie.genre = drama
+    movie.save()
+    Movie.objects.filter(title='Bulk 0').update(genre=genre)
+    Movie.objects.get(title='Bulk 1').delete()
+    counts = dict(Genre.objects.values_list('name', 'movie_count'))
+    assert counts == {'Action': 1, 'Drama': 2}
+
+    # Renaming a genre from a copy read before the last movie write keeps the count.
+    drama.name = 'Dramas'
+    drama.save()
+    assert dict(Genre.objects.values_list('name', 'movie_count')) == {'Action': 1, 'Dramas': 2}
+
+
+@pytest.mark.django_db
+def test_home_dashboard_is_cached_and_refreshed_by_writes(client, django_assert_num_queries, review, movie_award):
+    content = client.get(reverse('home')).content.decode()
+    assert 'Test Movie (2006)' in content and 'Best Picture' in content and '8/10 by testuser' in content
+    with django_assert_num_queries(0):
+        client.get(reverse('home'))
+
+    Movie.objects.create(title='Newest', description='', release_year=2024, duration_minutes=90,
+                         genre=review.movie.genre)
+    response = client.get(reverse('home'))
+    assert response.context['movies'][0].title == 'Newest'
+    assert response.context['genres']['total'] == 2
+    Review.objects.create(user=review.user, movie=review.movie, rating=3, text='')
+    assert [r.rating for r in client.get(reverse('home')).context['reviews']] == [3, 8]
+
+
+def facet_values(response, name):
+    facet = next(facet for facet in response.context['facets'] if facet['name'] == name)
+    return {value['label']: value['count'] for value in facet['values']}
+
+
+@pytest.mark.django_db
+def test_movie_list_facets_filter_and_count(client, user, genre, person, award, django_capture_on_commit_callbacks):
+    drama = Genre.objects.create(name='Drama')
+    other = Person.objects.create(first_name='Ann', last_name='Lee', birth_date='1970-01-01', role='director')
+    specs = [('Alpha', genre, 1994, 85, person), ('Beta', genre, 2003, 100, other), ('Gamma', drama, 1998, 130, person),
+             ('Delta', drama, 2005, 160, other), ('Epsilon', drama, 2007, 95, person)]
+    movies = {}
+    for title, movie_genre, year, minutes, director in specs:
+        movies[title] = Movie.objects.create(title=title, description='', release_year=year,
+                                             duration_minutes=minutes, genre=movie_genre)
+        movies[title].directors.add(director)
+    MovieAward.objects.create(movie=movies['Gamma'], award=award, category='Best Picture')
+    for title, rating in (('Alpha', 9), ('Gamma', 7), ('Delta', 8)):
+        Review.objects.create(user=user, movie=movies[title], rating=rating, text='')
+
+    def titles(response):
+        return [movie.title for movie in response.context['movies']]
+
+    response = client.get(reverse('movie_list'))
+    assert facet_values(response, 'genre') == {'Drama': 3, 'Action': 2}
+    assert facet_values(response, 'decade') == {'2000s': 3, '1990s': 2}
+    assert facet_values(response, 'duration') == {'Under 90 min': 1, '90–120 min': 2, '120–150 min': 1,
+                                                  '150 min or more': 1}
+    assert facet_values(response, 'director') == {'Jack Smith': 3, 'Ann Lee': 2}
+    assert facet_values(response, 'award') == {'Oscar': 1}
+    assert facet_values(response, 'min_rating') == {'9+ ★': 1, '8+ ★': 2, '7+ ★': 3, '6+ ★': 3, '5+ ★': 3}
+
+    # A picked facet keeps counting its other values; the rest count within the selection.
+    response = client.get(reverse('movie_list') + f'?genre={drama.pk}')
+    assert titles(response) == ['Delta', 'Epsilon', 'Gamma']
+    assert facet_values(response, 'genre') == {'Drama': 3, 'Action': 2}
+    assert facet_values(response, 'decade') == {'2000s': 2, '1990s': 1}
+    response = client.get(reverse('movie_list') + f'?genre={drama.pk}&genre={genre.pk}&decade=2000&min_rating=7')
+    assert titles(response) == ['Delta']
+    assert facet_values(response, 'min_rating')['7+ ★'] == 1
+    response = client.get(reverse('movie_list') + f'?director={person.pk}&duration=120-150&sort_by=release_year')
+    assert titles(response) == ['Gamma']
+    assert facet_values(response, 'duration') == {'Under 90 min': 1, '90–120 min': 1, '120–150 min': 1}
+    response = client.get(reverse('movie_list') + f'?award={award.pk}&q=gamma')
+    assert titles(response) == ['Gamma']
+    assert facet_values(response, 'genre') == {'Drama': 1}
+    value = next(value for facet in response.context['facets'] for value in facet['values'] if value['selected'])
+    assert value['url'] == '?q=gamma'
+    assert client.get(reverse('movie_list') + '?genre=x&decade=1995&duration=long&min_rating=3').status_code == 200
+    assert client.get(reverse('movie_list') + '?genre=%C2%B2&director=%C2%B9&min_rating=%C2%B3').status_code == 200
+
+    # Writes committed by this process are applied to the index in place.
+    with django_capture_on_commit_callbacks(execute=True):
+        movie = Movie.objects.get(pk=movies['Beta'].pk)
+        movie.genre = drama
+        movie.save()
+        movie.directors.clear()
+        Review.objects.create(user=user, movie=movie, rating=10, text='')
+        MovieAward.objects.create(movie=movie, award=award, category='Best Director')
+        movies['Alpha'].delete()
+    response = client.get(reverse('movie_list'))
+    assert facet_values(response, 'genre') == {'Drama': 4}
+    assert facet_values(response, 'director') == {'Jack Smith': 2, 'Ann Lee': 1}
+    assert facet_values(response, 'award') == {'Oscar': 2}
+    assert facet_values(response, 'min_rating')['9+ ★'] == 1
+
+
+@pytest.mark.django_db
+def test_movie_list_facets_count_every_search_match(client, settings, genre, django_assert_max_num_queries,
+                                                    monkeypatch):
+    settings.MOVIES_SEARCH_MAX_RESULTS = 2
+    movies = [Movie.objects.create(title=f'Heist {i}', description='', release_year=2000 + i, duration_minutes=100,
+                                   genre=genre) for i in range(5)]
+    get_facet_index()
+    with django_assert_max_num_queries(MovieListView.query_budget):
+        response = client.get(reverse('movie_list') + '?q=heist')
+    assert facet_values(response, 'genre') == {'Action': 5}
+    assert not response.context['facets_approximate']
+
+    # Past MOVIES_FACET_SEARCH_LIMIT matches a backend counts a sample and says so.
+    monkeypatch.setattr(get_search_backend(), 'match_ids', lambda query, limit: ([movies[0].pk], False))
+    response = client.get(reverse('movie_list') + '?q=heist')
+    assert facet_values(response, 'genre') == {'Action': 1}
+    assert 'Counts are approximate' in response.content.decode()
+
+
+@pytest.mark.django_db(transaction=True)
+def test_replica_router_sends_reads_to_replicas_and_pins_writers(client, user, movie, replica_aliases):
+    random.seed(0)
+
+    def reader(path):
+        captured = {alias: CaptureQueriesContext(connections[alias]) for alias in ('default', 'replica_a', 'replica_b')}
+        for context in captured.values():
+            context.__enter__()
+        try:
+            assert client.get(path).status_code == 200
+        finally:
+            for context in captured.values():
+                context.__exit__(None, None, None)
+        return {alias for alias, context in captured.items() if len(context)}
+
+    with override_settings(MOVIES_DATABASE_REPLICAS={'replica_a': 1, 'replica_b': 3}):
+        used = [reader(reverse('movie_list')) for _ in range(20)]
+        assert all(len(aliases) == 1 and 'default' not in aliases for aliases in used)
+        assert 5 * sum('replica_a' in aliases for aliases in used) < sum('replica_b' in aliases for aliases in used) * 3
+
+        client.force_login(user)
+        response = client.post(reverse('review_add'), {'movie': movie.pk, 'rating': 9, 'text': 'Mine'})
+        assert response.status_code == 302
+        assert PIN_COOKIE in response.cookies
+        assert reader(reverse('movie_detail', kwargs={'pk': movie.pk})) == {'default'}
+        client.cookies[PIN_COOKIE] = '0'
+        assert reader(reverse('review_list')) <= {'replica_a', 'replica_b'}
+
+
+@pytest.mark.django_db
+def test_replica_pool_fails_over_and_balances_load(replica_aliases):
+    with pytest.raises(ImproperlyConfigured):
+        ReplicaPool({'missing': 1})
+
+    pool = ReplicaPool({'replica_down': 10, 'replica_a': 1}, check_seconds=60, retry_seconds=60)
+    # The weighted pick may take the healthy replica before probing the other.
+    while 'replica_down' not in pool.down_until:
+        assert pool.choose() == 'replica_a'
+    assert pool.available() == ['replica_a']
+    assert pool.status()['replica_down']['down_for'] > 0
+    pool.mark_down('replica_a', 'test')
+    assert pool.choose() == 'default'
+    recovering = ReplicaPool({'replica_a': 1}, retry_seconds=0)
+    recovering.mark_down('replica_a', 'test')
+    assert recovering.choose() == 'replica_a'
+
+    pool = ReplicaPool({'replica_a': 1, 'replica_b': 2}, strategy='least_loaded')
+    pool.acquire('replica_a')
+    assert {pool.choose() for _ in range(5)} == {'replica_b'}
+    pool.acquire('replica_b')
+    pool.acquire('replica_b')
+    pool.acquire('replica_b')
+    assert pool.choose() == 'replica_a'
+
+    # A connection error mid-request takes the replica out of rotation.
+    with override_settings(MOVIES_DATABASE_REPLICAS={'replica_a': 1}):
+        def failing(sql, params, many, context):
+            raise OperationalError('server closed the connection unexpectedly')
+
+        with pytest.raises(OperationalError):
+            watch_replica(failing, 'SELECT 1', None, False, {'connection': connections['replica_a']})
+        assert get_replica_pool().choose() == 'default'
+
+
+@pytest.mark.django_db(transaction=True)
+def test_replica_reads_skip_fresh_cache_stamps_and_retry_on_the_primary(client, movie, replica_aliases):
+    def misses():
+        return detail_cache.stats(['movie'])['movie']['misses']
+
+    path = reverse('movie_detail', kwargs={'pk': movie.pk})
+    with override_settings(MOVIES_DATABASE_REPLICAS={'replica_a': 1}, MOVIES_REPLICA_MAX_LAG_SECONDS=5,
+                           MOVIES_REPLICA_CHECK_SECONDS=60):
+        # The replica may not have replayed the write behind a fresh stamp, so what it returns is not cached.
+        detail_cache.invalidate('movie', [movie.pk])
+        before = misses()
+        assert client.get(path).status_code == 200
+        assert client.get(path).status_code == 200
+        assert misses() == before + 2
+
+        # Once the stamp is older than the replica can lag, replica reads fill the cache.
+        detail_cache.cache.set(f'movies:version:movie:{movie.pk}', '1-old', None)
+        detail_cache.cache.set(GENERATION_KEY, '1-old', None)
+        assert client.get(path).status_code == 200
+        assert client.get(path).status_code == 200
+        assert misses() == before + 3
+
+        def failing(execute, sql, params, many, context):
+            raise OperationalError('server closed the connection unexpectedly')
+
+        # A replica failing mid-request is taken out of rotation and the request is served by the primary.
+        with connections['replica_a'].execute_wrapper(failing):
+            response = client.get(reverse('movie_list'))
+        assert response.status_code == 200
+        assert movie.title in response.content.decode()
+        assert get_replica_pool().choose() == 'default'
+
+
+def movies_per_shard(genre, shards, count=2):
+    # Creates movies until every shard holds `count` of them.
+    placed = {alias: [] for alias in shards}
+    while any(len(movies) < count for movies in placed.values()):
+        movie = Movie.objects.create(title=f'Sharded {len(placed)}', release_year=2000, duration_minutes=90,
+                                     genre=genre)
+        alias = shard_for(movie.pk, shards)
+        if len(placed[alias]) < count:
+            placed[alias].append(movie)
+    return placed
+
+
+@pytest.mark.django_db(transaction=True)
+def test_reviews_are_sharded_by_movie_and_merged(client, user, genre, review_shards):
+    placed = movies_per_shard(genre, review_shards)
+    movies = [movie for shard_movies in placed.values() for movie in shard_movies]
+    reviews = [Review.objects.create(user=user, movie=movie, rating=1 + i % 10, text=f'Review {i}')
+               for i, movie in enumerate(movies * 4)]
+    reviews += Review.objects.bulk_create(
+        Review(user=user, movie=movie, rating=7, text='Bulk') for movie in movies
+    )
+    assert len({review.pk for review in reviews}) == len(reviews)
+    for alias, shard_movies in placed.items():
+        stored = Review._base_manager.using(alias).values_list('movie_id', flat=True)
+        assert set(stored) == {movie.pk for movie in shard_movies}
+    assert Review.objects.count() == len(reviews)
+    assert Movie.objects.get(pk=movies[0].pk).rating_count == 5
+
+    # A movie's reviews are read from its shard alone, with the select_related user prefetched from the default one.
+    target = placed['shard_a'][0]
+    captured = {alias: CaptureQueriesContext(connections[alias]) for alias in review_shards}
+    for context in captured.values():
+        context.__enter__()
+    response = client.get(reverse('movie_detail', kwargs={'pk': target.pk}))
+    for context in captured.values():
+        context.__exit__(None, None, None)
+    assert response.status_code == 200
+    assert len(response.context['reviews']) == 5
+    assert len(captured['shard_a']) == 1 and not captured['shard_b']
+
+    # The global feed merges the shards newest first, page after page.
+    expected = sorted(reviews, key=lambda review: (review.created_at, review.pk), reverse=True)
+    response = client.get(reverse('review_list'))
+    page = list(response.context['reviews'])
+    assert [review.pk for review in page] == [review.pk for review in expected[:25]]
+    assert page[0].user.username == user.username and page[0].movie.title
+    response = client.get(reverse('review_list') + response.context['page_obj'].next_url)
+    assert [review.pk for review in response.context['reviews']] == [review.pk for review in expected[25:50]]
+    assert reverse('async_review_list') == '/async/reviews/'
+    response = client.get(reverse('async_review_list'))
+    assert [review.pk for review in response.context['reviews']] == [review.pk for review in expected[:25]]
+    rebuild_ratings(movie.pk for movie in movies)
+    assert Movie.objects.get(pk=movies[0].pk).rating_count == 5
+
+    # Moving a review to a movie on another shard moves its row and keeps its creation time.
+    moved = Review.objects.filter(movie=target).order_by('pk')[0]
+    created_at = moved.created_at
+    moved.movie = placed['shard_b'][0]
+    moved.save()
+    assert not Review._base_manager.using('shard_a').filter(pk=moved.pk).exists()
+    assert Review._base_manager.using('shard_b').get(pk=moved.pk).created_at == created_at
+    assert Movie.objects.get(pk=target.pk).rating_count == 4
+    assert Movie.objects.get(pk=placed['shard_b'][0].pk).rating_count == 6
+
+    assert Review.objects.filter(movie__in=placed['shard_b']).update(rating=10) == 11
+    with pytest.raises(NotSupportedError):
+        Review.objects.filter(movie=target).update(movie=placed['shard_b'][0])
+
+    # Deleting a movie or a user reaches its reviews on every shard.
+    placed['shard_b'][1].delete()
+    assert not Review._base_manager.using('shard_b').filter(movie_id=placed['shard_b'][1].pk).exists()
+    User.objects.create_user(username='other').review_set.create(movie=target, rating=2, text='Other')
+    user.delete()
+    assert Review.objects.count() == 1
+    assert Movie.objects.get(pk=target.pk).rating_histogram[1] == 1
+    assert Movie.objects.get(pk=target.pk).rating_count == 1
+
+
+@pytest.mark.django_db(transaction=True)
+def test_reshard_reviews_moves_rows_and_syncs_ids(settings, user, genre, review_shards):
+    settings.MOVIES_REVIEW_SHARDS = ['default']
+    movies = [movie for shard_movies in movies_per_shard(genre, review_shards).values() for movie in shard_movies]
+    reviews = Review.objects.bulk_create(Review(user=user, movie=movie, rating=5, text='Old') for movie in movies)
+    assert Review._base_manager.using('default').count() == len(reviews)
+
+    settings.MOVIES_REVIEW_SHARDS = review_shards
+    out = StringIO()
+    call_command('reshard_reviews', '--batch-size', '2', stdout=out)
+    assert 'Moved 4 reviews onto 3 shards' in out.getvalue()
+    for review in reviews:
+        assert Review._base_manager.using(shard_for(review.movie_id)).filter(pk=review.pk).exists()
+    assert Review.objects.create(user=user, movie=movies[0], rating=5, text='New').pk > max(r.pk for r in reviews)
+
+    # Retiring a shard moves its reviews onto the remaining ones.
+    settings.MOVIES_REVIEW_SHARDS = ['default', 'shard_a']
+    call_command('reshard_reviews', '--from', 'shard_b', stdout=StringIO())
+    assert not Review._base_manager.using('shard_b').exists()
+    assert Review.objects.count() == len(reviews) + 1
+    assert sum(Movie.objects.values_list('rating_count', flat=True)) == len(reviews) + 1
+
+
+@pytest.mark.django_db
+def test_detail_views_buffer_view_counts(client, movie, person, django_assert_num_queries, monkeypatch):
+    for path in (reverse('movie_detail', args=[movie.pk]), reverse('movie_detail', args=[movie.pk]),
+                 reverse('async_movie_detail', args=[movie.pk]), reverse('person_detail', args=[person.pk])):
+        assert client.get(path).status_code == 200
+    counter = get_view_counter()
+    assert counter.pending_views() == 4
+    assert Movie.objects.get(pk=movie.pk).view_count == 0
+
+    # One UPDATE per model and increment, however many objects were viewed.
+    with django_assert_num_queries(2):
+        assert counter.flush() == 4
+    assert Movie.objects.get(pk=movie.pk).view_count == 3
+    assert Person.objects.get(pk=person.pk).view_count == 1
+
+    # Saving a copy loaded before a flush does not write its count back.
+    stale = Movie.objects.get(pk=movie.pk)
+    client.get(reverse('movie_detail', args=[movie.pk]))
+    counter.flush()
+    stale.title = 'Renamed'
+    stale.save()
+    assert Movie.objects.values_list('title', 'view_count').get(pk=movie.pk) == ('Renamed', 4)
+
+    # A failed flush keeps its views for the next one.
+    client.get(reverse('person_detail', args=[person.pk]))
+
+    def failing(pending):
+        raise DatabaseError('database is locked')
+
+    monkeypatch.setattr('movies.popularity.write_views', failing)
+    with pytest.raises(DatabaseError):
+        counter.flush()
+    assert counter.pending_views() == 1
+
+    response = client.get(reverse('most_viewed_movies'))
+    assert [obj.pk for obj in response.context['objects']] == [movie.pk]
+    response = client.get(reverse('most_viewed_persons'))
+    assert [obj.pk for obj in response.context['objects']] == [person.pk]
+
+
+def test_view_counter_flushes_in_background_when_full(monkeypatch):
+    counter = ViewCounter(flush_seconds=60, buffer_size=2)
+    started = []
+    monkeypatch.setattr(counter, 'flush_in_background', lambda: started.append(True))
+    counter.record(Movie, 1)
+    counter.record(Movie, 1)
+    assert not started
+    counter.record(Movie, 2)
+    for _ in range(100):
+        if started:
+            break
+        time.sleep(0.01)
+    assert started == [True]
+    # Only one flush runs at a time.
+    counter.record(Movie, 3)
+    assert counter.flushing and started == [True]
+
+
+def test_view_counter_flushes_an_idle_buffer_on_a_timer(monkeypatch):
+    written = []
+    monkeypatch.setattr('movies.popularity.write_views', lambda pending: written.append(dict(pending)))
+
+    def wait_for(count):
+        for _ in range(200):
+            if len(written) == count:
+                return
+            time.sleep(0.01)
+
+    counter = ViewCounter(flush_seconds=0.05, buffer_size=100)
+    counter.record(Movie, 1)
+    counter.record(Movie, 1)
+    # No later record() call comes to notice the deadline.
+    wait_for(1)
+    assert written == [{(Movie, 1): 2}]
+    assert counter.pending_views() == 0 and counter.timer is None
+
+    counter.record(Person, 2)
+    wait_for(2)
+    assert written[1:] == [{(Person, 2): 1}]
+
+    counter = ViewCounter(flush_seconds=0.05, buffer_size=100)
+    counter.record(Movie, 3)
+    counter.stop()
+    time.sleep(0.1)
+    assert counter.pending_views() == 1 and len(written) == 2
+
+
+@pytest.mark.django_db
+@override_settings(MOVIES_CREDITS_TABLE=True)
+def test_bulk_cast_edit_applies_the_diff_in_constant_queries(client, user, populated_movie, person):
+    call_command('rebuild_credits', stdout=StringIO())
+    casts = {cast.role_name: cast for cast in Cast.objects.filter(movie=populated_movie).select_related('person')}
+    newcomers = Person.objects.bulk_create(
+        Person(first_name=f'New{i}', last_name='Cast', birth_date='1990-01-01', role='actor') for i in range(30)
+    )
+    director = Person.objects.create(first_name='New', last_name='Director', birth_date='1970-01-01', role='director')
+    client.force_login(user)
+    url = reverse('cast_bulk_edit', kwargs={'pk': populated_movie.pk})
+    client.get(reverse('movie_detail', kwargs={'pk': populated_movie.pk}))
+
+    response = client.get(url)
+    assert f'{casts["Role 3"].person.pk}\tRole 3\tActor3 Cast' in response.context['form'].initial['cast']
+    assert response.context['form'].initial['directors'] == f'{person.pk}\tJack Smith'
+
+    # Keep ten rows, rename one, drop nine, add thirty newcomers and give the director a part.
+    lines = [f'{casts[f"Role {i}"].person.pk}\tRole {i}' for i in range(10)]
+    lines.append(f'{casts["Role 10"].person.pk}\tHero\tActor10 Cast')
+    lines += [f'{newcomer.pk} Extra {i}' for i, newcomer in enumerate(newcomers)]
+    lines.append(f'{person.pk}\tCameo')
+    with CaptureQueriesContext(connection) as queries:
+        response = client.post(url, {'cast': '\n'.join(lines) + '\n', 'directors': f'{director.pk}\n\n'})
+    assert response.status_code == 302
+    # Session, user, movie, one in_bulk and the diff's statements: none of them per row.
+    assert len(queries) <= 22
+
+    rows = Cast.objects.filter(movie=populated_movie).order_by('pk')
+    assert [cast.role_name for cast in rows] == [f'Role {i}' for i in range(10)] + ['Hero'] + [
+        f'Extra {i}' for i in range(30)] + ['Cameo']
+    assert rows.get(role_name='Hero').pk == casts['Role 10'].pk
+    assert list(populated_movie.directors.all()) == [director]
+    for someone in (person, director, casts['Role 10'].person, casts['Role 15'].person, newcomers[0]):
+        with override_settings(MOVIES_CREDITS_TABLE=False):
+            expected = credits_of(someone)
+        assert credits_of(someone) == expected
+    content = client.get(reverse('movie_detail', kwargs={'pk': populated_movie.pk})).content.decode()
+    assert 'Hero' in content and 'New29 Cast' in content and 'Role 15' not in content and 'New Director' in content
+
+    # Bad lines are reported by line number and nothing is written.
+    response = client.post(url, {'cast': f'x\tRole\n{newcomers[0].pk}\n999999\tGhost\n{director.pk}\tCameo',
+                                 'directors': f'{newcomers[1].pk}'})
+    assert response.status_code == 200
+    assert response.context['form'].errors == {
+        'cast': ['Line 1: "x" is not a person id.', 'Line 2: the role name is missing.'],
+    }
+    response = client.post(url, {'cast': f'999999\tGhost\n{director.pk}\tCameo', 'directors': f'{newcomers[1].pk}'})
+    assert response.context['form'].errors == {
+        'cast': ['Line 1: there is no person 999999.', 'Line 2: New Director is not an actor.'],
+        'directors': ['Line 1: New1 Cast is not a director.'],
+    }
+    response = client.post(url, {'cast': '²\tHero\n12345678901\tGiant', 'directors': '²\n99999999999'})
+    assert response.context['form'].errors == {
+        'cast': ['Line 1: "²" is not a person id.', 'Line 2: "12345678901" is not a person id.'],
+        'directors': ['Line 1: "²" is not a person id.', 'Line 2: "99999999999" is not a person id.'],
+    }
+    assert Cast.objects.filter(movie=populated_movie).count() == 42
+
+
+@pytest.mark.django_db
+@override_settings(MOVIES_CREDITS_TABLE=True)
+def test_deleting_a_genre_hides_it_at_once_and_removes_it_in_batches(client, user, populated_movie, person):
+    call_command('rebuild_credits', stdout=StringIO())
+    genre = populated_movie.genre
+    sequel = Movie.objects.create(title='Sequel', description='', release_year=2008, duration_minutes=90, genre=genre)
+    Cast.objects.create(movie=sequel, person=person, role_name='Lead')
+    other = Movie.objects.create(title='Survivor', description='', release_year=2010, duration_minutes=90,
+                                 genre=Genre.objects.create(name='Drama'))
+    Cast.objects.create(movie=other, person=person, role_name='Hero')
+    Review.objects.bulk_create(Review(user=user, movie=other, rating=6, text='Still here') for _ in range(3))
+    MovieNeighbor.objects.create(movie=other, neighbor=populated_movie, similarity=0.9, rank=1)
+    refresh_scores(full=True)
+    client.force_login(user)
+    for name in ('movie_list', 'genre_list', 'top_rated', 'home'):
+        client.get(reverse(name))
+    client.get(reverse('movie_detail', kwargs={'pk': other.pk}))
+    client.get(reverse('person_detail', kwargs={'pk': person.pk}))
+
+    with CaptureQueriesContext(connection) as queries:
+        response = client.post(reverse('genre_delete', kwargs={'pk': genre.pk}))
+    assert response.status_code == 302
+    # Hiding costs the same however many reviews, cast rows and awards the genre's movies have.
+    assert len(queries) < 25
+    assert Movie._base_manager.filter(genre=genre).count() == 2
+    assert not Movie.objects.filter(genre=genre).exists() and not Genre.objects.filter(pk=genre.pk).exists()
+    assert client.get(reverse('movie_detail', kwargs={'pk': populated_movie.pk})).status_code == 404
+    pages = [client.get(reverse(name)).content.decode() for name in ('movie_list', 'genre_list', 'top_rated', 'home')]
+    pages.append(client.get(reverse('person_detail', kwargs={'pk': person.pk})).content.decode())
+    pages.append(client.get(reverse('movie_detail', kwargs={'pk': other.pk})).content.decode())
+    assert [i for i, page in enumerate(pages) if 'Test Movie' in page or 'Sequel' in page] == []
+    assert 'Survivor' in pages[0] and reverse('genre_edit', kwargs={'pk': genre.pk}) not in pages[1]
+    results = client.get(reverse('autocomplete', args=['movie']), {'q': 'sequel'}).json()['results']
+    assert sequel.pk not in [result['id'] for result in results]
+    for resource in ('casts', 'movie-awards', 'reviews'):
+        rows = client.get(reverse('api_list', kwargs={'resource': resource}), {'limit': 100}).json()['results']
+        assert {row['movie'] for row in rows} == {other.pk} if resource != 'movie-awards' else rows == []
+    assert [review.movie_id for review in client.get(reverse('review_list')).context['reviews']] == [other.pk] * 3
+
+    out = StringIO()
+    call_command('process_deletions', '--batch-size', '7', stdout=out)
+    lines = out.getvalue().splitlines()
+    assert len(lines) > 10 and lines[-1].startswith('Deleted 1 objects and ')
+    assert not Movie._base_manager.filter(genre=genre).exists() and not Genre._base_manager.filter(pk=genre.pk).exists()
+    for model in (Cast, MovieAward, Review, Credit, MovieNeighbor, MovieScore):
+        assert not model._base_manager.filter(movie__in=[populated_movie.pk, sequel.pk]).exists()
+    assert list(Cast.objects.filter(person=person).values_list('role_name', flat=True)) == ['Hero']
+    assert Deletion.objects.get().finished_at is not None
+    assert Genre.objects.get(name='Drama').movie_count == 1
+
+
+@pytest.mark.django_db
+def test_deleting_a_person_keeps_their_movies(client, user, populated_movie, person):
+    client.force_login(user)
+    actor = Cast.objects.filter(movie=populated_movie).first().person
+    client.get(reverse('movie_detail', kwargs={'pk': populated_movie.pk}))
+    assert client.delete(reverse('api_detail', args=['persons', actor.pk])).status_code == 204
+    client.post(reverse('person_delete', kwargs={'pk': person.pk}))
+    # A copy read before the request, saved by a form, does not bring the actor back.
+    actor.first_name = 'Renamed'
+    actor.save()
+
+    content = client.get(reverse('movie_detail', kwargs={'pk': populated_movie.pk})).content.decode()
+    assert str(actor) not in content and 'Jack Smith' not in content and 'Actor1 Cast' in content
+    assert client.get(reverse('person_detail', kwargs={'pk': actor.pk})).status_code == 404
+    assert Person._base_manager.filter(pk__in=[actor.pk, person.pk]).count() == 2
+
+    assert [deletion.stage for deletion in delete_pending(batch_size=100)][-1] == ''
+    assert not Person._base_manager.filter(pk__in=[actor.pk, person.pk]).exists()
+    assert Cast.objects.filter(movie=populated_movie).count() == 19
+    assert not populated_movie.directors.exists()
+    assert Movie.objects.filter(pk=populated_movie.pk).exists()
+
+
+@pytest.mark.django_db
+def test_each_deletion_is_worked_on_by_one_run(populated_movie, settings):
+    settings.MOVIES_DELETE_IN_BACKGROUND = False
+    request_deletion(populated_movie)
+    first = delete_pending(batch_size=5)
+    assert next(first).stage
+    # A concurrent run finds nothing it can claim.
+    assert list(delete_pending(batch_size=5)) == []
+
+    # A claim left without progress lapses, and the run that held it stops at its next batch.
+    Deletion.objects.update(updated_at=timezone.now() - timedelta(seconds=settings.MOVIES_DELETE_CLAIM_SECONDS + 1))
+    assert [deletion.stage for deletion in delete_pending(batch_size=5)][-1] == ''
+    assert list(first) == []
+    deletion = Deletion.objects.get()
+    assert deletion.finished_at is not None
+    assert not Movie._base_manager.filter(pk=populated_movie.pk).exists()
+
+
+@pytest.mark.django_db(transaction=True)
+def test_deleting_a_movie_removes_its_reviews_from_every_shard(user, genre, review_shards, settings):
+    settings.MOVIES_DELETE_IN_BACKGROUND = False
+    placed = movies_per_shard(genre, review_shards, count=1)
+    movies = [movie for shard_movies in placed.values() for movie in shard_movies]
+    for movie in movies:
+        Review.objects.bulk_create(Review(user=user, movie=movie, rating=5, text='Sharded') for _ in range(5))
+    doomed, kept = movies[0], movies[1:]
+    request_deletion(doomed)
+    assert {review.movie_id for review in Review.objects.live()} == {movie.pk for movie in kept}
+    assert doomed.pk not in {review.movie_id for review in recent_reviews()}
+    for deletion in delete_pending(batch_size=2):
+        pass
+    assert not Movie._base_manager.filter(pk=doomed.pk).exists()
+    assert set(Review.objects.values_list('movie_id', flat=True)) == {movie.pk for movie in kept}
+    assert Review.objects.count() == 5 * len(kept)
@@ -1,4 +1,5 @@
 from django.urls import path
+from movies.api import ApiView, AsyncApiView
 from movies.views import *
 
 urlpatterns = [
@@ -10,6 +11,7 @@ urlpatterns = [
     path('movies/<int:pk>/edit/', MovieUpdateView.as_view(), name='movie_edit'),
     path('movies/<int:pk>/delete/', MovieDeleteView.as_view(), name='movie_delete'),
 
+    path('movies/<int:pk>/cast/', CastBulkEditView.as_view(), name='cast_bulk_edit'),
     path('casts/add/', CastCreateView.as_view(), name='cast_add'),
     path('casts/<int:pk>/edit/', CastUpdateView.as_view(), name='cast_edit'),
     path('casts/<int:pk>/delete/', CastDeleteView.as_view(), name='cast_delete'),
@@ -38,4 +40,31 @@ urlpatterns = [
     path('add/', ReviewCreateView.as_view(), name='review_add'),
     path('<int:pk>/edit/', ReviewUpdateView.as_view(), name='review_edit'),
     path('<int:pk>/delete/', ReviewDeleteView.as_view(), name='review_delete'),
+
+    path('leaderboards/top-rated/', TopRatedView.as_view(), name='top_rated'),
+    path('leaderboards/top-rated/<int:pk>/', GenreTopRatedView.as_view(), name='genre_top_rated'),
+    path('leaderboards/trending/', TrendingView.as_view(), name='trending'),
+    path('leaderboards/most-viewed/movies/', MostViewedView.as_view(), name='most_viewed_movies'),
+    path('leaderboards/most-viewed/persons/', MostViewedPersonsView.as_view(), name='most_viewed_persons'),
+
+    path('autocomplete/<str:source>/', AutocompleteView.as_view(), name='autocomplete'),
+    path('export/<slug:entity>.<slug:format>', CatalogExportView.as_view(), name='catalog_export'),
+    path('cache/stats/', DetailCacheStatsView.as_view(), name='detail_cache_stats'),
+    path('debug/perf/', PerfDashboardView.as_view(), name='perf_dashboard'),
+    path('metrics', PerfMetricsView.as_view(), name='perf_metrics'),
+
+    path('api/<slug:resource>/', ApiView.as_view(), name='api_list'),
+    path('api/<slug:resource>/<int:pk>/', ApiView.as_view(), name='api_detail'),
+
+    # Async variants of the read-heavy pages, for deployments served over ASGI.
+    path('async/movies/', AsyncMovieListView.as_view(), name='async_movie_list'),
+    path('async/movies/<int:pk>/', AsyncMovieDetailView.as_view(), name='async_movie_detail'),
+    path('async/genres/', AsyncGenreListView.as_view(), name='async_genre_list'),
+    path('async/persons/', AsyncPersonListView.as_view(), name='async_person_list'),
+    path('async/persons/<int:pk>/', AsyncPersonDetailView.as_view(), name='async_person_detail'),
+    path('async/awards/', AsyncAwardListView.as_view(), name='async_award_list'),
+    path('async/awards/<int:pk>/', AsyncAwardDetailView.as_view(), name='async_award_detail'),
+    path('async/reviews/', AsyncReviewListView.as_view(), name='async_review_list'),
+    path('async/api/<slug:resource>/', AsyncApiView.as_view(), name='async_api_list'),
+    path('async/api/<slug:resource>/<int:pk>/', AsyncApiView.as_view(), name='async_api_detail'),
 ]
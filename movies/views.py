@@ -1,55 +1,125 @@
+import hmac
 import logging
-from django.contrib.auth.mixins import LoginRequiredMixin
-from django.shortcuts import get_object_or_404
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
+from django.db.models import Prefetch
+from django.http import Http404, HttpResponse, JsonResponse, StreamingHttpResponse
+from django.shortcuts import get_object_or_404, redirect
 from django.urls import reverse_lazy
-from django.views.generic import TemplateView, ListView, DetailView, CreateView, UpdateView, DeleteView
-from movies.forms import MovieForm, PersonForm, GenreForm, CastForm, ReviewForm, AwardForm, MovieAwardForm
-from movies.models import Movie, Review, Person, Genre, Cast, Award, MovieAward
+from django.views import View
+from django.views.generic import TemplateView, ListView, DetailView, CreateView, UpdateView, DeleteView, FormView
+from movies.aio import AsyncDetailMixin, AsyncKeysetListMixin
+from movies.autocomplete import SOURCES
+from movies.cache import CachedDetailMixin, detail_cache
+from movies.casting import cast_text, directors_text, edit_cast
+from movies.catalog import ENTITIES, FORMATS, CatalogExporter
+from movies.dashboard import home_sections
+from movies.deletion import DeferredDeleteMixin
+from movies.facets import FacetSelection, clear_url, facet_counts, get_search_limit, toggle_url
+from movies.filmography import filmography
+from movies.forms import MovieForm, PersonForm, GenreForm, CastForm, BulkCastForm, ReviewForm, AwardForm, MovieAwardForm
+from movies.leaderboards import trending_activity, trending_threshold
+from movies.models import Movie, Review, Person, Genre, Cast, Award, MovieAward, MovieNeighbor, MovieScore
+from movies.pagination import InvalidCursor, KeysetPaginationMixin, KeysetPaginator, decode_cursor, encode_cursor
+from movies.perf import recorder
+from movies.popularity import CountViewsMixin
+from movies.routing import get_replica_pool
+from movies.search import get_search_backend
 
 
 class HomeView(TemplateView):
     template_name = 'home.html'
+    query_budget = 5
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        movies = list(Movie.objects.all())
-        context['movies'] = movies
+        context.update(home_sections())
         return context
 
 
-class MovieListView(ListView):
+class MovieListView(KeysetPaginationMixin, ListView):
     model = Movie
     template_name = 'movies/movie_list.html'
     context_object_name = 'movies'
+    # The page, the names of the listed directors and, with q on PostgreSQL, the search matches the facets count;
+    # the facet index is built once per process.
+    query_budget = 3
+    sort_orderings = {
+        'title': ('title', 'pk'),
+        'release_year': ('release_year', 'pk'),
+        'rating': ('-rating_avg', '-rating_count', 'pk'),
+    }
+
+    def ranks_by_relevance(self):
+        return bool(self.request.GET.get('q')) and self.request.GET.get('sort_by') not in self.sort_orderings
+
+    def get_keyset_ordering(self):
+        sort_by = self.request.GET.get('sort_by')
+        return self.sort_orderings.get(sort_by, self.sort_orderings['title'])
+
+    def get_keyset_paginator(self, queryset, page_size):
+        if self.ranks_by_relevance():
+            return get_search_backend().get_paginator(queryset, self.request.GET['q'], page_size)
+        return super().get_keyset_paginator(queryset, page_size)
+
+    def get_selection(self):
+        if not hasattr(self, '_selection'):
+            self._selection = FacetSelection.from_query(self.request.GET)
+        return self._selection
 
     def get_queryset(self):
-        queryset = Movie.objects.all()
+        queryset = self.get_selection().filter(Movie.objects.all())
         query = self.request.GET.get('q')
-        sort_by = self.request.GET.get('sort_by')
 
-        if query:
-            queryset = queryset.filter(title__icontains=query)
-
-        if sort_by == 'release_year':
-            queryset = queryset.order_by('release_year')
+        if query and not self.ranks_by_relevance():
+            queryset = get_search_backend().search(queryset, query)
 
         return queryset
 
+    def get_facets(self):
+        # Counts are narrowed to the text search matches; past MOVIES_FACET_SEARCH_LIMIT of them they are a sample.
+        query = self.request.GET.get('q')
+        within, self.facets_approximate = None, False
+        if query:
+            within, complete = get_search_backend().match_ids(query, get_search_limit())
+            self.facets_approximate = not complete
+        facets = facet_counts(self.get_selection(), within)
+        for facet in facets:
+            for value in facet['values']:
+                value['url'] = toggle_url(self.request.GET, facet['name'], value['value'])
+        return facets
+
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         context['search_query'] = self.request.GET.get('q', '')
+        context['sort_by'] = self.request.GET.get('sort_by', '')
+        context['facets'] = self.get_facets()
+        context['facets_approximate'] = self.facets_approximate
+        context['facets_selected'] = bool(self.get_selection())
+        context['facets_clear_url'] = clear_url(self.request.GET)
         return context
 
 
-class MovieDetailView(DetailView):
+class MovieDetailView(CountViewsMixin, CachedDetailMixin, DetailView):
     model = Movie
     template_name = 'movies/movie_detail.html'
     context_object_name = 'movie'
+    query_budget = 6
 
-    def get_context_data(self, **kwargs):
-        context = super().get_context_data(**kwargs)
-        context['reviews'] = Review.objects.filter(movie=self.object)
-        return context
+    def get_queryset(self):
+        return Movie.objects.select_related('genre').prefetch_related('directors')
+
+    def get_related_querysets(self):
+        return {
+            'cast_list': Cast.objects.filter(movie=self.object, person__pending_delete=False).select_related('person')
+                         .order_by('pk'),
+            'movie_awards': MovieAward.objects.filter(movie=self.object).select_related('award').order_by('pk'),
+            'reviews': Review.objects.filter(movie=self.object).select_related('user').order_by('-created_at'),
+            'also_liked': MovieNeighbor.objects.filter(movie=self.object, neighbor__pending_delete=False)
+                          .select_related('neighbor')
+                          .only('similarity', 'neighbor__title', 'neighbor__release_year').order_by('rank'),
+        }
 
 
 class MovieCreateView(LoginRequiredMixin, CreateView):
@@ -66,7 +136,7 @@ class MovieUpdateView(LoginRequiredMixin, UpdateView):
     success_url = reverse_lazy('movie_list')
 
 
-class MovieDeleteView(LoginRequiredMixin, DeleteView):
+class MovieDeleteView(LoginRequiredMixin, DeferredDeleteMixin, DeleteView):
     model = Movie
     template_name = 'movies/movie_confirm_delete.html'
     success_url = reverse_lazy('movie_list')
@@ -75,15 +145,37 @@ class MovieDeleteView(LoginRequiredMixin, DeleteView):
 logger = logging.getLogger(__name__)
 
 
-class CastCreateView(LoginRequiredMixin, CreateView):
+class MovieFromQueryMixin:
+    """Reads the movie a cast or award row is added to from ?movie=, raising Http404 for unknown or malformed ids."""
+
+    def get_movie(self):
+        if not hasattr(self, 'movie'):
+            movie_id = self.request.GET.get('movie')
+            if movie_id is None:
+                self.movie = None
+            elif movie_id.isdecimal() and len(movie_id) < 10:
+                self.movie = get_object_or_404(Movie, pk=movie_id)
+            else:
+                raise Http404('Invalid movie id.')
+        return self.movie
+
+
+class CastCreateView(LoginRequiredMixin, MovieFromQueryMixin, CreateView):
     model = Cast
     form_class = CastForm
     template_name = 'movies/cast_form.html'
 
+    def get_form(self, form_class=None):
+        # A movie given in the query is fixed before validation, so unique_cast_role is checked against it.
+        form = super().get_form(form_class)
+        movie = self.get_movie()
+        if movie is not None:
+            form.fields['movie'].initial = movie
+            form.fields['movie'].disabled = True
+        return form
+
     def form_valid(self, form):
-        movie_id = self.request.GET.get('movie')
-        logger.debug(f"Creating cast for movie ID: {movie_id}")
-        form.instance.movie = get_object_or_404(Movie, pk=movie_id)
+        logger.debug(f"Creating cast for movie ID: {form.instance.movie_id}")
         return super().form_valid(form)
 
     def get_success_url(self):
@@ -113,10 +205,48 @@ class CastDeleteView(LoginRequiredMixin, DeleteView):
         return reverse_lazy('movie_detail', kwargs={'pk': movie_pk})
 
 
-class GenreListView(ListView):
+class CastBulkEditView(LoginRequiredMixin, FormView):
+    """
+    Edits a movie's whole cast and its directors as pasted text in one POST,
+    saved as a diff against the stored rows (see movies.casting.edit_cast).
+    """
+
+    form_class = BulkCastForm
+    template_name = 'movies/cast_bulk_form.html'
+
+    def get_movie(self):
+        if not hasattr(self, 'movie'):
+            self.movie = get_object_or_404(Movie, pk=self.kwargs['pk'])
+        return self.movie
+
+    def get_initial(self):
+        if self.request.method == 'POST':
+            return {}
+        movie = self.get_movie()
+        return {
+            'cast': cast_text(Cast.objects.filter(movie=movie, person__pending_delete=False).select_related('person')
+                              .order_by('pk')),
+            'directors': directors_text(movie.directors.order_by('last_name', 'first_name', 'pk')),
+        }
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['movie'] = self.get_movie()
+        return context
+
+    def form_valid(self, form):
+        movie = self.get_movie()
+        changes = edit_cast(movie, form.cleaned_data['wanted_cast'], form.cleaned_data['director_ids'])
+        logger.info('Bulk cast edit of movie %s: %s', movie.pk, changes)
+        return redirect('movie_detail', pk=movie.pk)
+
+
+class GenreListView(KeysetPaginationMixin, ListView):
     model = Genre
     template_name = 'movies/genre_list.html'
     context_object_name = 'genres'
+    keyset_ordering = ('name', 'pk')
+    query_budget = 1
 
 
 class GenreCreateView(LoginRequiredMixin, CreateView):
@@ -133,16 +263,18 @@ class GenreUpdateView(LoginRequiredMixin, UpdateView):
     success_url = reverse_lazy('genre_list')
 
 
-class GenreDeleteView(LoginRequiredMixin, DeleteView):
+class GenreDeleteView(LoginRequiredMixin, DeferredDeleteMixin, DeleteView):
     model = Genre
     template_name = 'movies/genre_confirm_delete.html'
     success_url = reverse_lazy('genre_list')
 
 
-class PersonListView(ListView):
+class PersonListView(KeysetPaginationMixin, ListView):
     model = Person
     template_name = 'movies/person_list.html'
     context_object_name = 'persons'
+    keyset_ordering = ('last_name', 'pk')
+    query_budget = 1
 
     def get_queryset(self):
         query = self.request.GET.get('q')
@@ -155,7 +287,7 @@ class PersonListView(ListView):
                 queryset = Person.objects.filter(role__in=['director', 'both'])
         if query:
             queryset = queryset.filter(first_name__icontains=query) | queryset.filter(last_name__icontains=query)
-        return queryset.order_by('last_name')
+        return queryset
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
@@ -185,22 +317,28 @@ class PersonUpdateView(LoginRequiredMixin, UpdateView):
     success_url = reverse_lazy('person_list')
 
 
-class PersonDeleteView(LoginRequiredMixin, DeleteView):
+class PersonDeleteView(LoginRequiredMixin, DeferredDeleteMixin, DeleteView):
     model = Person
     template_name = 'movies/person_confirm_delete.html'
     success_url = reverse_lazy('person_list')
 
 
-class PersonDetailView(DetailView):
+class PersonDetailView(CountViewsMixin, CachedDetailMixin, DetailView):
     model = Person
     template_name = 'movies/person_detail.html'
     context_object_name = 'person'
+    query_budget = 2
 
+    def get_related_querysets(self):
+        return {'credits': filmography(self.object)}
 
-class AwardListView(ListView):
+
+class AwardListView(KeysetPaginationMixin, ListView):
     model = Award
     template_name = 'movies/award_list.html'
     context_object_name = 'awards'
+    keyset_ordering = ('name', 'pk')
+    query_budget = 1
 
 
 class AwardCreateView(LoginRequiredMixin, CreateView):
@@ -223,36 +361,41 @@ class AwardDeleteView(LoginRequiredMixin, DeleteView):
     success_url = reverse_lazy('award_list')
 
 
-class AwardDetailView(DetailView):
+class AwardDetailView(CachedDetailMixin, DetailView):
     model = Award
     template_name = 'movies/award_detail.html'
     context_object_name = 'award'
+    query_budget = 2
+
+    def get_queryset(self):
+        return Award.objects.prefetch_related(
+            Prefetch('movieaward_set', queryset=MovieAward.objects.filter(movie__pending_delete=False)
+                     .select_related('movie').order_by('pk')),
+        )
 
 
-class MovieAwardCreateView(LoginRequiredMixin, CreateView):
+class MovieAwardCreateView(LoginRequiredMixin, MovieFromQueryMixin, CreateView):
     model = MovieAward
     form_class = MovieAwardForm
     template_name = 'movies/movieaward_form.html'
 
-    def get_initial(self):
-        initial = super().get_initial()
-        movie_id = self.request.GET.get('movie')
-        if movie_id:
-            initial['movie'] = get_object_or_404(Movie, pk=movie_id)
-        return initial
+    def get_movie(self):
+        movie = super().get_movie()
+        if movie is None:
+            raise Http404('No movie given.')
+        return movie
+
+    def get_form_kwargs(self):
+        # The movie is set before validation, so MovieAwardForm can check unique_movie_award.
+        kwargs = super().get_form_kwargs()
+        kwargs['instance'] = MovieAward(movie=self.get_movie())
+        return kwargs
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        movie_id = self.request.GET.get('movie')
-        if movie_id:
-            context['movie'] = get_object_or_404(Movie, pk=movie_id)
+        context['movie'] = self.get_movie()
         return context
 
-    def form_valid(self, form):
-        movie_id = self.request.GET.get('movie')
-        form.instance.movie = get_object_or_404(Movie, pk=movie_id)
-        return super().form_valid(form)
-
     def get_success_url(self):
         return reverse_lazy('movie_detail', kwargs={'pk': self.object.movie.pk})
 
@@ -268,11 +411,16 @@ class MovieAwardDeleteView(LoginRequiredMixin, DeleteView):
         return reverse_lazy('movie_detail', kwargs={'pk': movie_pk})
 
 
-class ReviewListView(ListView):
+class ReviewListView(KeysetPaginationMixin, ListView):
     model = Review
     template_name = 'movies/review_list.html'
     context_object_name = 'reviews'
     ordering = ['-created_at']
+    keyset_ordering = ('-created_at', '-pk')
+    query_budget = 1
+
+    def get_queryset(self):
+        return Review.objects.live().select_related('user', 'movie')
 
 
 class ReviewCreateView(LoginRequiredMixin, CreateView):
@@ -302,3 +450,227 @@ class ReviewDeleteView(LoginRequiredMixin, DeleteView):
     model = Review
     template_name = 'movies/review_confirm_delete.html'
     success_url = reverse_lazy('review_list')
+
+
+class TopRatedView(KeysetPaginationMixin, ListView):
+    model = MovieScore
+    template_name = 'movies/leaderboard.html'
+    context_object_name = 'scores'
+    keyset_ordering = ('-bayesian_rating', 'pk')
+    query_budget = 2
+    title = 'Top Rated'
+
+    def get_queryset(self):
+        return MovieScore.objects.filter(movie__pending_delete=False).select_related('movie')
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['title'] = self.title
+        context['genres'] = Genre.objects.order_by('name')
+        return context
+
+
+class GenreTopRatedView(TopRatedView):
+    query_budget = 3
+
+    def get_queryset(self):
+        self.genre = get_object_or_404(Genre, pk=self.kwargs['pk'])
+        return super().get_queryset().filter(genre=self.genre)
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['title'] = f'Top Rated {self.genre.name}'
+        context['current_genre'] = self.genre
+        return context
+
+
+class TrendingView(TopRatedView):
+    keyset_ordering = ('-trending_score', 'pk')
+    title = 'Trending This Week'
+
+    def get_queryset(self):
+        return super().get_queryset().filter(trending_score__gte=trending_threshold())
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        for score in context['scores']:
+            score.activity = trending_activity(score.trending_score)
+        context['trending'] = True
+        return context
+
+
+class MostViewedView(KeysetPaginationMixin, ListView):
+    model = Movie
+    template_name = 'movies/most_viewed.html'
+    context_object_name = 'objects'
+    keyset_ordering = ('-view_count', 'pk')
+    query_budget = 1
+    title = 'Most Viewed Movies'
+
+    def get_queryset(self):
+        # View counts are flushed from each worker's buffer every few seconds, so the ranking trails by as much.
+        return self.model.objects.filter(view_count__gt=0)
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['title'] = self.title
+        context['detail_url'] = f'{self.model._meta.model_name}_detail'
+        return context
+
+
+class MostViewedPersonsView(MostViewedView):
+    model = Person
+    title = 'Most Viewed People'
+
+
+class AutocompleteView(View):
+    default_limit = 10
+    max_limit = 50
+    max_search_results = 200
+
+    def get(self, request, source):
+        if source not in SOURCES:
+            raise Http404('Unknown autocomplete source.')
+        source = SOURCES[source]
+        query = request.GET.get('q', '').strip()
+        cursor = request.GET.get('cursor')
+        try:
+            limit = min(max(int(request.GET.get('limit', self.default_limit)), 1), self.max_limit)
+        except ValueError:
+            limit = self.default_limit
+
+        try:
+            if query:
+                # Ranked matches have no stable sort key to seek on, so their cursor is an offset into the top hits.
+                offset = int(decode_cursor(cursor)[0]) if cursor else 0
+                if not 0 <= offset < self.max_search_results:
+                    raise InvalidCursor(cursor)
+                matches = source.search(query, request.GET, min(offset + limit, self.max_search_results) + 1)
+                results = matches[offset:offset + limit]
+                has_next = len(matches) > offset + limit
+                next_cursor = encode_cursor(offset + limit) if has_next else None
+            else:
+                paginator = KeysetPaginator(source.get_queryset(request.GET), source.ordering, limit)
+                page = paginator.page(cursor)
+                results, next_cursor = page.object_list, page.next_cursor
+        except (InvalidCursor, ValueError, TypeError):
+            return JsonResponse({'error': 'Invalid cursor.'}, status=400)
+
+        return JsonResponse({
+            'results': [{'id': obj.pk, 'text': str(obj)} for obj in results],
+            'next': next_cursor,
+        })
+
+
+class CatalogExportView(UserPassesTestMixin, View):
+    def test_func(self):
+        return self.request.user.is_staff
+
+    def get(self, request, entity, format):
+        if entity not in ENTITIES or format not in FORMATS:
+            raise Http404('Unknown export.')
+        exporter = CatalogExporter()
+        response = StreamingHttpResponse(exporter.render(entity, format), content_type=exporter.content_types[format])
+        response['Content-Disposition'] = f'attachment; filename="{entity}.{format}"'
+        return response
+
+
+class DetailCacheStatsView(UserPassesTestMixin, View):
+    def test_func(self):
+        return self.request.user.is_staff
+
+    def get(self, request):
+        return JsonResponse(detail_cache.stats())
+
+
+class PerfDashboardView(UserPassesTestMixin, TemplateView):
+    template_name = 'movies/perf_dashboard.html'
+
+    def test_func(self):
+        return self.request.user.is_staff
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        routes, statuses = recorder.snapshot()
+        rows = []
+        for route, histograms in routes.items():
+            latency, db = histograms['latency_seconds'], histograms['db_seconds']
+            rows.append({
+                'route': route,
+                'requests': latency.count,
+                'errors': sum(count for (name, status), count in statuses.items() if name == route and status >= 500),
+                'p50_ms': latency.quantile(0.5) * 1000,
+                'p95_ms': latency.quantile(0.95) * 1000,
+                'p99_ms': latency.quantile(0.99) * 1000,
+                'queries': histograms['queries'].mean,
+                'db_ms': db.mean * 1000,
+                'db_total_s': db.sum,
+                'render_ms': histograms['render_seconds'].mean * 1000,
+                'kib': histograms['response_bytes'].mean / 1024,
+            })
+        # The routes spending the most database time overall come first.
+        context['routes'] = sorted(rows, key=lambda row: -row['db_total_s'])
+        context['replicas'] = get_replica_pool().status()
+        return context
+
+
+class PerfMetricsView(View):
+    """Prometheus text exposition of the request histograms, for staff or a bearer MOVIES_METRICS_TOKEN."""
+
+    def get(self, request):
+        token = getattr(settings, 'MOVIES_METRICS_TOKEN', None)
+        bearer = request.headers.get('Authorization', '').removeprefix('Bearer ')
+        if not request.user.is_staff and not (token and hmac.compare_digest(bearer, token)):
+            return HttpResponse(status=403)
+        return HttpResponse(recorder.prometheus(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+class AsyncMovieListView(AsyncKeysetListMixin, MovieListView):
+    async def get(self, request, *args, **kwargs):
+        # Facet counts may build the facet index and look up director names.
+        self.facets = await sync_to_async(super().get_facets)()
+        return await super().get(request, *args, **kwargs)
+
+    def get_facets(self):
+        return self.facets
+
+    async def aget_queryset(self):
+        # The in-memory search backend may have to build its index first.
+        if self.request.GET.get('q'):
+            return await sync_to_async(self.get_queryset)()
+        return self.get_queryset()
+
+    async def aget_keyset_paginator(self, queryset, page_size):
+        if self.ranks_by_relevance():
+            return await sync_to_async(self.get_keyset_paginator)(queryset, page_size)
+        return self.get_keyset_paginator(queryset, page_size)
+
+
+class AsyncGenreListView(AsyncKeysetListMixin, GenreListView):
+    pass
+
+
+class AsyncPersonListView(AsyncKeysetListMixin, PersonListView):
+    pass
+
+
+class AsyncAwardListView(AsyncKeysetListMixin, AwardListView):
+    pass
+
+
+class AsyncReviewListView(AsyncKeysetListMixin, ReviewListView):
+    async def aget_queryset(self):
+        # With sharded reviews, leaving out those of movies pending deletion reads their pks first.
+        return await sync_to_async(self.get_queryset)()
+
+
+class AsyncMovieDetailView(AsyncDetailMixin, MovieDetailView):
+    pass
+
+
+class AsyncPersonDetailView(AsyncDetailMixin, PersonDetailView):
+    pass
+
+
+class AsyncAwardDetailView(AsyncDetailMixin, AwardDetailView):
+    pass
@@ -0,0 +1,65 @@
+from django import forms
+from django.core.exceptions import ValidationError
+from django.urls import reverse
+from django.utils.http import urlencode
+
+
+class AutocompleteSelect(forms.Select):
+    """
+    Renders only the selected options; the rest are fetched on demand from the
+    autocomplete endpoint by autocomplete.js.
+    """
+
+    def __init__(self, source, params=None, attrs=None):
+        super().__init__(attrs)
+        self.source = source
+        self.params = params or {}
+
+    class Media:
+        js = ['autocomplete.js']
+
+    def get_url(self):
+        url = reverse('autocomplete', kwargs={'source': self.source})
+        return f'{url}?{urlencode(self.params)}' if self.params else url
+
+    def build_attrs(self, base_attrs, extra_attrs=None):
+        attrs = super().build_attrs(base_attrs, extra_attrs)
+        attrs['data-autocomplete-url'] = self.get_url()
+        return attrs
+
+    def use_required_attribute(self, initial):
+        # Select peeks at the first choice here, which would run the full choices query.
+        return forms.Widget.use_required_attribute(self, initial)
+
+    def get_selected_keys(self, value):
+        # Submitted values are re-rendered before the field has validated them, so drop any that are not keys at all.
+        field = self.choices.field
+        meta = field.queryset.model._meta
+        key_field = meta.get_field(field.to_field_name) if field.to_field_name else meta.pk
+        keys = []
+        for item in value:
+            if item in (None, ''):
+                continue
+            try:
+                keys.append(key_field.to_python(item))
+            except ValidationError:
+                continue
+        return keys
+
+    def optgroups(self, name, value, attrs=None):
+        selected = self.get_selected_keys(value)
+        options = []
+        if not self.allow_multiple_selected:
+            options.append(self.create_option(name, '', self.choices.field.empty_label or '', not selected, 0))
+        if selected:
+            key = self.choices.field.to_field_name or 'pk'
+            objects = self.choices.queryset.filter(**{f'{key}__in': selected})
+            for index, obj in enumerate(objects, start=len(options)):
+                option_value = self.choices.choice(obj)[0]
+                label = self.choices.field.label_from_instance(obj)
+                options.append(self.create_option(name, option_value, label, True, index))
+        return [(None, options, 0)]
+
+
+class AutocompleteSelectMultiple(AutocompleteSelect, forms.SelectMultiple):
+    pass